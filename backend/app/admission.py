@@ -0,0 +1,220 @@
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+
+from app import metrics
+
+# Admission control in front of the provider-backed routes. At most
+# `max_concurrency` requests hold a provider slot; the rest wait in a bounded
+# priority queue (interactive hints before bulk grading, FIFO within a
+# priority). A request is rejected up front with Overloaded (503 +
+# Retry-After) when the queue is full or its expected wait, estimated from the
+# queue ahead of it and an EWMA of slot hold times, exceeds its deadline; it is
+# also rejected if it is still queued when the deadline passes.
+#
+# Within a priority, slots are shared between tenants (schools) by weighted
+# fair queuing: each request gets a virtual finish tag
+#
+#   start = max(V, last finish of its tenant);  finish = start + 1 / weight
+#
+# where V is the tag of the request most recently admitted, and the queue is
+# served in (priority, finish) order. A tenant with twice the weight gets twice
+# the slots while both are backlogged; an idle tenant's share is used by the
+# others (the scheduler never leaves a slot empty while anyone waits).
+#
+#   LLM_TENANT_WEIGHTS="school-a=3,school-b=1,*=1"
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Seconds a request may wait for a slot, per route
+_QUEUE_DEADLINE = {"generate-hints": 10.0, "grade-quiz": 30.0}
+
+_QUEUE_WAIT = metrics.histogram(
+    "studiebot_llm_queue_wait_seconds", "Time spent waiting for a provider slot", ("route",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+_REJECTED = metrics.counter("studiebot_llm_admission_rejections_total", "Requests shed by admission control", ("route", "reason"))
+_TENANT_WAIT = metrics.histogram(
+    "studiebot_llm_tenant_queue_wait_seconds", "Time spent waiting for a provider slot, per tenant", ("tenant",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+_QUEUE_DEPTH = metrics.gauge("studiebot_llm_queue_depth", "Requests waiting for a provider slot")
+_IN_FLIGHT = metrics.gauge("studiebot_llm_in_flight", "Requests holding a provider slot")
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(f"overloaded ({reason})")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def route_deadline(route: str) -> float:
+    env = os.environ.get(f"LLM_QUEUE_DEADLINE_{route.replace('-', '_').upper()}")
+    return float(env) if env else _QUEUE_DEADLINE.get(route, 10.0)
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for part in (spec or "").split(","):
+        name, sep, value = part.strip().rpartition("=")
+        if not sep or not name:
+            continue
+        try:
+            weight = float(value)
+        except ValueError:
+            continue
+        if weight > 0:
+            weights[name.strip()] = weight
+    return weights
+
+
+class _Waiter:
+    __slots__ = ("event", "admitted", "cancelled")
+
+    def __init__(self):
+        self.event = anyio.Event()
+        self.admitted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        max_queue: int = 256,
+        expected_service: float = 1.0,
+        tenant_weights: Optional[Dict[str, float]] = None,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.ewma_service = expected_service
+        self.tenant_weights = dict(tenant_weights or {})
+        self.default_weight = self.tenant_weights.pop("*", 1.0)
+        self.active = 0
+        self._queue: List[Tuple[int, float, int, _Waiter]] = []
+        self._virtual_time = 0.0
+        self._finish: Dict[str, float] = {}
+        self._queued = 0
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "16")),
+            max_queue=int(os.environ.get("LLM_MAX_QUEUE", "256")),
+            expected_service=float(os.environ.get("LLM_EXPECTED_SERVICE_SECONDS", "1.0")),
+            tenant_weights=parse_weights(os.environ.get("LLM_TENANT_WEIGHTS", "")),
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def weight(self, tenant: str) -> float:
+        return self.tenant_weights.get(tenant, self.default_weight)
+
+    def _tenant_label(self, tenant: str) -> str:
+        # Keep metric cardinality to the configured tenants
+        if tenant == "default" or tenant in self.tenant_weights:
+            return tenant
+        return "other"
+
+    def _finish_tag(self, tenant: str) -> float:
+        start = max(self._virtual_time, self._finish.get(tenant, 0.0))
+        return start + 1.0 / self.weight(tenant)
+
+    def _admit_tag(self, finish: float) -> None:
+        self._virtual_time = max(self._virtual_time, finish)
+        if len(self._finish) > 1024:
+            # Tenants at or behind virtual time carry no credit; forget them
+            self._finish = {t: f for t, f in self._finish.items() if f > self._virtual_time}
+
+    def expected_wait(self, priority: int, finish: float = math.inf) -> float:
+        ahead = sum(1 for p, f, _, w in self._queue if (p, f) <= (priority, finish) and not w.cancelled)
+        return math.ceil((ahead + 1) / self.max_concurrency) * self.ewma_service
+
+    async def acquire(self, route: str, priority: int, deadline: float, tenant: Optional[str] = None) -> None:
+        """Wait for a provider slot until ``deadline`` (seconds from now)."""
+        tenant = tenant or "default"
+        label = self._tenant_label(tenant)
+        finish = self._finish_tag(tenant)
+        if self.active < self.max_concurrency and self._queued == 0:
+            self.active += 1
+            self._finish[tenant] = finish
+            self._admit_tag(finish)
+            _QUEUE_WAIT.observe(0.0, route=route)
+            _TENANT_WAIT.observe(0.0, tenant=label)
+            return
+        if self._queued >= self.max_queue:
+            _REJECTED.inc(route=route, reason="queue_full")
+            raise Overloaded(self.expected_wait(priority, finish), "queue_full")
+        expected = self.expected_wait(priority, finish)
+        if expected > deadline:
+            _REJECTED.inc(route=route, reason="deadline")
+            raise Overloaded(expected, "deadline")
+
+        waiter = _Waiter()
+        heapq.heappush(self._queue, (priority, finish, next(self._seq), waiter))
+        previous = self._finish.get(tenant)
+        self._finish[tenant] = finish
+        self._queued += 1
+        t0 = time.perf_counter()
+        try:
+            with anyio.move_on_after(deadline):
+                await waiter.event.wait()
+        except BaseException:
+            if waiter.admitted:
+                # Cancelled after release() handed us the slot: pass it on
+                self.release()
+            raise
+        finally:
+            if not waiter.admitted:
+                # Timed out or cancelled while queued: leave the slot to others
+                waiter.cancelled = True
+                self._queued -= 1
+                if self._finish.get(tenant) == finish:
+                    # Not served, so the tenant is not charged for it
+                    self._finish[tenant] = max(previous or 0.0, self._virtual_time)
+        waited = time.perf_counter() - t0
+        _QUEUE_WAIT.observe(waited, route=route)
+        _TENANT_WAIT.observe(waited, tenant=label)
+        if not waiter.admitted:
+            _REJECTED.inc(route=route, reason="timeout")
+            raise Overloaded(self.expected_wait(priority), "timeout")
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        if service_time is not None:
+            self.ewma_service = 0.8 * self.ewma_service + 0.2 * service_time
+        while self._queue:
+            _, finish, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            self._admit_tag(finish)
+            # Hand the slot straight to the next waiter
+            waiter.admitted = True
+            self._queued -= 1
+            waiter.event.set()
+            return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, route: str, priority: int, deadline: float, tenant: Optional[str] = None) -> AsyncIterator[None]:
+        await self.acquire(route, priority, deadline, tenant)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - t0)
+
+
+admission = AdmissionController.from_env()
+_QUEUE_DEPTH.set_function(lambda: admission.queue_depth)
+_IN_FLIGHT.set_function(lambda: admission.active)
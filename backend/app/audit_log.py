@@ -0,0 +1,218 @@
+import json
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+# Record for the request currently being handled. Handlers add fields through
+# annotate(); the dict is shared by reference so it survives context copies.
+_CURRENT: ContextVar[Optional[Dict[str, Any]]] = ContextVar("audit_record", default=None)
+
+_STOP = object()
+
+AUDITED_PREFIXES: Tuple[str, ...] = ("/api/llm", "/api/glossary")
+
+
+def annotate(**fields: Any) -> None:
+    rec = _CURRENT.get()
+    if rec is not None:
+        rec.update(fields)
+
+
+class AuditLog:
+    """JSONL writer fed by a bounded queue and drained by a background thread.
+
+    emit() never blocks: when the queue is full the record is dropped and
+    counted in ``dropped``. A record that cannot be written (disk full,
+    permissions) is dropped too and also counted in ``write_errors``; the
+    writer reopens the file for the next record.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_queue: int = 10000,
+        max_bytes: int = 50 * 1024 * 1024,
+        rotate_seconds: float = 24 * 3600,
+        backups: int = 5,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.dropped = 0
+        self.written = 0
+        self.write_errors = 0
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._fh = None
+        self._opened_at = 0.0
+        self._size = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["AuditLog"]:
+        path = os.environ.get("AUDIT_LOG_PATH", "").strip()
+        if not path:
+            return None
+        return cls(
+            path,
+            max_queue=int(os.environ.get("AUDIT_LOG_QUEUE_SIZE", "10000")),
+            max_bytes=int(os.environ.get("AUDIT_LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+            rotate_seconds=float(os.environ.get("AUDIT_LOG_ROTATE_SECONDS", str(24 * 3600))),
+            backups=int(os.environ.get("AUDIT_LOG_BACKUPS", "5")),
+        )
+
+    def emit(self, record: Dict[str, Any]) -> bool:
+        self._ensure_started()
+        try:
+            self._q.put_nowait(record)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def close(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return
+        try:
+            self._q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                item = self._q.get()
+                batch = [item]
+                # Drain whatever is already queued so one flush covers the batch
+                while item is not _STOP and len(batch) < 512:
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                for rec in batch:
+                    if rec is _STOP:
+                        return
+                    self._write(rec)
+                if self._fh is not None:
+                    try:
+                        self._fh.flush()
+                    except OSError:
+                        self._failed()
+        finally:
+            self._close_file()
+
+    def _write(self, rec: Dict[str, Any]) -> None:
+        try:
+            line = (json.dumps(rec, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        except Exception:
+            with self._lock:
+                self.dropped += 1
+            return
+        try:
+            if self._fh is None:
+                self._open()
+            elif self._size + len(line) > self.max_bytes or time.time() - self._opened_at >= self.rotate_seconds:
+                self._rotate()
+            self._fh.write(line)
+        except OSError:
+            # Lose this record, not the writer thread
+            with self._lock:
+                self.dropped += 1
+            self._failed()
+            return
+        self._size += len(line)
+        self.written += 1
+
+    def _failed(self) -> None:
+        with self._lock:
+            self.write_errors += 1
+        self._close_file()
+
+    def _close_file(self) -> None:
+        fh, self._fh = self._fh, None
+        if fh is not None:
+            try:
+                fh.close()
+            except OSError:
+                pass  # buffered lines are lost with the failed file
+
+    def _open(self) -> None:
+        d = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(d, exist_ok=True)
+        self._fh = open(self.path, "ab")
+        self._size = self._fh.tell()
+        self._opened_at = time.time()
+
+    def _rotate(self) -> None:
+        self._fh.close()
+        self._fh = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+
+class AuditMiddleware:
+    """Pure ASGI middleware emitting one audit record per audited request."""
+
+    def __init__(self, app, audit_log: AuditLog, prefixes: Tuple[str, ...] = AUDITED_PREFIXES):
+        self.app = app
+        self.audit_log = audit_log
+        self.prefixes = prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope.get("path", "").startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        record: Dict[str, Any] = {
+            "ts": round(time.time(), 3),
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "client": client[0] if client else None,
+        }
+        token = _CURRENT.set(record)
+        status = {"code": 500}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as exc:
+            record.setdefault("outcome", "exception")
+            record["error"] = type(exc).__name__
+            raise
+        finally:
+            record["status"] = status["code"]
+            record["duration_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            _CURRENT.reset(token)
+            self.audit_log.emit(record)
@@ -0,0 +1,108 @@
+import json
+import os
+from typing import Dict, Optional
+
+from app import metrics
+
+# Request body size limits, enforced while the body streams in. A declared
+# Content-Length over the limit is rejected before anything is read; chunked
+# bodies are counted as they arrive and cut off at the limit. Either way the
+# client gets 413 {"error": "payload_too_large"} and the route never parses it.
+#
+#   MAX_BODY_BYTES=1048576                                   default for all routes
+#   BODY_SIZE_LIMITS="/api/glossary/refresh=4194304,..."     per-path overrides
+
+_REJECTED = metrics.counter("studiebot_body_too_large_total", "Requests rejected for body size", ("path",))
+
+_REJECT_BODY = json.dumps({"error": "payload_too_large"}).encode()
+
+DEFAULT_ROUTE_LIMITS = {
+    "/api/llm/generate-hints": 128 * 1024,
+    "/api/llm/grade-quiz": 256 * 1024,
+    "/api/glossary/refresh": 2 * 1024 * 1024,
+    "/api/glossary/refresh/bulk": 64 * 1024 * 1024,
+    "/api/glossary/upload": 32 * 1024 * 1024,
+}
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    limits: Dict[str, int] = {}
+    for part in (spec or "").split(","):
+        path, sep, value = part.strip().rpartition("=")
+        if sep and path and value.strip().isdigit():
+            limits[path.strip()] = int(value)
+    return limits
+
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app, default_limit: Optional[int] = None, route_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.default_limit = default_limit if default_limit is not None else int(os.environ.get("MAX_BODY_BYTES", str(1024 * 1024)))
+        if route_limits is None:
+            route_limits = dict(DEFAULT_ROUTE_LIMITS)
+            route_limits.update(parse_limits(os.environ.get("BODY_SIZE_LIMITS", "")))
+        self.route_limits = route_limits
+
+    def limit_for(self, path: str) -> int:
+        return self.route_limits.get(path, self.default_limit)
+
+    async def _reject(self, scope, send) -> None:
+        _REJECTED.inc(path=scope["path"])
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(_REJECT_BODY)).encode()), (b"connection", b"close")],
+            }
+        )
+        await send({"type": "http.response.body", "body": _REJECT_BODY})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS"):
+            await self.app(scope, receive, send)
+            return
+        limit = self.limit_for(scope["path"])
+        for k, v in scope.get("headers", ()):
+            if k == b"content-length":
+                try:
+                    declared = int(v)
+                except ValueError:
+                    declared = 0
+                if declared > limit:
+                    await self._reject(scope, send)
+                    return
+                break
+
+        received = 0
+        rejected = False
+        started = False
+
+        async def _receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    rejected = True
+                    if not started:
+                        await self._reject(scope, send)
+                    # The route sees a vanished client and stops reading
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def _send(message):
+            nonlocal started
+            if rejected:
+                return  # we already answered 413
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, _receive, _send)
+        except Exception:
+            # Routes that read the stream themselves raise on the disconnect
+            if not rejected:
+                raise
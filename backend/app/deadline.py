@@ -0,0 +1,67 @@
+import math
+import os
+import time
+from typing import Mapping, Optional
+
+# Request-wide time budget for the LLM routes. Clients may send either
+#
+#   X-Request-Deadline: <unix epoch seconds>   absolute, e.g. 1760000000.5
+#   X-Request-Timeout:  <seconds>              relative to arrival
+#
+# and the server default per route (LLM_REQUEST_TIMEOUT_<ROUTE>) caps both.
+# Queueing, moderation, every provider attempt and the backoff sleeps between
+# them all draw from the same budget.
+
+_DEFAULT_TIMEOUT = {"generate-hints": 15.0, "grade-quiz": 30.0}
+
+# Attempts with less time than this left are not started
+MIN_ATTEMPT_SECONDS = 0.1
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def route_timeout(route: str) -> float:
+    env = os.environ.get(f"LLM_REQUEST_TIMEOUT_{route.replace('-', '_').upper()}")
+    return float(env) if env else _DEFAULT_TIMEOUT.get(route, 15.0)
+
+
+def _parse_seconds(value: Optional[str]) -> Optional[float]:
+    try:
+        out = float((value or "").strip())
+    except ValueError:
+        return None
+    return out if math.isfinite(out) else None
+
+
+class Deadline:
+    def __init__(self, timeout: float, clock=time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + max(0.0, timeout)
+
+    @classmethod
+    def from_headers(cls, headers: Mapping[str, str], route: str) -> "Deadline":
+        timeout = route_timeout(route)
+        absolute = _parse_seconds(headers.get("x-request-deadline"))
+        relative = _parse_seconds(headers.get("x-request-timeout"))
+        if absolute is not None:
+            timeout = min(timeout, absolute - time.time())
+        elif relative is not None:
+            timeout = min(timeout, relative)
+        return cls(timeout)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - self.clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def check(self, needed: float = 0.0) -> None:
+        """Raise DeadlineExceeded unless ``needed`` seconds plus a minimal attempt still fit."""
+        if self.remaining() < needed + MIN_ATTEMPT_SECONDS:
+            raise DeadlineExceeded()
+
+    def cap(self, seconds: float) -> float:
+        return min(seconds, self.remaining())
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional
+
+import anyio
+
+from app import metrics
+from app.admission import Overloaded
+from app.audit_log import annotate
+
+# Graceful drain of provider-backed requests. Once draining starts (SIGTERM,
+# or the lifespan shutting down) /readyz reports not ready so the load
+# balancer stops routing here, new LLM requests get 503, and requests already
+# in flight keep running for up to SHUTDOWN_GRACE_SECONDS. Whatever is still
+# running then is cancelled, answered with 503 and counted as dropped.
+#
+# uvicorn waits for open connections before running lifespan shutdown, so run
+# it with --timeout-graceful-shutdown a little above SHUTDOWN_GRACE_SECONDS.
+
+_DROPPED = metrics.counter("studiebot_drain_dropped_total", "In-flight requests cancelled at shutdown", ("route",))
+_IN_FLIGHT = metrics.gauge("studiebot_drain_in_flight", "Provider-backed requests tracked for drain")
+
+
+class Drain:
+    def __init__(self, grace_seconds: float = 25.0):
+        self.grace_seconds = grace_seconds
+        self.draining = False
+        self.dropped = 0
+        self._started_at: Optional[float] = None
+        self._scopes: Dict[anyio.CancelScope, str] = {}
+        self._begun: Optional[anyio.Event] = None
+
+    @classmethod
+    def from_env(cls) -> "Drain":
+        return cls(float(os.environ.get("SHUTDOWN_GRACE_SECONDS", "25")))
+
+    @property
+    def ready(self) -> bool:
+        return not self.draining
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._scopes)
+
+    def begin(self) -> None:
+        if not self.draining:
+            self.draining = True
+            self._started_at = time.monotonic()
+            if self._begun is not None:
+                self._begun.set()
+
+    def reset(self) -> None:
+        self.draining = False
+        self._started_at = None
+
+    @asynccontextmanager
+    async def track(self, route: str) -> AsyncIterator[None]:
+        if self.draining:
+            raise Overloaded(1.0, "draining")
+        with anyio.CancelScope() as scope:
+            self._scopes[scope] = route
+            try:
+                yield
+            finally:
+                self._scopes.pop(scope, None)
+        if scope.cancelled_caught:
+            self.dropped += 1
+            _DROPPED.inc(route=route)
+            annotate(outcome="dropped_on_shutdown")
+            raise Overloaded(1.0, "draining")
+
+    async def watch(self) -> None:
+        """Run for the app's lifetime; enforces the grace period once draining starts."""
+        self._begun = anyio.Event()
+        if self.draining:
+            self._begun.set()
+        await self._begun.wait()
+        await self.shutdown()
+
+    async def shutdown(self) -> int:
+        """Wait out the grace period for in-flight requests, then cancel the rest.
+
+        Returns the number of requests cancelled.
+        """
+        self.begin()
+        assert self._started_at is not None
+        give_up = self._started_at + self.grace_seconds
+        while self._scopes and time.monotonic() < give_up:
+            await anyio.sleep(0.05)
+        cancelled = 0
+        for scope in list(self._scopes):
+            scope.cancel()
+            cancelled += 1
+        # Let the cancelled handlers unwind and send their 503s
+        while self._scopes:
+            await anyio.sleep(0.01)
+        return cancelled
+
+    def install_signal_handler(self) -> Callable[[], None]:
+        """Start draining on SIGTERM, then hand the signal on to the server.
+
+        Returns a function that restores the previous handler.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return lambda: None
+        loop = asyncio.get_running_loop()
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def _on_sigterm(signum, frame):
+            loop.call_soon_threadsafe(self.begin)
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                signal.signal(signal.SIGTERM, previous or signal.SIG_DFL)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, _on_sigterm)
+        return lambda: signal.signal(signal.SIGTERM, previous if previous is not None else signal.SIG_DFL)
+
+
+drain = Drain.from_env()
+_IN_FLIGHT.set_function(lambda: drain.in_flight)
@@ -0,0 +1,134 @@
+import json
+import math
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+import anyio
+import anyio.to_process
+from anyio.lowlevel import RunVar
+from anyio.streams.memory import MemoryObjectSendStream
+
+from app.glossary_extract import Term, extract_glossary
+
+# Bulk glossary refresh: many chapters per request, extracted in a bounded
+# pool of worker processes so the CPU-bound parsing never runs on the event
+# loop. Small chapters are parsed inline, where shipping them to a worker would
+# cost more than the parse itself.
+#
+#   GLOSSARY_BULK_WORKERS=<cpu count>   worker processes (and parallel chapters)
+#   GLOSSARY_BULK_INLINE_CHARS=20000    chapters up to this size stay in-process
+
+POOL_WORKERS = int(os.environ.get("GLOSSARY_BULK_WORKERS", "0")) or (os.cpu_count() or 2)
+INLINE_CHARS = int(os.environ.get("GLOSSARY_BULK_INLINE_CHARS", "20000"))
+
+# One limiter per event loop, like anyio's own worker pools
+_LIMITER: RunVar[anyio.CapacityLimiter] = RunVar("glossary_bulk_limiter")
+
+
+class BulkItemError(Exception):
+    """A bulk input item that could not be read; reported per item."""
+
+
+def pool_limiter() -> anyio.CapacityLimiter:
+    try:
+        return _LIMITER.get()
+    except LookupError:
+        limiter = anyio.CapacityLimiter(POOL_WORKERS)
+        _LIMITER.set(limiter)
+        return limiter
+
+
+async def extract_in_pool(text: str) -> List[Term]:
+    if len(text) <= INLINE_CHARS:
+        return extract_glossary(text)
+    return await anyio.to_process.run_sync(extract_glossary, text, cancellable=True, limiter=pool_limiter())
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Any]:
+    """Yield one decoded JSON value (or BulkItemError) per non-empty NDJSON line."""
+    buf = bytearray()
+    skipping = False
+
+    def _decode(line: bytes) -> Any:
+        try:
+            return json.loads(line)
+        except ValueError:
+            return BulkItemError("invalid_json")
+
+    async for chunk in chunks:
+        start = 0
+        while True:
+            nl = chunk.find(b"\n", start)
+            if nl < 0:
+                if not skipping:
+                    buf += chunk[start:]
+                    if len(buf) > max_line_bytes:
+                        # Drop the rest of this line as it arrives
+                        skipping = True
+                        buf.clear()
+                        yield BulkItemError("payload_too_large")
+                break
+            if skipping:
+                skipping = False
+            else:
+                buf += chunk[start:nl]
+                if len(buf) > max_line_bytes:
+                    yield BulkItemError("payload_too_large")
+                elif buf.strip():
+                    yield _decode(bytes(buf))
+            buf.clear()
+            start = nl + 1
+    if buf.strip() and not skipping:
+        yield _decode(bytes(buf))
+
+
+async def run_bulk(
+    items: AsyncIterator[Any],
+    handle: Callable[[int, Any], Awaitable[Dict[str, Any]]],
+    results: MemoryObjectSendStream,
+    window: int = 0,
+) -> None:
+    """Run ``handle(index, item)`` concurrently over ``items``; send results as they finish.
+
+    At most ``window`` items are in progress (default: twice the pool size), so
+    a streamed input is read only as fast as it is processed. ``results`` is
+    closed when the run ends. The task group lives in this coroutine, never
+    across a yield, so cancelling the caller cancels the in-flight items.
+    """
+    slots = anyio.Semaphore(window or 2 * POOL_WORKERS)
+
+    async def _one(index: int, item: Any, out) -> None:
+        async with out:
+            try:
+                result = await handle(index, item)
+            finally:
+                slots.release()
+            await out.send(result)
+
+    async with results, anyio.create_task_group() as tg:
+        index = 0
+        async for item in items:
+            await slots.acquire()
+            tg.start_soon(_one, index, item, results.clone())
+            index += 1
+
+
+async def collect_bulk(
+    items: AsyncIterator[Any],
+    handle: Callable[[int, Any], Awaitable[Dict[str, Any]]],
+    window: int = 0,
+) -> List[Dict[str, Any]]:
+    """run_bulk() into a list, in completion order."""
+    send, receive = anyio.create_memory_object_stream(math.inf)
+    await run_bulk(items, handle, send, window)
+    async with receive:
+        return [result async for result in receive]
+
+
+async def aiter_list(values: List[Any]) -> AsyncIterator[Any]:
+    for value in values:
+        yield value
+
+
+def chapter_key(item: Dict[str, Any]) -> Tuple[str, str, str]:
+    return str(item.get("vak", "")), str(item.get("leerjaar", "")), str(item.get("hoofdstuk", ""))
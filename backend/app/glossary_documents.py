@@ -0,0 +1,154 @@
+import importlib.util
+import os
+import tempfile
+import zipfile
+from typing import AsyncIterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+import anyio
+import anyio.to_process
+import anyio.to_thread
+
+from app.glossary_bulk import pool_limiter
+
+# Text from uploaded PDF and DOCX documents, for glossary extraction.
+#
+# The upload is spooled to a temp file and parsed in the bulk worker pool, so
+# neither the document nor its parser lives in the server process. PDFs are
+# read GLOSSARY_PDF_PAGE_BATCH pages per worker call and DOCX bodies
+# GLOSSARY_DOCX_PARAGRAPH_BATCH paragraphs per call, each yielded a batch at a
+# time. A DOCX batch is streamed with iterparse and rescans the body up to its
+# start (a worker cannot resume another's parse), which the caller's character
+# cap keeps bounded. Table rows come out as "| cell | cell |" lines so the
+# extractor's table rules apply.
+
+PDF_PAGE_BATCH = int(os.environ.get("GLOSSARY_PDF_PAGE_BATCH", "10"))
+DOCX_PARAGRAPH_BATCH = int(os.environ.get("GLOSSARY_DOCX_PARAGRAPH_BATCH", "500"))
+COPY_CHUNK = 1024 * 1024
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class DocumentError(Exception):
+    """The upload is not a document we can read; the message is the error code."""
+
+
+def pdf_supported() -> bool:
+    return importlib.util.find_spec("pypdf") is not None
+
+
+def detect_kind(head: bytes) -> Optional[str]:
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "docx"
+    return None
+
+
+async def spool_upload(upload) -> str:
+    """Copy an UploadFile to a named temp file the workers can open; returns its path."""
+    fd, path = tempfile.mkstemp(prefix="glossary-", suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                await anyio.to_thread.run_sync(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def pdf_pages_text(path: str, start: int, stop: int) -> Tuple[int, List[str]]:
+    """Text of pages [start, stop) and the document's page count (runs in a worker)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    total = len(reader.pages)
+    return total, [reader.pages[i].extract_text() or "" for i in range(start, min(stop, total))]
+
+
+def docx_paragraphs(path: str, start: int, stop: int, max_chars: int) -> Tuple[bool, List[str]]:
+    """Top-level paragraphs and table rows [start, stop) of a DOCX body (runs in a worker).
+
+    Returns whether the body may continue past ``stop``, and the texts. Reading
+    ends early once the body is past ``max_chars``.
+    """
+    out: List[str] = []
+    index = chars = 0
+    parts: List[str] = []
+    # One (cells, paragraphs of the open cell) per open table row; a nested
+    # table's rows are flattened into the enclosing cell's text
+    rows: List[Tuple[List[str], List[str]]] = []
+    with zipfile.ZipFile(path) as zf, zf.open("word/document.xml") as f:
+        for event, elem in ElementTree.iterparse(f, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == _W + "tr":
+                    rows.append(([], []))
+                continue
+            text = None
+            if tag == _W + "t":
+                parts.append(elem.text or "")
+            elif tag == _W + "tab":
+                parts.append("\t")
+            elif tag in (_W + "br", _W + "cr"):
+                parts.append("\n")
+            elif tag == _W + "p":
+                paragraph = "".join(parts)
+                parts = []
+                if rows:
+                    rows[-1][1].append(paragraph)
+                else:
+                    text = paragraph
+                elem.clear()
+            elif tag == _W + "tc" and rows:
+                cells, cell = rows[-1]
+                cells.append(" ".join(c for c in cell if c))
+                cell.clear()
+            elif tag == _W + "tr" and rows:
+                cells, _ = rows.pop()
+                if rows:
+                    rows[-1][1].append(" ".join(c for c in cells if c))
+                else:
+                    text = "| " + " | ".join(cells) + " |"
+                elem.clear()
+            if text is None:
+                continue
+            if index >= stop:
+                return True, out
+            if index >= start:
+                out.append(text)
+            index += 1
+            chars += len(text) + 1
+            if chars > max_chars:
+                return False, out
+    return False, out
+
+
+async def iter_document_text(path: str, kind: str, max_chars: int) -> AsyncIterator[str]:
+    """Yield the document's text in pieces, each ending in a line break."""
+    try:
+        if kind == "pdf":
+            start, total = 0, None
+            while total is None or start < total:
+                total, pages = await anyio.to_process.run_sync(
+                    pdf_pages_text, path, start, start + PDF_PAGE_BATCH, cancellable=True, limiter=pool_limiter()
+                )
+                for page in pages:
+                    yield page + "\n"
+                start += PDF_PAGE_BATCH
+        else:
+            start, more = 0, True
+            while more:
+                more, paragraphs = await anyio.to_process.run_sync(
+                    docx_paragraphs, path, start, start + DOCX_PARAGRAPH_BATCH, max_chars, cancellable=True, limiter=pool_limiter()
+                )
+                for paragraph in paragraphs:
+                    yield paragraph + "\n"
+                start += DOCX_PARAGRAPH_BATCH
+    except Exception as exc:
+        # Parser errors come back from the worker as whatever the library raised
+        raise DocumentError("unreadable_document") from exc
@@ -0,0 +1,362 @@
+import hashlib
+import os
+import re
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from app import metrics
+from app.glossary_store import ChapterLRU, memory_budget
+
+# Glossary extraction from chapter text, one line at a time.
+#
+# A chapter may contain a glossary header ("Begrippenlijst", "Woordenlijst:",
+# ...); only lines after the first header count, or every line if there is
+# none. Entries are "Term — definitie", "Term - definitie" or
+# "Term: definitie" lines; if a section has none, a Markdown table whose first
+# row names Begrip/Term and Definitie/Betekenis columns is used instead. Terms
+# are deduplicated case-insensitively, first occurrence wins.
+#
+# GlossaryExtractor is push-based: feed() it chunks of text as they arrive and
+# it returns terms as soon as they are known to be final, holding only the
+# current partial line plus terms whose fate depends on what follows (entries
+# before a header may yet be discarded; table rows are used only if no entry
+# line turns up). Lines longer than GLOSSARY_MAX_LINE_CHARS are skipped.
+#
+# Results are memoized by content digest: sha256 over the extractor version
+# and the text's lines, each followed by "\n", so texts that differ only in
+# their line endings share an entry. The digest is computed while streaming
+# as well, which lets callers recognise a resubmitted chapter either way.
+#
+# Parsing a line (classify_line) is pure; what the line means for the result
+# depends on the lines around it and is decided by a cheap fold. ChapterIndex
+# keeps the per-line parse results of a chapter's last extraction, so after an
+# edit only new or changed lines are parsed again and the fold is replayed,
+# giving exactly the result of a full extraction.
+
+Term = Dict[str, str]
+
+# Bump whenever a change to the parsing rules can change extraction output
+EXTRACTOR_VERSION = "2"
+
+_CACHE_HITS = metrics.counter("studiebot_glossary_extract_cache_hits_total", "Glossary extractions served from the memo cache")
+_CACHE_MISSES = metrics.counter("studiebot_glossary_extract_cache_misses_total", "Glossary extractions that had to parse")
+_CACHE_ENTRIES = metrics.gauge("studiebot_glossary_extract_cache_entries", "Entries in the glossary memo cache")
+
+# Glossary section headers ("Begrippenlijst", "Woordenlijst:", ...)
+_HEADER_PAT = re.compile(r"^(\s*(begrip|begrippen|begrippenlijst|woordenlijst)\s*:?)$", re.I)
+# First separator on a line; a plain character class, so one linear scan
+_HEADER_INITIALS = ("b", "B", "w", "W")
+_DASH_SEPS = re.compile(r"[-—:|]")
+_COLON_SEPS = re.compile(r"[:|]")
+# Line boundaries recognised by str.splitlines()
+_LINE_BREAK = re.compile("\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
+# Longer lines are prose or pasted junk, never a glossary entry
+MAX_LINE_CHARS = int(os.environ.get("GLOSSARY_MAX_LINE_CHARS", "2000"))
+
+
+def _split_at(s: str, seps: "re.Pattern[str]", want: str) -> Optional[Tuple[str, str]]:
+    # Same result as matching ^([^<seps>]+?)\s*<want>\s*(.+)$ on a stripped
+    # line: the first separator must be one of `want`, with text on both sides.
+    m = seps.search(s)
+    if m is None or m.start() == 0 or m.group() not in want:
+        return None
+    term, definition = s[: m.start()].strip(), s[m.end() :].strip()
+    if term and definition:
+        return term, definition
+    return None
+
+
+def parse_line(line: str) -> Optional[Tuple[str, str]]:
+    """Parse one "Term — definitie" or "Term: definitie" line."""
+    s = line.strip()
+    if not s:
+        return None
+    return _split_at(s, _DASH_SEPS, "-—") or _split_at(s, _COLON_SEPS, ":")
+
+
+def _parse_table_row(row: str) -> Optional[Tuple[str, str]]:
+    cols = [c.strip() for c in row.split("|") if c.strip()]
+    if len(cols) >= 2:
+        return cols[0], cols[1]
+    return None
+
+
+def _is_table_header(row: str) -> bool:
+    hdr = row.lower()
+    return ("begrip" in hdr or "term" in hdr) and ("definitie" in hdr or "betekenis" in hdr)
+
+
+# (is_header, entry, has_pipe, is_table_header, table_row)
+LineInfo = Tuple[bool, Optional[Tuple[str, str]], bool, bool, Optional[Tuple[str, str]]]
+
+
+def classify_line(line: str) -> LineInfo:
+    """Everything the extractor needs to know about one line, in isolation."""
+    s = line.strip()
+    pair = (_split_at(s, _DASH_SEPS, "-—") or _split_at(s, _COLON_SEPS, ":")) if s else None
+    pipe = pair is None and "|" in line
+    return (
+        s[:1] in _HEADER_INITIALS and _HEADER_PAT.match(s) is not None,
+        pair,
+        pipe,
+        pipe and _is_table_header(line),
+        _parse_table_row(line) if pipe else None,
+    )
+
+
+class _Section:
+    """Entry and table candidates for the lines after a header (or before any)."""
+
+    __slots__ = ("entries", "table_seen", "table_valid", "table_terms")
+
+    def __init__(self):
+        self.entries = 0
+        self.table_seen = False
+        self.table_valid = False
+        self.table_terms: List[Tuple[str, str]] = []
+
+
+class GlossaryExtractor:
+    def __init__(self, max_line_chars: Optional[int] = None):
+        self.max_line_chars = max_line_chars if max_line_chars is not None else MAX_LINE_CHARS
+        self.chars = 0
+        self._hash = _new_digest(self.max_line_chars)
+        self._parts: List[str] = []
+        self._line_len = 0
+        self._overlong = False
+        self._pending_cr = False
+        self._header_seen = False
+        self._section = _Section()
+        # Entries before a header wait here; the header would discard them
+        self._pre_header: List[Tuple[str, str]] = []
+        self._seen: Set[str] = set()
+
+    def feed(self, chunk: str) -> List[Term]:
+        """Consume the next piece of text; returns the terms it made final."""
+        out: List[Term] = []
+        if not chunk:
+            return out
+        self.chars += len(chunk)
+        pos = 0
+        if self._pending_cr and chunk[0] == "\n":
+            pos = 1  # second half of a "\r\n" split across chunks
+        self._pending_cr = False
+        for m in _LINE_BREAK.finditer(chunk, pos):
+            self._append(chunk, pos, m.start())
+            self._end_line(out)
+            pos = m.end()
+        self._append(chunk, pos, len(chunk))
+        self._pending_cr = chunk[-1] == "\r"
+        return out
+
+    def close(self) -> List[Term]:
+        """Flush the last line and any terms held back until the end."""
+        out: List[Term] = []
+        if self._parts or self._overlong:
+            self._end_line(out)
+        if not self._header_seen:
+            for pair in self._pre_header:
+                self._emit(pair, out)
+        if self._section.entries == 0 and self._section.table_valid:
+            for pair in self._section.table_terms:
+                self._emit(pair, out)
+        self._pre_header = []
+        self._section = _Section()
+        return out
+
+    @property
+    def digest(self) -> str:
+        """Content digest of everything fed so far; final once close() returned."""
+        return self._hash.hexdigest()
+
+    def _append(self, chunk: str, start: int, end: int) -> None:
+        if start == end:
+            return
+        self._hash.update(chunk[start:end].encode("utf-8", "surrogatepass"))
+        if self._overlong:
+            return
+        self._line_len += end - start
+        if self._line_len > self.max_line_chars:
+            self._overlong = True
+            self._parts = []
+        else:
+            self._parts.append(chunk[start:end])
+
+    def _end_line(self, out: List[Term]) -> None:
+        self._hash.update(b"\n")
+        overlong = self._overlong
+        line = "".join(self._parts)
+        self._parts = []
+        self._line_len = 0
+        self._overlong = False
+        if not overlong:
+            self._apply(classify_line(line), out)
+
+    def _emit(self, pair: Tuple[str, str], out: List[Term]) -> None:
+        key = pair[0].lower()
+        if key not in self._seen:
+            self._seen.add(key)
+            out.append({"term": pair[0], "definition": pair[1]})
+
+    def _apply(self, info: LineInfo, out: List[Term]) -> None:
+        is_header, pair, pipe, table_header, row = info
+        if not self._header_seen and is_header:
+            # Only what follows the first header counts
+            self._header_seen = True
+            self._pre_header = []
+            self._section = _Section()
+            return
+        section = self._section
+        if pair:
+            section.entries += 1
+            section.table_terms = []
+            if self._header_seen:
+                self._emit(pair, out)
+            else:
+                self._pre_header.append(pair)
+            return
+        if not pipe:
+            return
+        if not section.table_seen:
+            section.table_seen = True
+            section.table_valid = table_header
+        elif section.table_valid and section.entries == 0:
+            if row:
+                section.table_terms.append(row)
+
+
+def iter_glossary(chunks: Iterable[str], max_line_chars: Optional[int] = None) -> Iterator[Term]:
+    """Yield glossary terms from an iterable of text chunks or lines.
+
+    Line breaks are taken from the text itself, so file objects (lines with
+    their newlines) and arbitrary chunks both work.
+    """
+    extractor = GlossaryExtractor(max_line_chars)
+    for chunk in chunks:
+        yield from extractor.feed(chunk)
+    yield from extractor.close()
+
+
+def extract_glossary(text: str) -> List[Term]:
+    if not text or not isinstance(text, str):
+        return []
+    return list(iter_glossary((text,)))
+
+
+class ChapterIndex:
+    """Per-line parse results of one chapter's last extraction, by line content."""
+
+    def __init__(self, max_line_chars: Optional[int] = None):
+        self.max_line_chars = max_line_chars if max_line_chars is not None else MAX_LINE_CHARS
+        self._lines: Dict[str, LineInfo] = {}
+        self.reparsed = 0
+        self.nbytes = 0
+
+    def extract(self, text: str) -> List[Term]:
+        """Same result as extract_glossary(text); only unseen lines are parsed."""
+        previous = self._lines
+        lines: Dict[str, LineInfo] = {}
+        extractor = GlossaryExtractor(self.max_line_chars)
+        out: List[Term] = []
+        self.reparsed = 0
+        for line in text.splitlines() if isinstance(text, str) else ():
+            extractor.chars += len(line)
+            if len(line) > self.max_line_chars:
+                continue
+            info = lines.get(line) or previous.get(line)
+            if info is None:
+                info = classify_line(line)
+                self.reparsed += 1
+            lines[line] = info
+            extractor._apply(info, out)
+        out.extend(extractor.close())
+        self._lines = lines
+        # The line, plus its parsed pieces and the dict slot holding them
+        self.nbytes = sum(2 * sys.getsizeof(line) for line in lines) + _LINE_OVERHEAD * len(lines)
+        return out
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+
+_LINE_OVERHEAD = 150
+
+
+def diff_terms(old: List[Term], new: List[Term]) -> Dict[str, List[str]]:
+    """Terms added, removed or updated (definition or spelling) between two lists."""
+    before = {t["term"].lower(): t for t in old}
+    after = {t["term"].lower(): t for t in new}
+    return {
+        "added": [t["term"] for k, t in after.items() if k not in before],
+        "removed": [t["term"] for k, t in before.items() if k not in after],
+        "updated": [t["term"] for k, t in after.items() if k in before and before[k] != t],
+    }
+
+
+def _new_digest(max_line_chars: int):
+    return hashlib.sha256(f"glossary:{EXTRACTOR_VERSION}:{max_line_chars}\0".encode())
+
+
+def text_digest(text: str, max_line_chars: Optional[int] = None) -> str:
+    """Digest of ``text`` as GlossaryExtractor.digest would report it."""
+    h = _new_digest(max_line_chars if max_line_chars is not None else MAX_LINE_CHARS)
+    for line in text.splitlines():
+        h.update(line.encode("utf-8", "surrogatepass"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """LRU of extraction results by content digest, bounded by bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = ChapterLRU(max_bytes, "extract")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> Optional[List[Term]]:
+        pairs = self._entries.get(digest)
+        if pairs is None:
+            self.misses += 1
+            _CACHE_MISSES.inc()
+            return None
+        self.hits += 1
+        _CACHE_HITS.inc()
+        # Fresh dicts, so callers cannot alter the cached result
+        return [{"term": t, "definition": d} for t, d in pairs]
+
+    def put(self, digest: str, terms: List[Term]) -> None:
+        if self.max_bytes <= 0:
+            return
+        pairs = tuple((t["term"], t["definition"]) for t in terms)
+        size = _ENTRY_OVERHEAD + sys.getsizeof(pairs) + sum(sys.getsizeof(t) + sys.getsizeof(d) + 56 for t, d in pairs)
+        self._entries.put(digest, pairs, size)
+
+    def clear(self) -> None:
+        self._entries = ChapterLRU(self.max_bytes, "extract")
+        self.hits = self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._entries.bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_ENTRY_OVERHEAD = 200
+
+extraction_cache = ExtractionCache(memory_budget("extract"))
+_CACHE_ENTRIES.set_function(lambda: len(extraction_cache))
+
+
+def extract_glossary_cached(text: str) -> Tuple[str, List[Term]]:
+    """extract_glossary through the memo cache; returns (digest, terms)."""
+    digest = text_digest(text)
+    terms = extraction_cache.get(digest)
+    if terms is None:
+        terms = extract_glossary(text)
+        extraction_cache.put(digest, terms)
+    return digest, terms
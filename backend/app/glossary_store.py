@@ -0,0 +1,378 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from app import metrics
+
+# Storage for extracted glossaries, one entry per (vak, leerjaar, hoofdstuk).
+# Every write bumps the chapter's version; the digest of the text it was
+# extracted from is kept so unchanged resubmissions can be recognised.
+#
+#   GLOSSARY_STORAGE=memory | sqlite:///var/lib/studiebot/glossary.db
+#
+# The in-process default is per worker and lost on restart. With SQLite (WAL
+# mode) all workers on the host share one glossary; reads go through an
+# in-process cache that is revalidated by version, so a hot chapter costs a
+# PRAGMA data_version check and stays in memory until some connection commits.
+#
+# Either way the in-process layer is an LRU bounded by GLOSSARY_MEMORY_BYTES,
+# sized from what each stored chapter actually holds, so junk keys cannot grow a
+# worker without limit. The same budget also covers the per-line indexes and
+# the extraction memo of recently refreshed chapters (see memory_budget). Chapters listed in GLOSSARY_PINNED_CHAPTERS (or pinned
+# at runtime) are never evicted. For the memory store eviction drops the
+# chapter; for SQLite it only drops the cached copy.
+#
+# A stored chapter never changes (a write makes a new version), so it is kept
+# compact: interned term names, one string holding all definitions with an
+# offset array, and the serialized JSON of the term list, built once per
+# version, which GET writes out as is.
+#
+# Each store has an epoch, random per process for the memory store and per
+# database file for SQLite; epoch and chapter version together name one
+# chapter version for as long as the data lives, which is what ETags use.
+
+Key = Tuple[str, str, str]
+Terms = List[Dict[str, str]]
+
+_READS = metrics.counter("studiebot_glossary_store_reads_total", "Glossary chapter reads by where they were served from", ("source",))
+_EVICTIONS = metrics.counter("studiebot_glossary_evictions_total", "Glossary chapters evicted from process memory", ("layer",))
+_BYTES = metrics.gauge("studiebot_glossary_memory_bytes", "Estimated bytes of glossary chapters held in process memory", ("layer",))
+
+_CHAPTER_OVERHEAD = 200
+
+
+def dump_terms(terms: Terms) -> bytes:
+    # Same encoding as Starlette's JSONResponse
+    return json.dumps(terms, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class CompactTerms:
+    """A term list as interned names plus one definition buffer with offsets."""
+
+    __slots__ = ("names", "_definitions", "_offsets")
+
+    def __init__(self, terms: Terms):
+        self.names = tuple(sys.intern(t["term"]) for t in terms)
+        self._definitions = "".join(t["definition"] for t in terms)
+        offsets = array("L", [0])
+        end = 0
+        for t in terms:
+            end += len(t["definition"])
+            offsets.append(end)
+        self._offsets = offsets
+
+    def definition(self, i: int) -> str:
+        return self._definitions[self._offsets[i] : self._offsets[i + 1]]
+
+    def to_list(self) -> Terms:
+        return [{"term": name, "definition": self.definition(i)} for i, name in enumerate(self.names)]
+
+    @property
+    def nbytes(self) -> int:
+        names = sys.getsizeof(self.names) + sum(sys.getsizeof(n) for n in self.names)
+        return names + sys.getsizeof(self._definitions) + sys.getsizeof(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class Chapter:
+    __slots__ = ("compact", "terms_json", "digest", "version")
+
+    def __init__(self, terms: Terms, digest: str, version: int, terms_json: Optional[bytes] = None):
+        self.compact = CompactTerms(terms)
+        self.terms_json = terms_json if terms_json is not None else dump_terms(terms)
+        self.digest = digest
+        self.version = version
+
+    @classmethod
+    def from_json(cls, terms_json: bytes, digest: str, version: int) -> "Chapter":
+        return cls(json.loads(terms_json), digest, version, terms_json)
+
+    @property
+    def terms(self) -> Terms:
+        """A fresh list of term dicts; GET serves terms_json instead."""
+        return self.compact.to_list()
+
+    def __len__(self) -> int:
+        return len(self.compact)
+
+
+def chapter_bytes(chapter: Chapter) -> int:
+    return _CHAPTER_OVERHEAD + chapter.compact.nbytes + sys.getsizeof(chapter.terms_json)
+
+
+def parse_pinned(spec: str) -> List[Key]:
+    """Parse "vak/leerjaar/hoofdstuk,..." into chapter keys."""
+    keys = []
+    for item in spec.split(","):
+        parts = [p.strip() for p in item.split("/")]
+        if len(parts) == 3 and all(parts):
+            keys.append((parts[0], parts[1], parts[2]))
+    return keys
+
+
+class ChapterLRU:
+    """Values per chapter (or any key) in LRU order within a byte budget; pinned keys stay."""
+
+    def __init__(self, max_bytes: int, layer: str, pinned: Iterable[Hashable] = ()):
+        self.max_bytes = max_bytes
+        self.layer = layer
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._pinned: Set[Hashable] = set(pinned)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            self._trim(keep=key)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+                _BYTES.set(self.bytes, layer=self.layer)
+
+    def pin(self, key: Hashable) -> None:
+        with self._lock:
+            self._pinned.add(key)
+
+    def unpin(self, key: Hashable) -> None:
+        with self._lock:
+            self._pinned.discard(key)
+            self._trim()
+
+    def _trim(self, keep: Optional[Hashable] = None) -> None:
+        # Oldest first, skipping pinned chapters and the one just written
+        if self.bytes > self.max_bytes:
+            for key in list(self._entries):
+                if self.bytes <= self.max_bytes:
+                    break
+                if key == keep or key in self._pinned:
+                    continue
+                self.bytes -= self._entries.pop(key)[1]
+                self.evictions += 1
+                _EVICTIONS.inc(layer=self.layer)
+        _BYTES.set(self.bytes, layer=self.layer)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _memory_bytes() -> int:
+    return int(os.environ.get("GLOSSARY_MEMORY_BYTES", str(64 * 1024 * 1024)))
+
+
+# Shares of GLOSSARY_MEMORY_BYTES per in-process layer
+_LAYER_SHARES = {"store": 0.75, "index": 0.125, "extract": 0.125}
+
+
+def memory_budget(layer: str) -> int:
+    """Bytes of GLOSSARY_MEMORY_BYTES for one layer: "store", "index" or "extract"."""
+    return int(_memory_bytes() * _LAYER_SHARES[layer])
+
+
+def _pinned_from_env() -> List[Key]:
+    return parse_pinned(os.environ.get("GLOSSARY_PINNED_CHAPTERS", ""))
+
+
+class MemoryGlossaryStore:
+    """Per-process chapters in a byte-bounded LRU; evicted chapters are gone."""
+
+    blocking = False  # cheap enough to call on the event loop
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, pinned: Iterable[Key] = ()):
+        self.epoch = os.urandom(6).hex()
+        self.chapters = ChapterLRU(max_bytes, "store", pinned)
+        self._lock = threading.Lock()
+        # One clock for all chapters, so a chapter evicted and written again
+        # never reuses a version
+        self._clock = 0
+
+    def get(self, key: Key) -> Optional[Chapter]:
+        return self.chapters.get(key)
+
+    def version(self, key: Key) -> int:
+        chapter = self.chapters.get(key)
+        return chapter.version if chapter else 0
+
+    def put(self, key: Key, terms: Terms, digest: str) -> Chapter:
+        with self._lock:
+            self._clock += 1
+            chapter = Chapter(terms, digest, self._clock)
+            self.chapters.put(key, chapter, chapter_bytes(chapter))
+        return chapter
+
+    def pin(self, key: Key) -> None:
+        self.chapters.pin(key)
+
+    def unpin(self, key: Key) -> None:
+        self.chapters.unpin(key)
+
+
+class SQLiteGlossaryStore:
+    """Chapters in a SQLite file shared by every worker on the host."""
+
+    blocking = True
+
+    def __init__(self, path: str, busy_timeout_ms: int = 2000):
+        self.path = path
+        self._local = threading.local()
+        self._busy_timeout_ms = busy_timeout_ms
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO glossary_meta (name, value) VALUES ('epoch', ?)", (os.urandom(6).hex(),))
+        self.epoch = conn.execute("SELECT value FROM glossary_meta WHERE name = 'epoch'").fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # The primary key is the (vak, leerjaar, hoofdstuk) index
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS glossary_chapters ("
+                "vak TEXT NOT NULL, leerjaar TEXT NOT NULL, hoofdstuk TEXT NOT NULL, "
+                "version INTEGER NOT NULL, digest TEXT NOT NULL, terms TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (vak, leerjaar, hoofdstuk)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS glossary_meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def data_version(self) -> int:
+        """Changes whenever another connection commits (this thread's connection)."""
+        return self._conn().execute("PRAGMA data_version").fetchone()[0]
+
+    def get(self, key: Key) -> Optional[Chapter]:
+        row = self._conn().execute(
+            "SELECT terms, digest, version FROM glossary_chapters WHERE vak = ? AND leerjaar = ? AND hoofdstuk = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        return Chapter.from_json(row[0].encode("utf-8"), row[1], row[2])
+
+    def version(self, key: Key) -> int:
+        row = self._conn().execute(
+            "SELECT version FROM glossary_chapters WHERE vak = ? AND leerjaar = ? AND hoofdstuk = ?", key
+        ).fetchone()
+        return row[0] if row else 0
+
+    def put(self, key: Key, terms: Terms, digest: str) -> Chapter:
+        chapter = Chapter(terms, digest, 0)  # serialized outside the write lock
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            chapter.version = self.version(key) + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO glossary_chapters (vak, leerjaar, hoofdstuk, version, digest, terms, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, chapter.version, digest, chapter.terms_json.decode("utf-8"), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return chapter
+
+
+class CachedGlossaryStore:
+    """Read-through cache over a shared store, revalidated by chapter version.
+
+    A cached chapter is trusted while no connection has committed since it was
+    last validated (PRAGMA data_version, seen from each thread's connection);
+    after a commit it is checked against the stored version and reloaded only
+    if that changed.
+    """
+
+    blocking = True
+
+    def __init__(self, backend: SQLiteGlossaryStore, max_bytes: int = 64 * 1024 * 1024, pinned: Iterable[Key] = ()):
+        self.backend = backend
+        self.epoch = backend.epoch
+        # (chapter, generation it was validated in)
+        self.cache = ChapterLRU(max_bytes, "cache", pinned)
+        self._generation = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _current_generation(self) -> int:
+        seen = self.backend.data_version()
+        if getattr(self._local, "data_version", None) != seen:
+            self._local.data_version = seen
+            with self._lock:
+                self._generation += 1
+        return self._generation
+
+    def get(self, key: Key) -> Optional[Chapter]:
+        generation = self._current_generation()
+        cached = self.cache.get(key)
+        if cached is not None:
+            chapter, validated = cached
+            if validated == generation:
+                _READS.inc(source="memory")
+                return chapter
+            if self.backend.version(key) == chapter.version:
+                self.cache.put(key, (chapter, generation), chapter_bytes(chapter))
+                _READS.inc(source="revalidated")
+                return chapter
+        chapter = self.backend.get(key)
+        _READS.inc(source="db")
+        if chapter is None:
+            self.cache.pop(key)
+        else:
+            self.cache.put(key, (chapter, generation), chapter_bytes(chapter))
+        return chapter
+
+    def version(self, key: Key) -> int:
+        """The chapter's version, without loading its terms on a cache miss."""
+        generation = self._current_generation()
+        cached = self.cache.get(key)
+        if cached is not None and cached[1] == generation:
+            return cached[0].version
+        return self.backend.version(key)
+
+    def put(self, key: Key, terms: Terms, digest: str) -> Chapter:
+        generation = self._generation
+        chapter = self.backend.put(key, terms, digest)
+        self.cache.put(key, (chapter, generation), chapter_bytes(chapter))
+        return chapter
+
+    def pin(self, key: Key) -> None:
+        self.cache.pin(key)
+
+    def unpin(self, key: Key) -> None:
+        self.cache.unpin(key)
+
+
+def store_from_env():
+    url = os.environ.get("GLOSSARY_STORAGE", "").strip()
+    if not url or url == "memory":
+        return MemoryGlossaryStore(memory_budget("store"), _pinned_from_env())
+    if url.startswith("sqlite:///"):
+        return CachedGlossaryStore(SQLiteGlossaryStore(url[len("sqlite:///") :]), memory_budget("store"), _pinned_from_env())
+    raise ValueError(f"unsupported GLOSSARY_STORAGE: {url}")
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+
+from app import metrics
+from app.rate_limiter import get_remote_address, header, limiter
+
+# Idempotency-Key support for the LLM POST routes. The first request with a
+# given key runs normally and, if the route marked it as a real success with
+# mark_storable(), its response is stored for a TTL; a retry
+# with the same key and body gets the stored response back (with
+# "Idempotent-Replayed: true") instead of a second provider call. A duplicate
+# that arrives while the original is still running waits for it. Reusing a key
+# with a different body is rejected with 422.
+#
+# Keys are scoped per client (signed student or IP) and route. Storage is an
+# in-process LRU by default, or a SQLite file shared by all workers:
+#
+#   IDEMPOTENCY_STORAGE=memory | sqlite:///var/lib/studiebot/idempotency.db
+
+_REPLAYED = metrics.counter("studiebot_idempotency_replays_total", "Responses served from the idempotency store", ("path",))
+_CONFLICTS = metrics.counter("studiebot_idempotency_conflicts_total", "Idempotency keys rejected", ("path", "reason"))
+
+# Set by a route on a response worth replaying; stripped before it is sent.
+# Fallback answers (provider errors, moderation blocks) are 200s too, but a
+# retry should get a fresh attempt rather than the stored fallback.
+STORE_HEADER = "x-idempotent-store"
+
+
+def mark_storable(response) -> None:
+    response.headers[STORE_HEADER] = "1"
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class Entry:
+    __slots__ = ("fingerprint", "status", "headers", "body", "expires_at")
+
+    def __init__(self, fingerprint: str, expires_at: float, status: Optional[int] = None, headers: Optional[Headers] = None, body: bytes = b""):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.status = status  # None while the original request is in flight
+        self.headers = headers or []
+        self.body = body
+
+
+class MemoryIdempotencyStore:
+    """Per-process LRU bounded by entry count, with per-entry expiry."""
+
+    blocking = False  # cheap enough to call on the event loop
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, fingerprint: str, now: float, lock_seconds: float) -> Optional[Entry]:
+        """Return the live entry for ``key``, or reserve it for the caller and return None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                return entry
+            self._entries[key] = Entry(fingerprint, now + lock_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return None
+
+    def complete(self, key: str, status: int, headers: Headers, body: bytes, expires_at: float) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.status, entry.headers, entry.body, entry.expires_at = status, headers, body, expires_at
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.status is None:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteIdempotencyStore:
+    """Entries in a SQLite file so every worker on the host sees the same keys."""
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = 100_000, sweep_interval: float = 60.0, busy_timeout_ms: int = 2000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._busy_timeout_ms = busy_timeout_ms
+        self._conn()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, status INTEGER, "
+                "headers TEXT, body BLOB, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires_at)")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key: str, fingerprint: str, now: float, lock_seconds: float) -> Optional[Entry]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT fingerprint, status, headers, body, expires_at FROM idempotency WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, fingerprint, status, headers, body, expires_at) VALUES (?, ?, NULL, NULL, NULL, ?)",
+                    (key, fingerprint, now + lock_seconds),
+                )
+            if now >= self._next_sweep:
+                self._next_sweep = now + self._sweep_interval
+                conn.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+                conn.execute(
+                    "DELETE FROM idempotency WHERE key IN (SELECT key FROM idempotency ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        fp, status, headers, body, expires_at = row
+        decoded = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in json.loads(headers)] if headers else []
+        return Entry(fp, expires_at, status, decoded, bytes(body or b""))
+
+    def complete(self, key: str, status: int, headers: Headers, body: bytes, expires_at: float) -> None:
+        encoded = json.dumps([(k.decode("latin-1"), v.decode("latin-1")) for k, v in headers])
+        self._conn().execute(
+            "UPDATE idempotency SET status = ?, headers = ?, body = ?, expires_at = ? WHERE key = ?",
+            (status, encoded, body, expires_at, key),
+        )
+
+    def release(self, key: str) -> None:
+        self._conn().execute("DELETE FROM idempotency WHERE key = ? AND status IS NULL", (key,))
+
+
+def store_from_env():
+    url = os.environ.get("IDEMPOTENCY_STORAGE", "").strip()
+    max_entries = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+    if not url or url == "memory":
+        return MemoryIdempotencyStore(max_entries)
+    if url.startswith("sqlite:///"):
+        return SQLiteIdempotencyStore(url[len("sqlite:///") :], max_entries=max_entries)
+    raise ValueError(f"unsupported IDEMPOTENCY_STORAGE: {url}")
+
+
+def _json_response(status: int, payload: dict, extra: Optional[Headers] = None):
+    body = json.dumps(payload).encode()
+    start = {
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *(extra or [])],
+    }
+    return start, {"type": "http.response.body", "body": body}
+
+
+def _strip_mark(send):
+    mark = STORE_HEADER.encode()
+
+    async def _send(message):
+        if message["type"] == "http.response.start":
+            message = dict(message, headers=[(k, v) for k, v in message.get("headers", []) if bytes(k).lower() != mark])
+        await send(message)
+
+    return _send
+
+
+class IdempotencyMiddleware:
+    """Stores and replays responses for POSTs that carry an Idempotency-Key."""
+
+    def __init__(
+        self,
+        app,
+        store=None,
+        paths=("/api/llm/generate-hints", "/api/llm/grade-quiz"),
+        ttl: Optional[float] = None,
+        wait_seconds: Optional[float] = None,
+        lock_seconds: Optional[float] = None,
+        max_response_bytes: int = 256 * 1024,
+    ):
+        self.app = app
+        self.store = store if store is not None else store_from_env()
+        self.paths = frozenset(paths)
+        self.ttl = ttl if ttl is not None else float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600"))
+        # How long a duplicate waits for the original before giving up with 409
+        self.wait_seconds = wait_seconds if wait_seconds is not None else float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "30"))
+        # An in-flight claim lapses after this, e.g. if its worker died
+        self.lock_seconds = lock_seconds if lock_seconds is not None else float(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "120"))
+        self.max_response_bytes = max_response_bytes
+        self.clock = time.time
+        # Set when a key claimed by this process completes, so duplicates in
+        # the same worker wake at once instead of polling the store
+        self._inflight: Dict[str, anyio.Event] = {}
+
+    async def _store(self, method: str, *args):
+        fn = getattr(self.store, method)
+        if getattr(self.store, "blocking", True):
+            return await anyio.to_thread.run_sync(fn, *args)
+        return fn(*args)
+
+    def _scoped_key(self, scope, key: str) -> str:
+        who = limiter.identify(scope)
+        client = f"student:{who.school or ''}/{who.student}" if who is not None else f"ip:{get_remote_address(scope)}"
+        return hashlib.sha256(f"{client}|{scope['path']}|{key}".encode()).hexdigest()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = header(scope, b"idempotency-key")
+        if key is None:
+            await self.app(scope, receive, _strip_mark(send))
+            return
+        path = scope["path"]
+        if len(key) > 255:
+            _CONFLICTS.inc(path=path, reason="invalid")
+            for message in _json_response(400, {"error": "invalid_idempotency_key"}):
+                await send(message)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        store_key = self._scoped_key(scope, key)
+
+        give_up = self.clock() + self.wait_seconds
+        poll = 0.05
+        while True:
+            entry = await self._store("claim", store_key, fingerprint, self.clock(), self.lock_seconds)
+            if entry is None:
+                break
+            if entry.fingerprint != fingerprint:
+                _CONFLICTS.inc(path=path, reason="reused")
+                for message in _json_response(422, {"error": "idempotency_key_reused"}):
+                    await send(message)
+                return
+            if entry.status is not None:
+                _REPLAYED.inc(path=path)
+                await send({"type": "http.response.start", "status": entry.status, "headers": entry.headers + [(b"idempotent-replayed", b"true")]})
+                await send({"type": "http.response.body", "body": entry.body})
+                return
+            if self.clock() >= give_up:
+                _CONFLICTS.inc(path=path, reason="in_progress")
+                for message in _json_response(409, {"error": "idempotency_in_progress"}, [(b"retry-after", b"1")]):
+                    await send(message)
+                return
+            done = self._inflight.get(store_key)
+            if done is not None:
+                with anyio.move_on_after(give_up - self.clock()):
+                    await done.wait()
+            else:
+                # Claimed by another worker: poll its shared entry, backing off
+                await anyio.sleep(min(poll, max(0.0, give_up - self.clock())))
+                poll = min(poll * 2, 0.5)
+
+        done = self._inflight[store_key] = anyio.Event()
+        replayed = False
+
+        async def _receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status: Optional[int] = None
+        headers: Headers = []
+        storable = False
+        out: List[bytes] = []
+        size = 0
+        finished = False
+        mark = STORE_HEADER.encode()
+
+        async def _send(message):
+            nonlocal status, headers, storable, size, finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [(bytes(k), bytes(v)) for k, v in message.get("headers", [])]
+                storable = any(k.lower() == mark for k, _ in headers)
+                if storable:
+                    headers = [(k, v) for k, v in headers if k.lower() != mark]
+                    message = dict(message, headers=headers)
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= self.max_response_bytes:
+                    out.append(chunk)
+                if not message.get("more_body", False):
+                    finished = True
+            await send(message)
+
+        stored = False
+        try:
+            await self.app(scope, _receive, _send)
+            # Only marked successes are kept; errors, fallbacks and sheds stay retryable
+            if finished and storable and status is not None and 200 <= status < 300 and size <= self.max_response_bytes:
+                with anyio.CancelScope(shield=True):
+                    await self._store("complete", store_key, status, headers, b"".join(out), self.clock() + self.ttl)
+                stored = True
+        finally:
+            if not stored:
+                with anyio.CancelScope(shield=True):
+                    await self._store("release", store_key)
+            if self._inflight.get(store_key) is done:
+                del self._inflight[store_key]
+            done.set()
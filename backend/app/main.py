@@ -1,13 +1,23 @@
+import math
 import os
+from contextlib import asynccontextmanager
+
+import anyio
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 
+from app import metrics
+from app.admission import Overloaded
+from app.audit_log import AuditLog, AuditMiddleware
+from app.body_limit import BodySizeLimitMiddleware
+from app.drain import drain
+from app.idempotency import IdempotencyMiddleware
 from app.routers.llm import router as llm_router
 from app.routers.glossary import router as glossary_router
-from app.rate_limiter import limiter
+from app.rate_limiter import RateLimitMiddleware, limiter
+from app.token_budget import TokenBudgetExceeded
+from app.usage import accountant
 
 
 def get_cors_origins():
@@ -17,10 +27,57 @@ def get_cors_origins():
     return [o.strip() for o in raw.split(",") if o.strip()]
 
 
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    drain.reset()
+    accountant.start()
+    restore_signal = drain.install_signal_handler()
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(drain.watch)
+        yield
+        # Drain provider calls first, then stop the writers they feed
+        await drain.shutdown()
+        tg.cancel_scope.cancel()
+    restore_signal()
+    audit_log = getattr(app.state, "audit_log", None)
+    if audit_log is not None:
+        await anyio.to_thread.run_sync(audit_log.close)
+    await anyio.to_thread.run_sync(accountant.close)
+
+
 def create_app() -> FastAPI:
-    app = FastAPI(title="Studiebot Backend", version="1.0.0")
+    app = FastAPI(title="Studiebot Backend", version="1.0.0", lifespan=_lifespan)
     app.state.limiter = limiter
 
+    # Replays stored responses for retried LLM POSTs carrying Idempotency-Key.
+    # Innermost, so duplicates are still rate limited like any request.
+    app.add_middleware(IdempotencyMiddleware)
+
+    # Body size limits per route (413 {"error": "payload_too_large"}), checked
+    # while the body streams in and before idempotency buffers it.
+    app.add_middleware(BodySizeLimitMiddleware)
+
+    # Rate limiting (one check per request; 429 {"error": "rate_limited"}).
+    # Added before CORS so rejections still carry CORS headers.
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+    # Token budget exhausted: same contract as the request-rate limit
+    @app.exception_handler(TokenBudgetExceeded)
+    def _token_budget_handler(request: Request, exc: TokenBudgetExceeded):  # type: ignore
+        return JSONResponse(
+            status_code=429,
+            content={"error": "rate_limited"},
+            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+        )
+
+    @app.exception_handler(Overloaded)
+    def _overloaded_handler(request: Request, exc: Overloaded):  # type: ignore
+        return JSONResponse(
+            status_code=503,
+            content={"error": "overloaded"},
+            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+        )
+
     # CORS
     app.add_middleware(
         CORSMiddleware,
@@ -28,15 +85,32 @@ def create_app() -> FastAPI:
         allow_credentials=False,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "Retry-After", "Idempotent-Replayed", "ETag"],
     )
 
-    # Rate limiting middleware
-    app.add_middleware(SlowAPIMiddleware)
+    # Structured audit log (enabled when AUDIT_LOG_PATH is set). Added last so
+    # it is the outermost layer and also records rate-limited requests.
+    audit_log = AuditLog.from_env()
+    app.state.audit_log = audit_log
+    if audit_log is not None:
+        app.add_middleware(AuditMiddleware, audit_log=audit_log)
+        metrics.gauge(
+            "studiebot_audit_dropped_records", "Audit records dropped because the queue was full"
+        ).set_function(lambda: audit_log.dropped)
+        metrics.gauge(
+            "studiebot_audit_write_errors", "Audit log writes that failed (the records are dropped)"
+        ).set_function(lambda: audit_log.write_errors)
+
+    @app.get("/metrics", include_in_schema=False)
+    def _metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-    # Exception handler for rate limit
-    @app.exception_handler(RateLimitExceeded)
-    def _rate_limit_handler(request: Request, exc: RateLimitExceeded):  # type: ignore
-        return JSONResponse(status_code=429, content={"error": "rate_limited"})
+    # Readiness for the load balancer; false as soon as a drain starts
+    @app.get("/readyz", include_in_schema=False)
+    def _readyz():
+        if not drain.ready:
+            return JSONResponse(status_code=503, content={"ready": False, "in_flight": drain.in_flight})
+        return {"ready": True}
 
     # Mount routers
     app.include_router(llm_router, prefix="/api/llm", tags=["llm"])
@@ -1,10 +1,16 @@
-from typing import List, Optional
+from typing import Annotated, List, Optional
 from pydantic import BaseModel, Field
 
+# Field caps; the body-size middleware rejects grossly oversized requests first
+MAX_TOPIC_CHARS = 200
+MAX_TEXT_CHARS = 20_000
+MAX_ANSWERS = 50
+MAX_ANSWER_CHARS = 2_000
+
 
 class GenerateHintsIn(BaseModel):
-    topicId: str
-    text: str
+    topicId: str = Field(max_length=MAX_TOPIC_CHARS)
+    text: str = Field(max_length=MAX_TEXT_CHARS)
 
 
 class GenerateHintsOut(BaseModel):
@@ -15,7 +21,7 @@ class GenerateHintsOut(BaseModel):
 
 
 class GradeQuizIn(BaseModel):
-    answers: List[str]
+    answers: List[Annotated[str, Field(max_length=MAX_ANSWER_CHARS)]] = Field(max_length=MAX_ANSWERS)
 
 
 class GradeQuizOut(BaseModel):
@@ -0,0 +1,19 @@
+import os
+
+
+def openai_client():
+    """Build the provider client, honouring cassette and fault-injection settings."""
+    from app.providers import cassette, faults
+
+    mode = cassette.mode_from_env()
+    if mode == "replay":
+        return faults.wrap_from_env(cassette.replay_client_from_env())
+
+    from openai import OpenAI
+
+    # Retries and timeouts belong to the routers, which bound them by the
+    # request deadline; the SDK's own would outlive an abandoned call.
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+    if mode == "record":
+        client = cassette.recording_client_from_env(client)
+    return faults.wrap_from_env(client)
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Record/replay of provider calls.
+#
+#   LLM_CASSETTE_MODE=record  wraps the real client and appends every call
+#                             (request, response or error, elapsed time) to
+#                             LLM_CASSETTE_PATH as one JSON object per line.
+#   LLM_CASSETTE_MODE=replay  serves those interactions offline, sleeping for
+#                             the recorded latency times LLM_CASSETTE_LATENCY_SCALE.
+#
+# Replay matches on the endpoint plus a hash of the request kwargs
+# (LLM_CASSETTE_MATCH=request, the default) or on the endpoint alone
+# (LLM_CASSETTE_MATCH=endpoint), cycling through matches in recorded order.
+
+_CASSETTES: Dict[str, "Cassette"] = {}
+_CASSETTES_LOCK = threading.Lock()
+
+
+class CassetteMiss(LookupError):
+    pass
+
+
+class ReplayedProviderError(Exception):
+    """Raised in replay for an interaction that failed when it was recorded."""
+
+    def __init__(self, error_type: str, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.status_code = status_code
+
+
+def mode_from_env() -> str:
+    return os.environ.get("LLM_CASSETTE_MODE", "").strip().lower()
+
+
+def _to_jsonable(obj: Any) -> Any:
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, dict):
+        return {str(k): _to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_jsonable(v) for v in obj]
+    dump = getattr(obj, "model_dump", None)
+    if callable(dump):
+        return _to_jsonable(dump())
+    if hasattr(obj, "__dict__"):
+        return {k: _to_jsonable(v) for k, v in vars(obj).items() if not k.startswith("_")}
+    return str(obj)
+
+
+# Per-call transport options that vary between runs and say nothing about the request.
+_TRANSPORT_KWARGS = ("timeout",)
+
+
+def _request_fields(request: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in request.items() if k not in _TRANSPORT_KWARGS}
+
+
+def request_key(endpoint: str, request: Dict[str, Any]) -> str:
+    request = _request_fields(request)
+    raw = json.dumps([endpoint, _to_jsonable(request)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class Record(dict):
+    """Replayed payload readable both as a dict and through attributes."""
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return _wrap(self[name])
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, name):
+        return _wrap(dict.__getitem__(self, name))
+
+    def get(self, name, default=None):
+        return _wrap(dict.get(self, name, default))
+
+
+def _wrap(v: Any) -> Any:
+    if isinstance(v, dict) and not isinstance(v, Record):
+        return Record(v)
+    if isinstance(v, list):
+        return [_wrap(x) for x in v]
+    return v
+
+
+class Cassette:
+    def __init__(self, path: str, match: str = "request"):
+        self.path = path
+        self.match = match
+        self.interactions: List[Dict[str, Any]] = []
+        self._by_key: Dict[Tuple[str, str], List[int]] = {}
+        self._cursor: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for ln in f:
+                if ln.strip():
+                    self._index(json.loads(ln))
+
+    def _index(self, it: Dict[str, Any]) -> None:
+        i = len(self.interactions)
+        self.interactions.append(it)
+        self._by_key.setdefault((it["endpoint"], it.get("key", "")), []).append(i)
+        self._by_key.setdefault((it["endpoint"], ""), []).append(i)
+
+    def append(self, endpoint: str, request: Dict[str, Any], elapsed_s: float, response: Any = None, error: Optional[BaseException] = None) -> None:
+        it: Dict[str, Any] = {
+            "endpoint": endpoint,
+            "key": request_key(endpoint, request),
+            "request": _to_jsonable(_request_fields(request)),
+            "elapsed_s": round(elapsed_s, 4),
+            "recorded_at": round(time.time(), 3),
+        }
+        if error is not None:
+            it["error"] = {
+                "type": type(error).__name__,
+                "message": str(error),
+                "status_code": getattr(error, "status_code", None),
+            }
+        else:
+            it["response"] = _to_jsonable(response)
+        line = json.dumps(it, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._index(it)
+
+    def next_for(self, endpoint: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        key = (endpoint, request_key(endpoint, request) if self.match == "request" else "")
+        with self._lock:
+            idxs = self._by_key.get(key)
+            if not idxs:
+                raise CassetteMiss(f"no recorded interaction for {endpoint} ({key[1] or 'any'}) in {self.path}")
+            pos = self._cursor.get(key, 0)
+            self._cursor[key] = pos + 1
+            return self.interactions[idxs[pos % len(idxs)]]
+
+
+def get_cassette(path: str, match: str = "request") -> Cassette:
+    with _CASSETTES_LOCK:
+        c = _CASSETTES.get(path)
+        if c is None or c.match != match:
+            c = _CASSETTES[path] = Cassette(path, match)
+        return c
+
+
+def reset_cassettes() -> None:
+    with _CASSETTES_LOCK:
+        _CASSETTES.clear()
+
+
+class RecordingClient:
+    """Proxies attribute chains to the real client and records each call."""
+
+    def __init__(self, target: Any, cassette: Cassette, path: Tuple[str, ...] = ()):
+        self._target = target
+        self._cassette = cassette
+        self._path = path
+
+    def __getattr__(self, name: str) -> "RecordingClient":
+        return RecordingClient(getattr(self._target, name), self._cassette, self._path + (name,))
+
+    def __call__(self, **kwargs: Any) -> Any:
+        endpoint = ".".join(self._path)
+        t0 = time.perf_counter()
+        try:
+            resp = self._target(**kwargs)
+        except Exception as exc:
+            self._cassette.append(endpoint, kwargs, time.perf_counter() - t0, error=exc)
+            raise
+        self._cassette.append(endpoint, kwargs, time.perf_counter() - t0, response=resp)
+        return resp
+
+
+class ReplayClient:
+    """Serves recorded interactions with their original (scaled) latency."""
+
+    def __init__(self, cassette: Cassette, latency_scale: float = 1.0, path: Tuple[str, ...] = ()):
+        self._cassette = cassette
+        self._scale = latency_scale
+        self._path = path
+
+    def __getattr__(self, name: str) -> "ReplayClient":
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return ReplayClient(self._cassette, self._scale, self._path + (name,))
+
+    def __call__(self, **kwargs: Any) -> Any:
+        it = self._cassette.next_for(".".join(self._path), kwargs)
+        delay = float(it.get("elapsed_s", 0.0)) * self._scale
+        if delay > 0:
+            # The SDK calls being replayed are blocking, so block like they do
+            time.sleep(delay)
+        err = it.get("error")
+        if err:
+            raise ReplayedProviderError(err.get("type", "Error"), err.get("message", ""), err.get("status_code"))
+        return _wrap(it.get("response"))
+
+
+def _path_from_env() -> str:
+    return os.environ.get("LLM_CASSETTE_PATH", "").strip() or "cassettes/llm.jsonl"
+
+
+def _match_from_env() -> str:
+    return "endpoint" if os.environ.get("LLM_CASSETTE_MATCH", "").strip().lower() == "endpoint" else "request"
+
+
+def recording_client_from_env(client: Any) -> RecordingClient:
+    return RecordingClient(client, get_cassette(_path_from_env()))
+
+
+def replay_client_from_env() -> ReplayClient:
+    scale = float(os.environ.get("LLM_CASSETTE_LATENCY_SCALE", "1.0"))
+    return ReplayClient(get_cassette(_path_from_env(), _match_from_env()), latency_scale=scale)
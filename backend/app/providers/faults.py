@@ -0,0 +1,256 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+import types
+from typing import Any, Dict, Optional, Tuple
+
+# Fault injection for provider calls, for resilience and latency testing.
+#
+# Configured with LLM_FAULTS (or set_override() from tests) as comma-separated
+# key=value pairs, or the equivalent JSON object:
+#
+#   latency=fixed:0.2                 every call takes 0.2s
+#   latency=lognormal:0.4:0.6         median 0.4s, sigma 0.6
+#   latency=longtail:0.3:0.05:8       lognormal around 0.3s; 5% of calls take 8s
+#   timeout=0.05                      rate of InjectedTimeout
+#   rate_limit=0.1                    rate of 429 InjectedProviderError
+#   server_error=0.02                 rate of 500 InjectedProviderError
+#   malformed=0.05                    rate of responses whose content is not JSON
+#   truncated=0.05                    rate of responses cut off mid-content
+#   stall=0.01:30                     rate of calls that hang for 30s: streamed
+#                                     calls (stream=True) after their first chunk,
+#                                     others before the response is returned
+#   endpoints=chat.completions.create+responses.create   (default: all)
+#   seed=42
+
+ERROR_KINDS = ("timeout", "rate_limit", "server_error")
+CORRUPT_KINDS = ("malformed", "truncated")
+
+_OVERRIDE: Optional["FaultConfig"] = None
+_CACHE: Dict[str, "FaultConfig"] = {}
+_LOCK = threading.Lock()
+
+
+class InjectedTimeout(TimeoutError):
+    pass
+
+
+class InjectedProviderError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FaultConfig:
+    def __init__(
+        self,
+        latency: Tuple[Any, ...] = ("fixed", 0.0),
+        rates: Optional[Dict[str, float]] = None,
+        stall_seconds: float = 60.0,
+        endpoints: Optional[Tuple[str, ...]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.rates = {k: float(v) for k, v in (rates or {}).items()}
+        self.stall_seconds = stall_seconds
+        self.endpoints = endpoints
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str) -> "FaultConfig":
+        spec = spec.strip()
+        if spec.startswith("{"):
+            items = {str(k): str(v) for k, v in json.loads(spec).items()}
+        else:
+            items = {}
+            for part in spec.split(","):
+                if part.strip():
+                    k, _, v = part.partition("=")
+                    items[k.strip()] = v.strip()
+
+        latency: Tuple[Any, ...] = ("fixed", 0.0)
+        rates: Dict[str, float] = {}
+        stall_seconds = 60.0
+        endpoints = None
+        seed = None
+        for key, val in items.items():
+            if key == "latency":
+                kind, *args = val.split(":")
+                if kind not in {"fixed", "lognormal", "longtail"}:
+                    raise ValueError(f"unknown latency distribution: {kind}")
+                latency = (kind, *[float(a) for a in args])
+            elif key == "stall":
+                rate, _, secs = val.partition(":")
+                rates["stall"] = float(rate)
+                if secs:
+                    stall_seconds = float(secs)
+            elif key in ERROR_KINDS or key in CORRUPT_KINDS:
+                rates[key] = float(val)
+            elif key == "endpoints":
+                endpoints = tuple(e for e in val.split("+") if e)
+            elif key == "seed":
+                seed = int(val)
+            else:
+                raise ValueError(f"unknown fault setting: {key}")
+        return cls(latency, rates, stall_seconds, endpoints, seed)
+
+    def applies_to(self, endpoint: str) -> bool:
+        return self.endpoints is None or endpoint in self.endpoints
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self.rng.random()
+
+    def sample_latency(self) -> float:
+        kind, *args = self.latency
+        with self._rng_lock:
+            if kind == "fixed":
+                return args[0] if args else 0.0
+            median = args[0] if args else 0.3
+            sigma = args[1] if len(args) > 1 and kind == "lognormal" else 0.25
+            if kind == "longtail":
+                tail_p = args[1] if len(args) > 1 else 0.05
+                tail_s = args[2] if len(args) > 2 else 10 * median
+                if self.rng.random() < tail_p:
+                    return tail_s
+            return self.rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+    def draw(self) -> Optional[str]:
+        """Pick at most one fault for a call, by cumulative rate."""
+        r = self._random()
+        acc = 0.0
+        for kind in ("stall",) + ERROR_KINDS + CORRUPT_KINDS:
+            acc += self.rates.get(kind, 0.0)
+            if r < acc:
+                return kind
+        return None
+
+
+def set_override(config: Optional[FaultConfig]) -> None:
+    global _OVERRIDE
+    _OVERRIDE = config
+
+
+def config_from_env() -> Optional[FaultConfig]:
+    if _OVERRIDE is not None:
+        return _OVERRIDE
+    spec = os.environ.get("LLM_FAULTS", "").strip()
+    if not spec:
+        return None
+    # Parse once per spec so the seeded RNG sequence spans calls
+    with _LOCK:
+        cfg = _CACHE.get(spec)
+        if cfg is None:
+            cfg = _CACHE[spec] = FaultConfig.parse(spec)
+        return cfg
+
+
+def _response_text(resp: Any) -> str:
+    try:
+        return resp.choices[0].message.content or ""
+    except (AttributeError, IndexError, KeyError, TypeError):
+        pass
+    try:
+        return resp.content[0].text or ""
+    except (AttributeError, IndexError, KeyError, TypeError):
+        return ""
+
+
+def _with_text(resp: Any, text: str) -> Any:
+    # Rebuilt in both the Chat Completions and Responses shapes so callers
+    # reading either path see the damaged content.
+    ns = types.SimpleNamespace
+    return ns(
+        choices=[ns(message=ns(content=text), finish_reason="length")],
+        content=[ns(text=text)],
+        usage=getattr(resp, "usage", None),
+    )
+
+
+class _StalledStream:
+    """Passes a streamed response through, hanging once after the first chunk."""
+
+    def __init__(self, stream: Any, stall_seconds: float):
+        self._stream = stream
+        self._chunks = iter(stream)
+        self._stall_seconds = stall_seconds
+        self._sent = 0
+
+    def __iter__(self) -> "_StalledStream":
+        return self
+
+    def __next__(self) -> Any:
+        if self._sent == 1:
+            time.sleep(self._stall_seconds)
+        chunk = next(self._chunks)
+        self._sent += 1
+        return chunk
+
+    def __enter__(self) -> "_StalledStream":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+class FaultInjectingClient:
+    def __init__(self, target: Any, config: FaultConfig, path: Tuple[str, ...] = ()):
+        self._target = target
+        self._config = config
+        self._path = path
+
+    def __getattr__(self, name: str) -> "FaultInjectingClient":
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return FaultInjectingClient(getattr(self._target, name), self._config, self._path + (name,))
+
+    def __call__(self, **kwargs: Any) -> Any:
+        cfg = self._config
+        endpoint = ".".join(self._path)
+        if not cfg.applies_to(endpoint):
+            return self._target(**kwargs)
+
+        fault = cfg.draw()
+        streamed = bool(kwargs.get("stream"))
+        # SDK calls block the caller, so injected delays block as well
+        delay = cfg.sample_latency()
+        if fault == "stall" and not streamed:
+            delay += cfg.stall_seconds
+        if delay > 0:
+            time.sleep(delay)
+
+        if fault == "timeout":
+            raise InjectedTimeout(f"injected timeout on {endpoint}")
+        if fault == "rate_limit":
+            raise InjectedProviderError(429, f"injected rate limit on {endpoint}")
+        if fault == "server_error":
+            raise InjectedProviderError(500, f"injected server error on {endpoint}")
+
+        resp = self._target(**kwargs)
+        if fault == "stall" and streamed:
+            return _StalledStream(resp, cfg.stall_seconds)
+        if fault == "malformed":
+            return _with_text(resp, '{"hints": [unquoted, "score": }')
+        if fault == "truncated":
+            text = _response_text(resp)
+            return _with_text(resp, text[: max(1, len(text) // 2)])
+        return resp
+
+
+def wrap_from_env(client: Any) -> Any:
+    cfg = config_from_env()
+    if cfg is None:
+        return client
+    return FaultInjectingClient(client, cfg)
@@ -1,5 +1,532 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import hashlib
+import hmac
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
-# Shared limiter instance used by app and routers
-limiter = Limiter(key_func=get_remote_address, default_limits=["60/minute"])  # 60 req/min per IP
\ No newline at end of file
+import anyio
+
+from app import metrics
+
+# Pure ASGI rate limiting using GCRA (generic cell rate algorithm). Each key
+# costs a single float of state (its theoretical arrival time), a check is
+# O(1), and keys whose bucket has fully drained are evicted by a periodic sweep.
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# Shared with the token budget, which uses the same stores
+STORE_ERRORS = metrics.counter(
+    "studiebot_ratelimit_store_errors_total", "Rate-limit and token-budget store calls that failed (the request was let through)", ("store",)
+)
+
+
+class RateLimit:
+    __slots__ = ("count", "period", "interval", "tolerance", "text")
+
+    def __init__(self, count: int, period: float, text: str = ""):
+        self.count = count
+        self.period = period
+        self.interval = period / count  # emission interval per request
+        self.tolerance = period  # allows a burst of `count` requests
+        self.text = text or f"{count}/{int(period)}s"
+
+
+def parse_rate(text: str) -> RateLimit:
+    """Parse "60/minute", "10 per second" or "100/5minutes"."""
+    raw = text.strip().lower().replace(" per ", "/")
+    count_s, _, unit = raw.partition("/")
+    unit = unit.strip()
+    mult = 1
+    digits = ""
+    while unit and unit[0].isdigit():
+        digits += unit[0]
+        unit = unit[1:]
+    if digits:
+        mult = int(digits)
+    unit = unit.strip().rstrip("s") or "second"
+    if unit not in _PERIODS:
+        raise ValueError(f"unknown rate period: {text!r}")
+    return RateLimit(int(count_s), float(_PERIODS[unit] * mult), text.strip())
+
+
+class Decision:
+    __slots__ = ("allowed", "limit", "remaining", "reset_after", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_after: float, retry_after: float):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after
+        self.retry_after = retry_after
+
+
+def _adjusted(tat: Optional[float], rate: RateLimit, delta: float, now: float) -> Optional[float]:
+    tat = now if tat is None or tat < now else tat
+    new_tat = tat + rate.interval * delta
+    return new_tat if new_tat > now else None
+
+
+def gcra(tat: Optional[float], now: float, rate: RateLimit, cost: int = 1) -> Tuple[Decision, Optional[float]]:
+    """Apply one GCRA step. Returns the decision and the new TAT (None when denied)."""
+    tat = now if tat is None or tat < now else tat
+    new_tat = tat + rate.interval * cost
+    allow_at = new_tat - rate.tolerance
+    if now < allow_at:
+        remaining = max(0, int((rate.tolerance - (tat - now)) / rate.interval + 1e-9))
+        return Decision(False, rate.count, remaining, tat - now, allow_at - now), None
+    remaining = max(0, int((rate.tolerance - (new_tat - now)) / rate.interval + 1e-9))
+    return Decision(True, rate.count, remaining, new_tat - now, 0.0), new_tat
+
+
+# (bucket key, rate, cost)
+Hit = Tuple[str, RateLimit, int]
+
+
+class MemoryStore:
+    """Process-local GCRA state with idle-key eviction."""
+
+    blocking = False  # cheap enough to call on the event loop
+
+    def __init__(self, sweep_interval: float = 60.0):
+        self._tat: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+
+    def hit(self, key: str, rate: RateLimit, now: float, cost: int = 1) -> Decision:
+        return self.hit_many([(key, rate, cost)], now)[0]
+
+    def hit_many(self, items: List[Hit], now: float) -> List[Decision]:
+        """Check several buckets at once; quota is consumed only if all allow."""
+        with self._lock:
+            results = [gcra(self._tat.get(key), now, rate, cost) for key, rate, cost in items]
+            if all(new_tat is not None for _, new_tat in results):
+                for (key, _, _), (_, new_tat) in zip(items, results):
+                    self._tat[key] = new_tat  # type: ignore[assignment]
+            if now >= self._next_sweep:
+                self._sweep(now)
+            return [d for d, _ in results]
+
+    def adjust(self, key: str, rate: RateLimit, delta: float, now: float) -> None:
+        """Charge (delta > 0) or refund (delta < 0) cost already admitted."""
+        with self._lock:
+            new_tat = _adjusted(self._tat.get(key), rate, delta, now)
+            if new_tat is None:
+                self._tat.pop(key, None)
+            else:
+                self._tat[key] = new_tat
+
+    def _sweep(self, now: float) -> None:
+        # A key whose TAT has passed is indistinguishable from an unseen key
+        self._tat = {k: t for k, t in self._tat.items() if t > now}
+        self._next_sweep = now + self._sweep_interval
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tat.clear()
+
+
+class SQLiteStore:
+    """GCRA state in a SQLite file shared by every worker on the host.
+
+    Each hit is one short IMMEDIATE transaction, so concurrent workers see a
+    consistent TAT per key; state also survives restarts.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, sweep_interval: float = 60.0, busy_timeout_ms: int = 2000):
+        self.path = path
+        self._local = threading.local()
+        self._sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        self._busy_timeout_ms = busy_timeout_ms
+        self._conn()  # create the schema eagerly
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self._busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS ratelimit (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID")
+            conn.execute("CREATE INDEX IF NOT EXISTS ratelimit_tat ON ratelimit (tat)")  # for the sweep
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, rate: RateLimit, now: float, cost: int = 1) -> Decision:
+        return self.hit_many([(key, rate, cost)], now)[0]
+
+    def hit_many(self, items: List[Hit], now: float) -> List[Decision]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            results = []
+            for key, rate, cost in items:
+                row = conn.execute("SELECT tat FROM ratelimit WHERE key = ?", (key,)).fetchone()
+                results.append(gcra(row[0] if row else None, now, rate, cost))
+            if all(new_tat is not None for _, new_tat in results):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO ratelimit (key, tat) VALUES (?, ?)",
+                    [(key, new_tat) for (key, _, _), (_, new_tat) in zip(items, results)],
+                )
+            if now >= self._next_sweep:
+                self._next_sweep = now + self._sweep_interval
+                conn.execute("DELETE FROM ratelimit WHERE tat <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [d for d, _ in results]
+
+    def adjust(self, key: str, rate: RateLimit, delta: float, now: float) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM ratelimit WHERE key = ?", (key,)).fetchone()
+            new_tat = _adjusted(row[0] if row else None, rate, delta, now)
+            if new_tat is None:
+                conn.execute("DELETE FROM ratelimit WHERE key = ?", (key,))
+            else:
+                conn.execute("INSERT OR REPLACE INTO ratelimit (key, tat) VALUES (?, ?)", (key, new_tat))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM ratelimit").fetchone()[0]
+
+    def reset(self) -> None:
+        self._conn().execute("DELETE FROM ratelimit")
+
+
+# KEYS = buckets; ARGV = now, then interval, tolerance, cost per bucket
+# (seconds as floats). Returns {allowed, remaining, reset_after_us,
+# retry_after_us} per bucket; TATs are only written when every bucket allows.
+# Keys expire once drained, which is Redis-side idle eviction.
+GCRA_LUA = """
+local now = tonumber(ARGV[1])
+local out = {}
+local new_tats = {}
+local ok = true
+for i, key in ipairs(KEYS) do
+  local interval = tonumber(ARGV[i * 3 - 1])
+  local tolerance = tonumber(ARGV[i * 3])
+  local cost = tonumber(ARGV[i * 3 + 1])
+  local tat = tonumber(redis.call('GET', key) or now)
+  if tat < now then tat = now end
+  local new_tat = tat + interval * cost
+  local allow_at = new_tat - tolerance
+  if now < allow_at then
+    ok = false
+    local remaining = math.max(0, math.floor((tolerance - (tat - now)) / interval + 1e-9))
+    for _, v in ipairs({0, remaining, math.floor((tat - now) * 1e6), math.ceil((allow_at - now) * 1e6)}) do
+      table.insert(out, v)
+    end
+  else
+    new_tats[i] = new_tat
+    local remaining = math.max(0, math.floor((tolerance - (new_tat - now)) / interval + 1e-9))
+    for _, v in ipairs({1, remaining, math.floor((new_tat - now) * 1e6), 0}) do
+      table.insert(out, v)
+    end
+  end
+end
+if ok then
+  for i, key in ipairs(KEYS) do
+    redis.call('SET', key, string.format('%.6f', new_tats[i]), 'PX', math.ceil((new_tats[i] - now) * 1000))
+  end
+end
+return out
+"""
+
+
+# KEYS[1] = bucket; ARGV = now, interval, delta. Moves an existing TAT by
+# delta emission intervals (charge or refund), dropping the key when drained.
+ADJUST_LUA = """
+local now = tonumber(ARGV[1])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + tonumber(ARGV[2]) * tonumber(ARGV[3])
+if new_tat <= now then
+  redis.call('DEL', KEYS[1])
+else
+  redis.call('SET', KEYS[1], string.format('%.6f', new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+end
+return 1
+"""
+
+
+class RedisStore:
+    """GCRA state in Redis (or anything speaking its protocol), one atomic script per hit."""
+
+    blocking = True
+
+    def __init__(self, client: Any, prefix: str = "studiebot:rl:"):
+        self._client = client
+        self._prefix = prefix
+        self._script = client.register_script(GCRA_LUA)
+        self._adjust = client.register_script(ADJUST_LUA)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisStore":
+        import redis  # optional dependency, only needed for redis:// storage
+
+        return cls(redis.Redis.from_url(url, socket_timeout=0.25))
+
+    def hit(self, key: str, rate: RateLimit, now: float, cost: int = 1) -> Decision:
+        return self.hit_many([(key, rate, cost)], now)[0]
+
+    def hit_many(self, items: List[Hit], now: float) -> List[Decision]:
+        args: List[Any] = [repr(now)]
+        for _, rate, cost in items:
+            args += [repr(rate.interval), repr(rate.tolerance), cost]
+        flat = self._script(keys=[self._prefix + key for key, _, _ in items], args=args)
+        return [
+            Decision(bool(flat[i * 4]), rate.count, int(flat[i * 4 + 1]), int(flat[i * 4 + 2]) / 1e6, int(flat[i * 4 + 3]) / 1e6)
+            for i, (_, rate, _) in enumerate(items)
+        ]
+
+    def adjust(self, key: str, rate: RateLimit, delta: float, now: float) -> None:
+        self._adjust(keys=[self._prefix + key], args=[repr(now), repr(rate.interval), repr(delta)])
+
+    def reset(self) -> None:
+        for k in self._client.scan_iter(match=self._prefix + "*"):
+            self._client.delete(k)
+
+
+def store_from_env():
+    """RATE_LIMIT_STORAGE: memory (default), sqlite:///path/to/file.db or redis://host:port/db."""
+    url = os.environ.get("RATE_LIMIT_STORAGE", "").strip()
+    if not url or url == "memory":
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///") :])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore.from_url(url)
+    raise ValueError(f"unsupported RATE_LIMIT_STORAGE: {url}")
+
+
+def get_remote_address(scope) -> str:
+    client = scope.get("client")
+    return client[0] if client else "127.0.0.1"
+
+
+def header(scope, name: bytes) -> Optional[str]:
+    for k, v in scope.get("headers", ()):
+        if k == name:
+            return v.decode("latin-1").strip() or None
+    return None
+
+
+def parse_route_limits(spec: str) -> Dict[str, List[str]]:
+    """Parse "/api/path=10/minute;200/day,/other=5/second" into rates per path."""
+    limits: Dict[str, List[str]] = {}
+    for part in (spec or "").split(","):
+        path, sep, rates = part.strip().rpartition("=")
+        parsed = [r.strip() for r in rates.split(";") if r.strip()]
+        if sep and path.strip() and parsed:
+            limits[path.strip()] = parsed
+    return limits
+
+
+def sign_student(student: str, school: str, signing_key: str) -> str:
+    """Build an X-Student-Token value: "<school>/<student>.<hmac-sha256 hex>"."""
+    subject = f"{school}/{student}"
+    sig = hmac.new(signing_key.encode(), subject.encode(), hashlib.sha256).hexdigest()
+    return f"{subject}.{sig}"
+
+
+class StudentIdentity:
+    __slots__ = ("student", "school")
+
+    def __init__(self, student: str, school: Optional[str]):
+        self.student = student
+        self.school = school
+
+
+class Limiter:
+    """Hierarchical limits, all checked atomically in one store call.
+
+    - identified students (signed X-Student-Token, or X-Student-Id/X-School-Id
+      when trust_client_ids is on) get their own ``student_limits`` and share
+      ``aggregate_limits`` per school, or per IP when no school is known;
+    - anonymous requests fall back to ``default_limits`` per IP, or to the
+      path's own ``route_limits`` (RATE_LIMIT_ROUTES) when it has them;
+    - ``global_limits`` cap ``global_paths`` across all clients (provider ceiling).
+    """
+
+    def __init__(
+        self,
+        key_func: Callable = get_remote_address,
+        default_limits: Iterable[str] = ("60/minute",),
+        route_limits: Optional[Dict[str, Iterable[str]]] = None,
+        exempt_paths: Iterable[str] = ("/metrics", "/readyz"),
+        store=None,
+        student_limits: Iterable[str] = ("60/minute",),
+        aggregate_limits: Iterable[str] = ("1200/minute",),
+        global_limits: Iterable[str] = (),
+        global_paths: Iterable[str] = ("/api/llm/generate-hints", "/api/llm/grade-quiz"),
+        signing_key: Optional[str] = None,
+        trust_client_ids: bool = False,
+    ):
+        self.key_func = key_func
+        self.default_limits: List[RateLimit] = [parse_rate(x) for x in default_limits]
+        self.route_limits: Dict[str, List[RateLimit]] = {
+            p: [parse_rate(r) for r in ([rates] if isinstance(rates, str) else rates)] for p, rates in (route_limits or {}).items()
+        }
+        self.exempt_paths = frozenset(exempt_paths)
+        self.store = store if store is not None else store_from_env()
+        self.student_limits = [parse_rate(x) for x in student_limits]
+        self.aggregate_limits = [parse_rate(x) for x in aggregate_limits]
+        self.global_limits = [parse_rate(x) for x in global_limits]
+        self.global_paths = frozenset(global_paths)
+        self.signing_key = signing_key
+        self.trust_client_ids = trust_client_ids
+        self.enabled = True
+        self.clock = time.time
+
+    @classmethod
+    def from_env(cls) -> "Limiter":
+        def _rates(name: str, default: str) -> List[str]:
+            raw = os.environ.get(name, default)
+            return [r.strip() for r in raw.split(";") if r.strip()]
+
+        return cls(
+            key_func=get_remote_address,
+            default_limits=_rates("RATE_LIMIT_DEFAULT", "60/minute"),
+            route_limits=parse_route_limits(os.environ.get("RATE_LIMIT_ROUTES", "")),
+            student_limits=_rates("RATE_LIMIT_STUDENT", "60/minute"),
+            aggregate_limits=_rates("RATE_LIMIT_AGGREGATE", "1200/minute"),
+            global_limits=_rates("RATE_LIMIT_GLOBAL", ""),
+            signing_key=os.environ.get("RATE_LIMIT_SIGNING_KEY") or None,
+            trust_client_ids=os.environ.get("RATE_LIMIT_TRUST_CLIENT_IDS", "").strip().lower() in {"1", "true", "yes", "on"},
+        )
+
+    def identify(self, scope) -> Optional[StudentIdentity]:
+        token = header(scope, b"x-student-token")
+        if token and self.signing_key:
+            subject, _, sig = token.rpartition(".")
+            expected = hmac.new(self.signing_key.encode(), subject.encode(), hashlib.sha256).hexdigest()
+            if subject and hmac.compare_digest(sig, expected):
+                school, _, student = subject.rpartition("/")
+                if student:
+                    return StudentIdentity(student[:64], school[:64] or None)
+        if self.trust_client_ids:
+            student = header(scope, b"x-student-id")
+            if student:
+                return StudentIdentity(student[:64], (header(scope, b"x-school-id") or "")[:64] or None)
+        return None
+
+    def hits_for(self, scope) -> List[Hit]:
+        path = scope.get("path", "")
+        bucket = path[:128]
+        ip = self.key_func(scope)
+        who = self.identify(scope)
+        items: List[Hit] = []
+        if who is not None:
+            items += [(f"{bucket}|{r.text}|student:{who.school or ''}/{who.student}", r, 1) for r in self.student_limits]
+            group = f"school:{who.school}" if who.school else f"ip:{ip}"
+            items += [(f"{bucket}|{r.text}|{group}", r, 1) for r in self.aggregate_limits]
+        else:
+            limits = self.route_limits.get(path, self.default_limits)
+            items += [(f"{bucket}|{r.text}|{ip}", r, 1) for r in limits]
+        if path in self.global_paths:
+            items += [(f"global|{r.text}", r, 1) for r in self.global_limits]
+        return items
+
+    def check(self, scope) -> Optional[Decision]:
+        """Check and consume quota for a request; None when the path is not limited.
+
+        A failing store (locked SQLite file, unreachable Redis) lets the
+        request through and counts it in studiebot_ratelimit_store_errors_total.
+        """
+        path = scope.get("path", "")
+        if not self.enabled or path in self.exempt_paths:
+            return None
+        items = self.hits_for(scope)
+        if not items:
+            return None
+        try:
+            decisions = self.store.hit_many(items, self.clock())
+        except Exception:
+            STORE_ERRORS.inc(store=type(self.store).__name__)
+            return None
+        # Report the denying limit, or else the one with the least headroom
+        denied = [d for d in decisions if not d.allowed]
+        if denied:
+            return max(denied, key=lambda d: d.retry_after)
+        return min(decisions, key=lambda d: d.remaining)
+
+    def reset(self) -> None:
+        self.store.reset()
+
+
+def _headers(d: Decision) -> List[Tuple[bytes, bytes]]:
+    headers = [
+        (b"ratelimit-limit", str(d.limit).encode()),
+        (b"ratelimit-remaining", str(d.remaining).encode()),
+        (b"ratelimit-reset", str(max(0, math.ceil(d.reset_after))).encode()),
+    ]
+    if not d.allowed:
+        headers.append((b"retry-after", str(max(1, math.ceil(d.retry_after))).encode()))
+    return headers
+
+
+_REJECT_BODY = json.dumps({"error": "rate_limited"}).encode()
+
+
+class RateLimitMiddleware:
+    """Checks the limiter once per HTTP request and adds RateLimit-* headers."""
+
+    def __init__(self, app, limiter: "Limiter"):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if getattr(self.limiter.store, "blocking", True):
+            # SQLite and Redis calls block; keep them off the event loop
+            decision = await anyio.to_thread.run_sync(self.limiter.check, scope)
+        else:
+            decision = self.limiter.check(scope)
+        if decision is None:
+            await self.app(scope, receive, send)
+            return
+
+        extra = _headers(decision)
+        if not decision.allowed:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(_REJECT_BODY)).encode()),
+                        *extra,
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": _REJECT_BODY})
+            return
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        await self.app(scope, receive, _send)
+
+
+# Shared limiter instance used by the app (anonymous clients: 60 req/min per IP)
+limiter = Limiter.from_env()
@@ -1,100 +1,374 @@
-import re
-from typing import Dict, List, Tuple
-from fastapi import APIRouter, Body
+import codecs
+import json
+import math
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+import anyio.to_thread
+from fastapi import APIRouter, Request
 from fastapi import Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.datastructures import UploadFile
+from starlette.exceptions import HTTPException
+from starlette.requests import ClientDisconnect
+
+from app.audit_log import annotate
+from app.glossary_documents import DocumentError, detect_kind, iter_document_text, pdf_supported, spool_upload
+from app.glossary_store import Chapter, ChapterLRU, memory_budget, store_from_env
+from app.glossary_bulk import BulkItemError, aiter_list, chapter_key, collect_bulk, extract_in_pool, iter_ndjson, run_bulk
+from app.glossary_extract import (  # noqa: F401  (extract_glossary, parse_line re-exported)
+    ChapterIndex,
+    GlossaryExtractor,
+    diff_terms,
+    extract_glossary,
+    extraction_cache,
+    parse_line,
+    text_digest,
+)
 
 router = APIRouter()
 
-# In-memory store (DB disabled by default). Keyed by (vak, leerjaar, hoofdstuk)
-_STORE: Dict[Tuple[str, str, str], List[Dict[str, str]]] = {}
+# Keyed by (vak, leerjaar, hoofdstuk); in-process unless GLOSSARY_STORAGE names a SQLite file
+glossary_store = store_from_env()
+# Per-line parse results of recently refreshed chapters, for incremental
+# re-extraction; their share of GLOSSARY_MEMORY_BYTES bounds them
+_INDEXES = ChapterLRU(memory_budget("index"), "index")
 
+# Longest chapter text accepted by refresh, in characters
+MAX_REFRESH_CHARS = int(os.environ.get("GLOSSARY_MAX_TEXT_CHARS", "1000000"))
 
-def extract_glossary(text: str) -> List[Dict[str, str]]:
-    if not text or not isinstance(text, str):
-        return []
-    lines = text.splitlines()
+# Sent with GET /glossary; with the ETag, "no-cache" lets browsers revalidate cheaply
+CACHE_CONTROL = os.environ.get("GLOSSARY_CACHE_CONTROL", "no-cache")
 
-    # Try to locate glossary section by header keywords
-    header_idx = -1
-    header_pat = re.compile(r"^(\s*(begrip|begrippen|begrippenlijst|woordenlijst)\s*:?)$", re.I)
-    for i, ln in enumerate(lines):
-        if header_pat.match(ln.strip()):
-            header_idx = i
-            break
+_NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
 
-    search_lines = lines[header_idx + 1 :] if header_idx >= 0 else lines
 
-    terms: List[Dict[str, str]] = []
-    # Pattern 1: "Term — definitie" or "Term - definitie"
-    dash_pat = re.compile(r"^\s*([^\-—:|]+?)\s*[—-]\s*(.+)$")
-    colon_pat = re.compile(r"^\s*([^:|]+?)\s*:\s*(.+)$")
-
-    for ln in search_lines:
-        s = ln.strip()
-        if not s:
-            continue
-        m = dash_pat.match(s)
-        if m:
-            term, definition = m.group(1).strip(), m.group(2).strip()
-            if term and definition:
-                terms.append({"term": term, "definition": definition})
-                continue
-        m2 = colon_pat.match(s)
-        if m2:
-            term, definition = m2.group(1).strip(), m2.group(2).strip()
-            if term and definition:
-                terms.append({"term": term, "definition": definition})
-                continue
-
-    if terms:
-        return _dedupe_terms(terms)
-
-    # Pattern 2: Simple Markdown-like 2-col table with headers including Begrip/Definitie
-    table_rows = [ln for ln in search_lines if "|" in ln]
-    if table_rows:
-        # Expect header row
-        hdr = table_rows[0].lower()
-        if ("begrip" in hdr or "term" in hdr) and ("definitie" in hdr or "betekenis" in hdr):
-            for row in table_rows[1:]:
-                cols = [c.strip() for c in row.split("|") if c.strip()]
-                if len(cols) >= 2:
-                    term, definition = cols[0], cols[1]
-                    if term and definition:
-                        terms.append({"term": term, "definition": definition})
-    return _dedupe_terms(terms)
-
-
-def _dedupe_terms(items: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    seen = set()
-    out: List[Dict[str, str]] = []
-    for it in items:
-        key = it["term"].strip().lower()
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append({"term": it["term"].strip(), "definition": it["definition"].strip()})
-    return out
+def _etag(version: int) -> str:
+    return f'"{glossary_store.epoch}-{version}"'
+
+
+def _etag_matches(if_none_match: str, etag: str, exists: bool) -> bool:
+    # If-None-Match uses the weak comparison
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag == "*" and exists) or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+async def _read(fn, key: Tuple[str, str, str]):
+    # A SQLite-backed read checks PRAGMA data_version and may SELECT
+    if getattr(glossary_store, "blocking", True):
+        return await anyio.to_thread.run_sync(fn, key)
+    return fn(key)
 
 
 @router.get("/glossary")
-async def get_glossary(vak: str = "", leerjaar: str = "", hoofdstuk: str = "", response: Response = None):
-    # DB disabled by default: serve in-memory if present, else empty
+async def get_glossary(request: Request, vak: str = "", leerjaar: str = "", hoofdstuk: str = ""):
     key = (vak or "", leerjaar or "", hoofdstuk or "")
-    terms = _STORE.get(key, [])
-    return {"data": {"terms": terms}}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Decided on the version alone; the terms are not loaded
+        version = await _read(glossary_store.version, key)
+        etag = _etag(version)
+        if _etag_matches(if_none_match, etag, version > 0):
+            annotate(not_modified=True)
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    chapter = await _read(glossary_store.get, key)
+    annotate(terms=len(chapter) if chapter else 0)
+    # Terms are serialized once per chapter version
+    terms_json = chapter.terms_json if chapter else b"[]"
+    return Response(
+        content=b'{"data":{"terms":' + terms_json + b"}}",
+        media_type="application/json",
+        headers={"ETag": _etag(chapter.version if chapter else 0), "Cache-Control": CACHE_CONTROL},
+    )
+
+
+def _charset(content_type: str) -> str:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            try:
+                return codecs.lookup(value.strip().strip('"')).name
+            except LookupError:
+                break
+    return "utf-8"
+
+
+async def _stored(key: Tuple[str, str, str]) -> Optional[Chapter]:
+    return await _read(glossary_store.get, key) if all(key) else None
 
 
-@router.post("/glossary/refresh")
+async def _save_chapter(key: Tuple[str, str, str], digest: str, terms: List[Dict[str, str]], previous: Optional[Chapter]) -> bool:
+    """Store a chapter's terms; False if it already holds this exact text."""
+    if not all(key) or (previous is not None and previous.digest == digest):
+        return False
+    # A SQLite write may wait for another worker's transaction
+    await anyio.to_thread.run_sync(glossary_store.put, key, terms, digest)
+    return True
+
+
+def _extract_indexed(key: Tuple[str, str, str], text: str) -> List[Dict[str, str]]:
+    index = _INDEXES.get(key) or ChapterIndex()
+    terms = index.extract(text)
+    annotate(reparsed_lines=index.reparsed)
+    # Re-put: the index's size follows the chapter's current lines
+    _INDEXES.put(key, index, index.nbytes)
+    return terms
+
+
+async def _refresh_streamed(request: Request, vak: str, leerjaar: str, hoofdstuk: str):
+    # text/plain body: extract while it streams, keeping one line in memory
+    extractor = GlossaryExtractor()
+    decoder = codecs.getincrementaldecoder(_charset(request.headers.get("content-type", "")))(errors="replace")
+    terms: List[Dict[str, str]] = []
+    async for chunk in request.stream():
+        terms.extend(extractor.feed(decoder.decode(chunk)))
+        if extractor.chars > MAX_REFRESH_CHARS:
+            annotate(text_chars=extractor.chars)
+            return JSONResponse(status_code=413, content={"error": "payload_too_large"})
+    terms.extend(extractor.feed(decoder.decode(b"", final=True)))
+    return await _finish_streamed((vak, leerjaar, hoofdstuk), extractor, terms)
+
+
+async def _finish_streamed(key: Tuple[str, str, str], extractor: GlossaryExtractor, terms: List[Dict[str, str]]):
+    terms.extend(extractor.close())
+    extraction_cache.put(extractor.digest, terms)
+    previous = await _stored(key)
+    changes = diff_terms(previous.terms if previous else [], terms)
+    stored = await _save_chapter(key, extractor.digest, terms, previous)
+    annotate(terms=len(terms), text_chars=extractor.chars, unchanged=all(key) and not stored)
+    return {"data": {"terms": terms, "changes": changes}}
+
+
+@router.post(
+    "/glossary/refresh",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": {"type": "object"}},
+                "text/plain": {"schema": {"type": "string"}},
+            },
+            "required": True,
+        }
+    },
+)
 async def refresh_glossary(
-    payload: Dict = Body(...),
-    response: Response = None,  # type: ignore
+    request: Request,
+    vak: str = "",
+    leerjaar: str = "",
+    hoofdstuk: str = "",
 ):
+    """Extract and store a chapter's glossary.
+
+    Either a JSON object {vak, leerjaar, hoofdstuk, text}, or the chapter as a
+    text/plain body (streamed) with vak/leerjaar/hoofdstuk as query parameters.
+    """
+    if request.headers.get("content-type", "").split(";")[0].strip().lower() == "text/plain":
+        return await _refresh_streamed(request, vak, leerjaar, hoofdstuk)
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        return JSONResponse(status_code=422, content={"error": "invalid_body"})
     vak = str(payload.get("vak", ""))
     leerjaar = str(payload.get("leerjaar", ""))
     hoofdstuk = str(payload.get("hoofdstuk", ""))
     text = str(payload.get("text", ""))
-    terms = extract_glossary(text)
-    # DB disabled: we do not persist by default; but keep ephemeral for the process lifetime
-    if vak and leerjaar and hoofdstuk:
-        _STORE[(vak, leerjaar, hoofdstuk)] = terms
-    return {"data": {"terms": terms}}
\ No newline at end of file
+    if len(text) > MAX_REFRESH_CHARS:
+        annotate(text_chars=len(text))
+        return JSONResponse(status_code=413, content={"error": "payload_too_large"})
+    key = (vak, leerjaar, hoofdstuk)
+    digest = text_digest(text)
+    terms = extraction_cache.get(digest)
+    cached = terms is not None
+    if terms is None:
+        if all(key):
+            # Only lines not seen in this chapter's last refresh are parsed
+            terms = _extract_indexed(key, text)
+        else:
+            terms = extract_glossary(text)
+        extraction_cache.put(digest, terms)
+    previous = await _stored(key)
+    changes = diff_terms(previous.terms if previous else [], terms)
+    stored = await _save_chapter(key, digest, terms, previous)
+    annotate(terms=len(terms), text_chars=len(text), cached=cached, unchanged=all(key) and not stored)
+    return {"data": {"terms": terms, "changes": changes}}
+
+
+@router.post(
+    "/glossary/upload",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "file": {"type": "string", "format": "binary"},
+                            "vak": {"type": "string"},
+                            "leerjaar": {"type": "string"},
+                            "hoofdstuk": {"type": "string"},
+                        },
+                        "required": ["file"],
+                    }
+                }
+            },
+            "required": True,
+        }
+    },
+)
+async def upload_glossary(
+    request: Request,
+    vak: str = "",
+    leerjaar: str = "",
+    hoofdstuk: str = "",
+):
+    """Extract and store a chapter's glossary from an uploaded PDF or DOCX.
+
+    Multipart form with the document as `file`; vak/leerjaar/hoofdstuk as form
+    fields or query parameters. Same response as /glossary/refresh.
+    """
+    try:
+        form = await request.form(max_files=1, max_fields=8)
+    except HTTPException:
+        return JSONResponse(status_code=422, content={"error": "invalid_body"})
+    path = None
+    try:
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            return JSONResponse(status_code=422, content={"error": "invalid_body"})
+        key = (str(form.get("vak") or vak), str(form.get("leerjaar") or leerjaar), str(form.get("hoofdstuk") or hoofdstuk))
+        kind = detect_kind(await upload.read(8))
+        await upload.seek(0)
+        annotate(document=kind)
+        if kind is None:
+            return JSONResponse(status_code=415, content={"error": "unsupported_media_type"})
+        if kind == "pdf" and not pdf_supported():
+            return JSONResponse(status_code=501, content={"error": "pdf_support_unavailable"})
+        path = await spool_upload(upload)
+        await form.close()  # drop the multipart spool before parsing
+
+        extractor = GlossaryExtractor()
+        terms: List[Dict[str, str]] = []
+        try:
+            async for text in iter_document_text(path, kind, MAX_REFRESH_CHARS):
+                terms.extend(extractor.feed(text))
+                if extractor.chars > MAX_REFRESH_CHARS:
+                    annotate(text_chars=extractor.chars)
+                    return JSONResponse(status_code=413, content={"error": "payload_too_large"})
+        except DocumentError as exc:
+            return JSONResponse(status_code=422, content={"error": str(exc)})
+        return await _finish_streamed(key, extractor, terms)
+    finally:
+        await form.close()
+        if path:
+            os.unlink(path)
+
+
+async def _refresh_chapter(index: int, item) -> Dict:
+    if isinstance(item, BulkItemError):
+        return {"index": index, "error": str(item)}
+    if not isinstance(item, dict):
+        return {"index": index, "error": "invalid_body"}
+    vak, leerjaar, hoofdstuk = chapter_key(item)
+    result: Dict = {"index": index, "vak": vak, "leerjaar": leerjaar, "hoofdstuk": hoofdstuk}
+    text = str(item.get("text", ""))
+    if len(text) > MAX_REFRESH_CHARS:
+        result["error"] = "payload_too_large"
+        return result
+    digest = text_digest(text)
+    terms = extraction_cache.get(digest)
+    if terms is None:
+        try:
+            terms = await extract_in_pool(text)
+        except Exception:
+            result["error"] = "extraction_failed"
+            return result
+        extraction_cache.put(digest, terms)
+    key = (vak, leerjaar, hoofdstuk)
+    if not await _save_chapter(key, digest, terms, await _stored(key)) and all(key):
+        result["unchanged"] = True
+    result["terms"] = len(terms)
+    return result
+
+
+class _DuplexStreamingResponse(StreamingResponse):
+    # StreamingResponse listens on receive() for a disconnect while it streams,
+    # which would swallow a request body that is still being read. Here the
+    # body iterator itself reads the request, and sees the disconnect.
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
+class _BulkNDJSONResponse(_DuplexStreamingResponse):
+    # run_bulk() runs as a child task of the response, so when the client goes
+    # away mid-stream the in-flight chapters (and their pool jobs) are cancelled
+    # from the task that started them.
+    def __init__(self, items, handle) -> None:
+        self._results, receive = anyio.create_memory_object_stream(math.inf)
+        self._items = items
+        self._handle = handle
+        super().__init__(_ndjson_lines(receive), media_type="application/x-ndjson")
+
+    async def _produce(self) -> None:
+        try:
+            await run_bulk(self._items, self._handle, self._results)
+        except ClientDisconnect:
+            pass  # the request body stopped; what finished is still sent
+
+    async def __call__(self, scope, receive, send) -> None:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(self._produce)
+            try:
+                await self.stream_response(send)
+            except OSError:
+                pass  # the client went away while we were writing
+            finally:
+                tg.cancel_scope.cancel()
+
+
+async def _ndjson_lines(results) -> AsyncIterator[bytes]:
+    ok = failed = 0
+    async with results:
+        async for result in results:
+            if "error" in result:
+                failed += 1
+            else:
+                ok += 1
+            yield json.dumps(result, ensure_ascii=False).encode("utf-8") + b"\n"
+    annotate(chapters=ok + failed, failed=failed)
+
+
+@router.post("/glossary/refresh/bulk")
+async def refresh_glossary_bulk(request: Request):
+    """Refresh many chapters at once.
+
+    JSON in ([{vak, leerjaar, hoofdstuk, text}, ...] or {"chapters": [...]})
+    gives one JSON document with per-chapter results in input order. NDJSON in
+    (one chapter object per line, application/x-ndjson) is read as it streams
+    and answered with NDJSON results in completion order, each carrying the
+    chapter's input index.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in _NDJSON_TYPES:
+        # Allow for JSON escaping of the chapter text on a single line
+        items = iter_ndjson(request.stream(), max_line_bytes=MAX_REFRESH_CHARS * 6 + 4096)
+        return _BulkNDJSONResponse(items, _refresh_chapter)
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    chapters = payload.get("chapters") if isinstance(payload, dict) else payload
+    if not isinstance(chapters, list):
+        return JSONResponse(status_code=422, content={"error": "invalid_body"})
+    results = await collect_bulk(aiter_list(chapters), _refresh_chapter)
+    results.sort(key=lambda r: r["index"])
+    failed = sum(1 for r in results if "error" in r)
+    annotate(chapters=len(results), failed=failed)
+    return {"data": {"chapters": results, "ok": len(results) - failed, "failed": failed}}
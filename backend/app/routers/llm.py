@@ -1,6 +1,8 @@
 import json
+import math
 import os
-from typing import Dict, List
+import time
+from typing import Dict, List, Optional
 
 import anyio
 import yaml
@@ -12,7 +14,15 @@ from app.models.llm import (
     GradeQuizIn,
     GradeQuizOut,
 )
+from app.admission import PRIORITY_BULK, PRIORITY_INTERACTIVE, admission, route_deadline
+from app.audit_log import annotate
+from app.deadline import Deadline, DeadlineExceeded
+from app.drain import drain
+from app.idempotency import mark_storable
+from app.providers import openai_client
 from app.rate_limiter import limiter
+from app.token_budget import budget, estimate_request, record_usage
+from app.usage import Usage, accountant, extract_usage
 
 router = APIRouter()
 
@@ -41,17 +51,27 @@ async def _sleep_backoff(sec: float) -> None:
     await anyio.sleep(sec)
 
 
-async def _moderation_flagged(text: str) -> bool:
+async def _call_provider(fn, **kwargs):
+    # SDK clients are synchronous; run them off the event loop so a slow
+    # provider cannot stall other requests, and so timeouts can abandon them.
+    # An abandoned thread keeps its limiter token until the SDK returns, so
+    # hand the SDK the time left in the enclosing fail_after() as its own
+    # timeout and the thread ends when the request gives up on it.
+    left = anyio.current_effective_deadline() - anyio.current_time()
+    if left != math.inf:
+        kwargs["timeout"] = max(left, 0.0)
+    return await anyio.to_thread.run_sync(lambda: fn(**kwargs), abandon_on_cancel=True)
+
+
+async def _moderation_flagged(text: str, deadline: Optional[Deadline] = None) -> bool:
     prov = os.environ.get("LLM_PROVIDER", "openai").strip().lower()
     if prov != "openai":
         return False
     try:
-        from openai import OpenAI
-
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        client = openai_client()
         model = os.environ.get("OPENAI_MODERATION_MODEL", "omni-moderation-latest")
-        with anyio.fail_after(10):
-            res = client.moderations.create(model=model, input=text)
+        with anyio.fail_after(deadline.cap(10) if deadline else 10):
+            res = await _call_provider(client.moderations.create, model=model, input=text)
         flagged = False
         try:
             flagged = bool(getattr(res, "results")[0].get("flagged", False))  # type: ignore
@@ -62,21 +82,50 @@ async def _moderation_flagged(text: str) -> bool:
         return False
 
 
-async def _openai_generate_hints(topic_id: str, text: str) -> Dict:
-    from openai import OpenAI
+def _tenant_key(x_tenant_id: Optional[str], scope=None) -> Optional[str]:
+    # A signed student identity wins, so every school queues as its own
+    # tenant (at the "*" weight unless configured); the plain header is
+    # client-controlled, so it only selects a tenant LLM_TENANT_WEIGHTS lists.
+    who = limiter.identify(scope) if scope is not None else None
+    if who is not None and who.school:
+        return who.school[:64]
+    tenant = (x_tenant_id or "").strip()
+    if not tenant:
+        return None
+    return tenant if tenant in admission.tenant_weights else "default"
+
+
+def _account_usage(route: str, model: str, tenant: Optional[str], resp, spent: Usage) -> Usage:
+    # Tokens are billed even when the output later fails to parse, so count
+    # every response received, summed over attempts for the audit record.
+    usage = accountant.record(route, model, tenant, extract_usage(resp))
+    record_usage(usage)
+    spent = spent + usage
+    annotate(**spent.as_dict())
+    return spent
+
 
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+async def _openai_generate_hints(topic_id: str, text: str, tenant: Optional[str] = None, deadline: Optional[Deadline] = None) -> Dict:
+    client = openai_client()
     model = os.environ.get("OPENAI_MODEL_HINTS", "gpt-4o-mini")
     system = _load_yaml_prompt("generate_hints.yaml")
     user = json.dumps({"topicId": topic_id, "text": text}, ensure_ascii=False)
 
+    annotate(model=model)
+    t0 = time.perf_counter()
+    spent = Usage()
     for attempt, delay in enumerate([0.0, 0.25, 0.8]):
+        annotate(attempts=attempt + 1)
         try:
+            if deadline is not None:
+                # Give up now rather than sleep into an attempt that cannot finish
+                deadline.check(delay)
             if delay:
                 await _sleep_backoff(delay)
-            with anyio.fail_after(10):
+            with anyio.fail_after(deadline.cap(10) if deadline else 10):
                 try:
-                    resp = client.responses.create(
+                    resp = await _call_provider(
+                        client.responses.create,
                         model=model,
                         input=[
                             {"role": "system", "content": system},
@@ -84,6 +133,7 @@ async def _openai_generate_hints(topic_id: str, text: str) -> Dict:
                         ],
                         response_format={"type": "json_object"},
                     )
+                    spent = _account_usage("generate-hints", model, tenant, resp, spent)
                     content = getattr(resp, "output", None) or getattr(resp, "content", None)
                     text_out = None
                     if isinstance(content, list) and content:
@@ -91,7 +141,8 @@ async def _openai_generate_hints(topic_id: str, text: str) -> Dict:
                     if not text_out:
                         text_out = getattr(resp, "text", None)
                 except Exception:
-                    comp = client.chat.completions.create(
+                    comp = await _call_provider(
+                        client.chat.completions.create,
                         model=model,
                         messages=[
                             {"role": "system", "content": system},
@@ -99,29 +150,41 @@ async def _openai_generate_hints(topic_id: str, text: str) -> Dict:
                         ],
                         response_format={"type": "json_object"},
                     )
+                    spent = _account_usage("generate-hints", model, tenant, comp, spent)
                     text_out = comp.choices[0].message.content
             data = json.loads(text_out or "{}")
+            annotate(provider_ms=round((time.perf_counter() - t0) * 1000, 2))
             return data
+        except DeadlineExceeded:
+            annotate(provider_ms=round((time.perf_counter() - t0) * 1000, 2), deadline_exceeded=True)
+            raise
         except Exception:
             if attempt == 2:
+                annotate(provider_ms=round((time.perf_counter() - t0) * 1000, 2))
                 raise
             continue
 
 
-async def _openai_grade_quiz(answers: List[str]) -> Dict:
-    from openai import OpenAI
-
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+async def _openai_grade_quiz(answers: List[str], tenant: Optional[str] = None, deadline: Optional[Deadline] = None) -> Dict:
+    client = openai_client()
     model = os.environ.get("OPENAI_MODEL_GRADE", "gpt-4o-mini")
     system = _load_yaml_prompt("grade_quiz.yaml")
     user = json.dumps({"answers": answers}, ensure_ascii=False)
 
+    annotate(model=model)
+    t0 = time.perf_counter()
+    spent = Usage()
     for attempt, delay in enumerate([0.0, 0.25, 0.8]):
+        annotate(attempts=attempt + 1)
         try:
+            if deadline is not None:
+                # Give up now rather than sleep into an attempt that cannot finish
+                deadline.check(delay)
             if delay:
                 await _sleep_backoff(delay)
-            with anyio.fail_after(10):
-                comp = client.chat.completions.create(
+            with anyio.fail_after(deadline.cap(10) if deadline else 10):
+                comp = await _call_provider(
+                    client.chat.completions.create,
                     model=model,
                     messages=[
                         {"role": "system", "content": system},
@@ -129,11 +192,17 @@ async def _openai_grade_quiz(answers: List[str]) -> Dict:
                     ],
                     response_format={"type": "json_object"},
                 )
+                spent = _account_usage("grade-quiz", model, tenant, comp, spent)
                 text_out = comp.choices[0].message.content
             data = json.loads(text_out or "{}")
+            annotate(provider_ms=round((time.perf_counter() - t0) * 1000, 2))
             return data
+        except DeadlineExceeded:
+            annotate(provider_ms=round((time.perf_counter() - t0) * 1000, 2), deadline_exceeded=True)
+            raise
         except Exception:
             if attempt == 2:
+                annotate(provider_ms=round((time.perf_counter() - t0) * 1000, 2))
                 raise
             continue
 
@@ -144,92 +213,132 @@ def _echo_emoji_mode(resp: Response, emoji_mode: str | None):
 
 
 @router.post("/generate-hints", response_model=GenerateHintsOut)
-@limiter.limit("60/minute")
 async def generate_hints(
     payload: GenerateHintsIn,
     request: Request,
     response: Response,
     x_emoji_mode: str | None = Header(default=None, alias="X-Emoji-Mode"),
+    x_tenant_id: str | None = Header(default=None, alias="X-Tenant-Id"),
 ):
     if not _bool_env("LLM_ENABLED", False):
         response.headers["X-Studiebot-LLM"] = "disabled"
         _echo_emoji_mode(response, x_emoji_mode)
+        annotate(outcome="disabled")
         return GenerateHintsOut(hints=[], notice="LLM not configured", hint=None)
 
     provider = os.environ.get("LLM_PROVIDER", "openai").strip().lower()
     if provider == "openai" and not os.environ.get("OPENAI_API_KEY"):
         response.headers["X-Studiebot-LLM"] = "disabled"
         _echo_emoji_mode(response, x_emoji_mode)
+        annotate(outcome="not_configured")
         return GenerateHintsOut(hints=[], notice="not_configured", hint=None)
 
-    if await _moderation_flagged(f"{payload.topicId}\n\n{payload.text}"):
-        response.headers["X-Studiebot-LLM"] = "enabled"
-        _echo_emoji_mode(response, x_emoji_mode)
-        return GenerateHintsOut(hints=[], notice="moderation_blocked", hint=None)
+    deadline = Deadline.from_headers(request.headers, "generate-hints")
+    tenant = _tenant_key(x_tenant_id, request.scope)
+    async with drain.track("generate-hints"), admission.slot("generate-hints", PRIORITY_INTERACTIVE, min(route_deadline("generate-hints"), deadline.remaining()), tenant):
+        if await _moderation_flagged(f"{payload.topicId}\n\n{payload.text}", deadline):
+            response.headers["X-Studiebot-LLM"] = "enabled"
+            _echo_emoji_mode(response, x_emoji_mode)
+            annotate(outcome="moderation_blocked")
+            return GenerateHintsOut(hints=[], notice="moderation_blocked", hint=None)
 
-    try:
-        if provider == "openai":
-            data = await _openai_generate_hints(payload.topicId, payload.text)
-        else:
-            data = {}
-        hints_raw = data.get("hints") if isinstance(data, dict) else []
-        if not isinstance(hints_raw, list):
-            hints_raw = []
-        hints = [str(x) for x in hints_raw][:5]
-        single_hint = hints[0] if hints else None
-        out = GenerateHintsOut(hints=hints, hint=single_hint)
-        response.headers["X-Studiebot-LLM"] = "enabled"
-        _echo_emoji_mode(response, x_emoji_mode)
-        return out
-    except Exception:
-        response.headers["X-Studiebot-LLM"] = "enabled"
-        _echo_emoji_mode(response, x_emoji_mode)
-        return GenerateHintsOut(hints=[], notice="provider_error", hint=None)
+        reservation = None
+        if budget.enabled:
+            estimate = estimate_request("generate-hints", _load_yaml_prompt("generate_hints.yaml"), payload.topicId, payload.text)
+            reservation = await budget.reserve_async(request.scope, "generate-hints", estimate)
+
+        try:
+            if provider == "openai":
+                data = await _openai_generate_hints(payload.topicId, payload.text, tenant=tenant, deadline=deadline)
+            else:
+                data = {}
+            hints_raw = data.get("hints") if isinstance(data, dict) else []
+            if not isinstance(hints_raw, list):
+                hints_raw = []
+            hints = [str(x) for x in hints_raw][:5]
+            single_hint = hints[0] if hints else None
+            out = GenerateHintsOut(hints=hints, hint=single_hint)
+            response.headers["X-Studiebot-LLM"] = "enabled"
+            _echo_emoji_mode(response, x_emoji_mode)
+            annotate(outcome="ok")
+            mark_storable(response)
+            return out
+        except Exception:
+            response.headers["X-Studiebot-LLM"] = "enabled"
+            _echo_emoji_mode(response, x_emoji_mode)
+            annotate(outcome="provider_error")
+            return GenerateHintsOut(hints=[], notice="provider_error", hint=None)
+        finally:
+            if reservation is not None:
+                await reservation.settle_async()
 
 
 @router.post("/grade-quiz", response_model=GradeQuizOut)
-@limiter.limit("60/minute")
 async def grade_quiz(
     payload: GradeQuizIn,
     request: Request,
     response: Response,
     x_emoji_mode: str | None = Header(default=None, alias="X-Emoji-Mode"),
+    x_tenant_id: str | None = Header(default=None, alias="X-Tenant-Id"),
 ):
     if not _bool_env("LLM_ENABLED", False):
         response.headers["X-Studiebot-LLM"] = "disabled"
         _echo_emoji_mode(response, x_emoji_mode)
+        annotate(outcome="disabled")
         return GradeQuizOut(score=0, feedback=["LLM not configured"], notice="LLM not configured")
 
     provider = os.environ.get("LLM_PROVIDER", "openai").strip().lower()
     if provider == "openai" and not os.environ.get("OPENAI_API_KEY"):
         response.headers["X-Studiebot-LLM"] = "disabled"
         _echo_emoji_mode(response, x_emoji_mode)
+        annotate(outcome="not_configured")
         return GradeQuizOut(score=0, feedback=["LLM not configured"], notice="not_configured")
 
-    if await _moderation_flagged("\n\n".join([str(a) for a in payload.answers])):
-        response.headers["X-Studiebot-LLM"] = "enabled"
-        _echo_emoji_mode(response, x_emoji_mode)
-        return GradeQuizOut(score=0, feedback=["moderation blocked"], notice="moderation_blocked")
+    deadline = Deadline.from_headers(request.headers, "grade-quiz")
+    tenant = _tenant_key(x_tenant_id, request.scope)
+    async with drain.track("grade-quiz"), admission.slot("grade-quiz", PRIORITY_BULK, min(route_deadline("grade-quiz"), deadline.remaining()), tenant):
+        if await _moderation_flagged("\n\n".join([str(a) for a in payload.answers]), deadline):
+            response.headers["X-Studiebot-LLM"] = "enabled"
+            _echo_emoji_mode(response, x_emoji_mode)
+            annotate(outcome="moderation_blocked")
+            return GradeQuizOut(score=0, feedback=["moderation blocked"], notice="moderation_blocked")
 
-    try:
-        if provider == "openai":
-            data = await _openai_grade_quiz(payload.answers)
-        else:
-            data = {}
-        score = 0
-        feedback: List[str] = []
-        if isinstance(data, dict):
-            score = int(data.get("score", 0))
-            feedback_raw = data.get("feedback", [])
-            if not isinstance(feedback_raw, list):
-                feedback_raw = []
-            feedback = [str(x) for x in feedback_raw][:10]
-        score = max(0, min(100, score))
-        out = GradeQuizOut(score=score, feedback=feedback)
-        response.headers["X-Studiebot-LLM"] = "enabled"
-        _echo_emoji_mode(response, x_emoji_mode)
-        return out
-    except Exception:
-        response.headers["X-Studiebot-LLM"] = "enabled"
-        _echo_emoji_mode(response, x_emoji_mode)
-        return GradeQuizOut(score=0, feedback=["provider error"], notice="provider_error")
\ No newline at end of file
+        reservation = None
+        if budget.enabled:
+            estimate = estimate_request("grade-quiz", _load_yaml_prompt("grade_quiz.yaml"), *[str(a) for a in payload.answers])
+            reservation = await budget.reserve_async(request.scope, "grade-quiz", estimate)
+
+        try:
+            if provider == "openai":
+                data = await _openai_grade_quiz(payload.answers, tenant=tenant, deadline=deadline)
+            else:
+                data = {}
+            score = 0
+            feedback: List[str] = []
+            if isinstance(data, dict):
+                score = int(data.get("score", 0))
+                feedback_raw = data.get("feedback", [])
+                if not isinstance(feedback_raw, list):
+                    feedback_raw = []
+                feedback = [str(x) for x in feedback_raw][:10]
+            score = max(0, min(100, score))
+            out = GradeQuizOut(score=score, feedback=feedback)
+            response.headers["X-Studiebot-LLM"] = "enabled"
+            _echo_emoji_mode(response, x_emoji_mode)
+            annotate(outcome="ok")
+            mark_storable(response)
+            return out
+        except Exception:
+            response.headers["X-Studiebot-LLM"] = "enabled"
+            _echo_emoji_mode(response, x_emoji_mode)
+            annotate(outcome="provider_error")
+            return GradeQuizOut(score=0, feedback=["provider error"], notice="provider_error")
+        finally:
+            if reservation is not None:
+                await reservation.settle_async()
+
+
+@router.get("/usage")
+async def get_usage():
+    totals = await anyio.to_thread.run_sync(accountant.snapshot)
+    return {"data": {"since": accountant.since, "totals": totals}}
@@ -0,0 +1,165 @@
+import math
+import os
+import time
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+import anyio
+
+from app import metrics
+from app.rate_limiter import STORE_ERRORS, RateLimit, limiter, parse_rate, store_from_env
+from app.usage import Usage
+
+# Token-weighted limiting for the LLM routes. Each request reserves its
+# estimated prompt + completion tokens from GCRA buckets whose unit is one
+# token, per client key and globally, over any number of windows. After the
+# provider call the reservation is settled against the real usage.
+#
+#   LLM_TOKEN_BUDGET_KEY="20000/minute;200000/hour;1000000/day"
+#   LLM_TOKEN_BUDGET_GLOBAL="200000/minute;5000000/day"
+#
+# Budgets are off while both are empty. Like the rate limiter, the budget
+# fails open: if its store errors, the request goes ahead unreserved (or its
+# reconciliation is skipped) and the error is counted.
+
+_ACTIVE: ContextVar[Optional["Reservation"]] = ContextVar("token_reservation", default=None)
+
+_REJECTED = metrics.counter("studiebot_llm_token_budget_rejections_total", "Requests rejected by the token budget", ("route", "scope"))
+_RESERVED = metrics.counter("studiebot_llm_token_budget_reserved_total", "Estimated tokens reserved", ("route",))
+_SETTLED = metrics.counter("studiebot_llm_token_budget_settled_total", "Tokens charged after reconciliation", ("route",))
+
+# Completion tokens assumed before the call, per route
+_COMPLETION_ESTIMATE = {"generate-hints": 300, "grade-quiz": 400}
+
+
+class TokenBudgetExceeded(Exception):
+    def __init__(self, retry_after: float, scope: str):
+        super().__init__(f"token budget exceeded ({scope})")
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for Dutch/English prose; errs on the high side
+    # for short inputs, which is the safe direction for a reservation.
+    return math.ceil(len(text) / 4) + 4
+
+
+def estimate_request(route: str, *texts: str) -> int:
+    env = os.environ.get(f"LLM_COMPLETION_ESTIMATE_{route.replace('-', '_').upper()}")
+    completion = int(env) if env else _COMPLETION_ESTIMATE.get(route, 300)
+    return sum(estimate_tokens(t) for t in texts) + completion
+
+
+class Reservation:
+    def __init__(self, budget: "TokenBudget", route: str, hits: List[Tuple[str, RateLimit, int]], estimate: int):
+        self.budget = budget
+        self.route = route
+        self.hits = hits
+        self.estimate = estimate
+        self.actual = 0
+        self.responses = 0
+        self.settled = False
+
+    def add_usage(self, usage: Usage) -> None:
+        self.responses += 1
+        self.actual += usage.prompt_tokens + usage.completion_tokens
+
+    async def settle_async(self) -> None:
+        """settle(), off the event loop for stores that block; runs even when cancelled."""
+        with anyio.CancelScope(shield=True):
+            if getattr(self.budget.store, "blocking", True):
+                await anyio.to_thread.run_sync(self.settle)
+            else:
+                self.settle()
+
+    def settle(self) -> None:
+        if self.settled:
+            return
+        self.settled = True
+        if self.responses == 0:
+            charged = 0  # no provider response: nothing was billed
+        elif self.actual == 0:
+            charged = self.estimate  # provider did not report usage; keep the estimate
+        else:
+            charged = self.actual
+        _SETTLED.inc(charged, route=self.route)
+        now = self.budget.clock()
+        try:
+            for key, rate, reserved in self.hits:
+                # Over-use beyond a window becomes debt that delays later requests
+                if charged != reserved:
+                    self.budget.store.adjust(key, rate, charged - reserved, now)
+        except Exception:
+            STORE_ERRORS.inc(store=type(self.budget.store).__name__)
+
+
+class TokenBudget:
+    def __init__(self, key_limits: List[str], global_limits: List[str], store=None):
+        self.key_limits = [parse_rate(x) for x in key_limits]
+        self.global_limits = [parse_rate(x) for x in global_limits]
+        self.store = store if store is not None else store_from_env()
+        self.clock = time.time
+
+    @classmethod
+    def from_env(cls) -> "TokenBudget":
+        def _rates(name: str) -> List[str]:
+            return [r.strip() for r in os.environ.get(name, "").split(";") if r.strip()]
+
+        return cls(_rates("LLM_TOKEN_BUDGET_KEY"), _rates("LLM_TOKEN_BUDGET_GLOBAL"))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.key_limits or self.global_limits)
+
+    def client_key(self, scope) -> str:
+        who = limiter.identify(scope)
+        if who is not None:
+            return f"student:{who.school or ''}/{who.student}"
+        return f"ip:{limiter.key_func(scope)}"
+
+    def reserve(self, scope, route: str, estimate: int) -> Optional[Reservation]:
+        """Reserve estimated tokens or raise TokenBudgetExceeded."""
+        if not self.enabled:
+            return None
+        key = self.client_key(scope)
+        hits: List[Tuple[str, RateLimit, int]] = []
+        for r in self.key_limits:
+            # A single request may use a whole window, but not more
+            hits.append((f"tokens|{r.text}|{key}", r, min(estimate, r.count)))
+        for r in self.global_limits:
+            hits.append((f"tokens|{r.text}|global", r, min(estimate, r.count)))
+        try:
+            decisions = self.store.hit_many(hits, self.clock())
+        except Exception:
+            STORE_ERRORS.inc(store=type(self.store).__name__)
+            return None
+        denied = [(d, h) for d, h in zip(decisions, hits) if not d.allowed]
+        if denied:
+            d, (k, _, _) = max(denied, key=lambda x: x[0].retry_after)
+            scope_name = "global" if k.endswith("|global") else "key"
+            _REJECTED.inc(route=route, scope=scope_name)
+            raise TokenBudgetExceeded(d.retry_after, scope_name)
+        _RESERVED.inc(estimate, route=route)
+        res = Reservation(self, route, hits, estimate)
+        _ACTIVE.set(res)
+        return res
+
+    async def reserve_async(self, scope, route: str, estimate: int) -> Optional[Reservation]:
+        """reserve(), off the event loop for stores that block."""
+        if not getattr(self.store, "blocking", True):
+            return self.reserve(scope, route, estimate)
+        res = await anyio.to_thread.run_sync(self.reserve, scope, route, estimate)
+        # The worker thread ran in a copy of this context
+        _ACTIVE.set(res)
+        return res
+
+
+def record_usage(usage: Usage) -> None:
+    """Attribute a provider response's usage to the current reservation, if any."""
+    res = _ACTIVE.get()
+    if res is not None:
+        res.add_usage(usage)
+
+
+budget = TokenBudget.from_env()
@@ -0,0 +1,300 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app import metrics
+
+# USD per 1M tokens. Override with LLM_PRICE_TABLE (inline JSON or a path to a
+# JSON file) using the same shape.
+DEFAULT_PRICES: Dict[str, Dict[str, float]] = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+}
+
+_TOKENS = metrics.counter(
+    "studiebot_llm_tokens_total", "Provider tokens by route, model, tenant and kind", ("route", "model", "tenant", "kind")
+)
+_COST = metrics.counter("studiebot_llm_cost_usd_total", "Estimated provider cost in USD", ("route", "model", "tenant"))
+_CALLS = metrics.counter("studiebot_llm_provider_calls_total", "Provider calls with a response", ("route", "model", "tenant"))
+
+
+@dataclass
+class Usage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost_usd: float = 0.0
+
+    def __add__(self, other: "Usage") -> "Usage":
+        return Usage(
+            self.prompt_tokens + other.prompt_tokens,
+            self.completion_tokens + other.completion_tokens,
+            self.cached_tokens + other.cached_tokens,
+            self.cost_usd + other.cost_usd,
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost_usd": round(self.cost_usd, 8),
+        }
+
+
+def _get(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _int(v: Any) -> int:
+    try:
+        return int(v or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def extract_usage(resp: Any) -> Usage:
+    """Read token usage from a Responses or Chat Completions result."""
+    u = _get(resp, "usage")
+    if u is None:
+        return Usage()
+    # Chat Completions: prompt/completion; Responses API: input/output
+    prompt = _get(u, "prompt_tokens")
+    if prompt is None:
+        prompt = _get(u, "input_tokens")
+    completion = _get(u, "completion_tokens")
+    if completion is None:
+        completion = _get(u, "output_tokens")
+    details = _get(u, "prompt_tokens_details") or _get(u, "input_tokens_details")
+    return Usage(_int(prompt), _int(completion), _int(_get(details, "cached_tokens")))
+
+
+def load_price_table() -> Dict[str, Dict[str, float]]:
+    raw = os.environ.get("LLM_PRICE_TABLE", "").strip()
+    if not raw:
+        return DEFAULT_PRICES
+    try:
+        if raw.startswith("{"):
+            return json.loads(raw)
+        with open(raw, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return DEFAULT_PRICES
+
+
+def estimate_cost(model: str, usage: Usage, prices: Dict[str, Dict[str, float]]) -> float:
+    p = prices.get(model)
+    if p is None:
+        # Dated snapshots ("gpt-4o-mini-2024-07-18") price like their base model
+        for name in sorted(prices, key=len, reverse=True):
+            if model.startswith(name):
+                p = prices[name]
+                break
+    if not p:
+        return 0.0
+    cached = min(usage.cached_tokens, usage.prompt_tokens)
+    uncached = usage.prompt_tokens - cached
+    return (
+        uncached * float(p.get("input", 0.0))
+        + cached * float(p.get("cached_input", p.get("input", 0.0)))
+        + usage.completion_tokens * float(p.get("output", 0.0))
+    ) / 1_000_000
+
+
+_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd")
+TotalsKey = Tuple[str, str, str]
+
+# Label for tenants past the cap, so a stream of made-up tenant ids cannot grow
+# the totals (or the metric label sets) without limit
+OTHER_TENANT = "other"
+
+
+class UsageAccountant:
+    """Aggregates usage per (route, model, tenant) and periodically persists it.
+
+    With a store path, each flush adds the usage recorded since the previous
+    flush to per-key rows in a SQLite file (n = n + ?), so every worker on the
+    host can share one file and totals survive restarts without being counted
+    twice. Reads then come from the file plus this worker's unflushed usage.
+    """
+
+    def __init__(self, store_path: Optional[str] = None, flush_seconds: float = 60.0, prices=None, max_tenants: int = 1000):
+        self.store_path = store_path
+        self.flush_seconds = flush_seconds
+        self.prices = prices if prices is not None else load_price_table()
+        self.max_tenants = max_tenants
+        self._totals: Dict[TotalsKey, List[float]] = {}  # without a store: everything since start
+        self._pending: Dict[TotalsKey, List[float]] = {}  # with a store: recorded since the last flush
+        self._tenants: Set[str] = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.since = time.time()
+        if store_path:
+            self._init_store()
+
+    @classmethod
+    def from_env(cls) -> "UsageAccountant":
+        return cls(
+            store_path=os.environ.get("USAGE_STORE_PATH", "").strip() or None,
+            flush_seconds=float(os.environ.get("USAGE_FLUSH_SECONDS", "60")),
+            max_tenants=int(os.environ.get("USAGE_MAX_TENANTS", "1000")),
+        )
+
+    def _tenant_label(self, tenant: Optional[str]) -> str:
+        tenant = tenant or ""
+        if tenant in self._tenants:
+            return tenant
+        if len(self._tenants) >= self.max_tenants:
+            return OTHER_TENANT
+        self._tenants.add(tenant)
+        return tenant
+
+    def record(self, route: str, model: str, tenant: Optional[str], usage: Usage) -> Usage:
+        usage.cost_usd = estimate_cost(model, usage, self.prices)
+        with self._lock:
+            tenant = self._tenant_label(tenant)
+            rows = self._pending if self.store_path else self._totals
+            key = (route, model, tenant)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = [0, 0, 0, 0, 0.0]
+            row[0] += 1
+            row[1] += usage.prompt_tokens
+            row[2] += usage.completion_tokens
+            row[3] += usage.cached_tokens
+            row[4] += usage.cost_usd
+        _CALLS.inc(route=route, model=model, tenant=tenant)
+        _TOKENS.inc(usage.prompt_tokens, route=route, model=model, tenant=tenant, kind="prompt")
+        _TOKENS.inc(usage.completion_tokens, route=route, model=model, tenant=tenant, kind="completion")
+        _TOKENS.inc(usage.cached_tokens, route=route, model=model, tenant=tenant, kind="cached")
+        _COST.inc(usage.cost_usd, route=route, model=model, tenant=tenant)
+        self._ensure_flusher()
+        return usage
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            if self.store_path:
+                totals = {k: list(v) for k, v in self._pending.items()}
+            else:
+                totals = {k: list(v) for k, v in self._totals.items()}
+        if self.store_path:
+            for route, model, tenant, *row in self._conn().execute(f"SELECT route, model, tenant, {', '.join(_FIELDS)} FROM usage_totals"):
+                _add(totals, (route, model, tenant), row)
+        out = []
+        for (route, model, tenant), row in sorted(totals.items()):
+            entry: Dict[str, Any] = {"route": route, "model": model, "tenant": tenant or None}
+            entry.update(zip(_FIELDS, row))
+            entry["cost_usd"] = round(entry["cost_usd"], 8)
+            out.append(entry)
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+            self._pending.clear()
+            self._tenants.clear()
+        if self.store_path:
+            self._conn().execute("DELETE FROM usage_totals")
+
+    def flush(self) -> bool:
+        """Add the usage recorded since the last flush to the store."""
+        if not self.store_path:
+            return False
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return False
+            conn = self._conn()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(
+                        f"INSERT INTO usage_totals (route, model, tenant, {', '.join(_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (route, model, tenant) DO UPDATE SET "
+                        + ", ".join(f"{f} = {f} + excluded.{f}" for f in _FIELDS),
+                        [(*key, *row) for key, row in pending.items()],
+                    )
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error:
+                # Keep the usage for the next flush
+                with self._lock:
+                    for key, row in pending.items():
+                        _add(self._pending, key, row)
+                raise
+            return True
+
+    def start(self) -> None:
+        """Re-arm the background flush after close(); called on lifespan start."""
+        self._stop.clear()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+        self.flush()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.store_path)), exist_ok=True)  # type: ignore[arg-type]
+            conn = sqlite3.connect(self.store_path, timeout=5.0, isolation_level=None)  # type: ignore[arg-type]
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_store(self) -> None:
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage_totals ("
+            "route TEXT NOT NULL, model TEXT NOT NULL, tenant TEXT NOT NULL, "
+            "requests INTEGER NOT NULL, prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+            "cached_tokens INTEGER NOT NULL, cost_usd REAL NOT NULL, PRIMARY KEY (route, model, tenant))"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS usage_meta (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO usage_meta (name, value) VALUES ('since', ?)", (self.since,))
+        self.since = conn.execute("SELECT value FROM usage_meta WHERE name = 'since'").fetchone()[0]
+        self._tenants.update(t for (t,) in conn.execute("SELECT DISTINCT tenant FROM usage_totals LIMIT ?", (self.max_tenants,)))
+
+    def _ensure_flusher(self) -> None:
+        if self._thread is not None or not self.store_path or self.flush_seconds <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="usage-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # pending usage was kept; the next tick retries
+
+
+def _add(totals: Dict[TotalsKey, List[float]], key: TotalsKey, row) -> None:
+    into = totals.get(key)
+    if into is None:
+        totals[key] = list(row)
+    else:
+        for i, v in enumerate(row):
+            into[i] += v
+
+
+accountant = UsageAccountant.from_env()
@@ -0,0 +1,303 @@
+"""
+In-process endpoint benchmarks.
+
+Drives the API through httpx's ASGI transport at a configurable concurrency
+against a simulated-latency provider (or a replayed cassette) and reports
+latency percentiles, throughput, event-loop lag and memory.
+
+    cd backend
+    python -m benchmarks.bench_endpoints --requests 300 --concurrency 16 --out bench.json
+    python -m benchmarks.bench_endpoints --compare bench.json           # run and compare
+    python -m benchmarks.bench_endpoints compare new.json bench.json    # compare two files
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import types
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import anyio
+import httpx
+
+from benchmarks._stats import percentile, summarize_ms
+
+DEFAULT_FAULTS = "latency=lognormal:0.05:0.3,endpoints=chat.completions.create+responses.create,seed=1"
+
+GLOSSARY_TEXT = "Begrippenlijst\n" + "\n".join(
+    f"Begrip {i} — Omschrijving van begrip {i} in een paar woorden." for i in range(60)
+)
+
+RequestSpec = Tuple[str, str, Callable[[int], Dict[str, Any]]]
+
+SCENARIOS: Dict[str, RequestSpec] = {
+    "generate-hints": (
+        "POST",
+        "/api/llm/generate-hints",
+        lambda i: {"json": {"topicId": f"topic-{i % 20}", "text": "Leg uit hoe de Tweede Kamer wetten controleert."}},
+    ),
+    "grade-quiz": (
+        "POST",
+        "/api/llm/grade-quiz",
+        lambda i: {"json": {"answers": [f"Antwoord {j} van leerling {i}" for j in range(10)]}},
+    ),
+    "glossary": (
+        "GET",
+        "/api/glossary",
+        lambda i: {"params": {"vak": "Benchmark", "leerjaar": "1", "hoofdstuk": str(i % 10)}},
+    ),
+    "glossary-refresh": (
+        "POST",
+        "/api/glossary/refresh",
+        lambda i: {"json": {"vak": "Benchmark", "leerjaar": "1", "hoofdstuk": str(i % 10), "text": GLOSSARY_TEXT}},
+    ),
+}
+
+
+class _SimulatedOpenAI:
+    """Canned provider; latency comes from the fault-injection wrapper."""
+
+    def __init__(self, **kwargs):
+        ns = types.SimpleNamespace
+        usage = ns(prompt_tokens=180, completion_tokens=40, prompt_tokens_details=ns(cached_tokens=128))
+
+        def _responses(**kw):
+            text = json.dumps({"hints": ["Denk aan de controlerende taak.", "Wat doet een motie?"]})
+            return ns(content=[ns(text=text)], usage=usage)
+
+        def _chat(**kw):
+            text = json.dumps({"score": 72, "feedback": ["Goed", "Let op de volgorde"]})
+            return ns(choices=[ns(message=ns(content=text))], usage=usage)
+
+        self.responses = ns(create=_responses)
+        self.chat = ns(completions=ns(create=_chat))
+        self.moderations = ns(create=lambda **kw: ns(results=[{"flagged": False}]))
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 2)
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        div = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / div, 2)
+
+
+def configure_provider(faults_spec: str, cassette: Optional[str], latency_scale: float) -> None:
+    os.environ["LLM_ENABLED"] = "true"
+    os.environ["LLM_PROVIDER"] = "openai"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    from app.providers import faults
+
+    if cassette:
+        os.environ["LLM_CASSETTE_MODE"] = "replay"
+        os.environ["LLM_CASSETTE_PATH"] = cassette
+        os.environ["LLM_CASSETTE_MATCH"] = "endpoint"
+        os.environ["LLM_CASSETTE_LATENCY_SCALE"] = str(latency_scale)
+    else:
+        os.environ.pop("LLM_CASSETTE_MODE", None)
+        sys.modules["openai"] = types.SimpleNamespace(OpenAI=_SimulatedOpenAI)  # type: ignore[assignment]
+    faults.set_override(faults.FaultConfig.parse(faults_spec) if faults_spec else None)
+
+
+def build_app(rate_limit: bool):
+    from app.main import create_app
+    from app.rate_limiter import limiter
+
+    limiter.enabled = rate_limit
+    return create_app()
+
+
+async def _lag_monitor(samples: List[float], stop: anyio.Event, interval: float = 0.005) -> None:
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await anyio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - t0 - interval))
+
+
+async def run_scenario(app, name: str, requests: int, concurrency: int, warmup: int = 5, trace_memory: bool = False) -> Dict[str, Any]:
+    method, path, make = SCENARIOS[name]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        if name == "glossary":
+            # Populate the chapters the GETs read
+            for i in range(10):
+                await client.request(*SCENARIOS["glossary-refresh"][:2], **SCENARIOS["glossary-refresh"][2](i))
+        for i in range(warmup):
+            await client.request(method, path, **make(i))
+
+        latencies: List[float] = []
+        statuses: Counter = Counter()
+        notices: Counter = Counter()
+        lag: List[float] = []
+        todo = iter(range(requests))
+        stop = anyio.Event()
+
+        async def worker():
+            for i in todo:
+                t0 = time.perf_counter()
+                r = await client.request(method, path, **make(i))
+                latencies.append(time.perf_counter() - t0)
+                statuses[r.status_code] += 1
+                try:
+                    body = r.json()
+                except ValueError:
+                    body = None
+                if isinstance(body, dict) and body.get("notice"):
+                    notices[body["notice"]] += 1
+
+        if trace_memory:
+            tracemalloc.start()
+        rss_before = _rss_mb()
+        started = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(_lag_monitor, lag, stop)
+            async with anyio.create_task_group() as workers:
+                for _ in range(concurrency):
+                    workers.start_soon(worker)
+            stop.set()
+        elapsed = time.perf_counter() - started
+        peak = None
+        if trace_memory:
+            peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3)
+            tracemalloc.stop()
+
+    result: Dict[str, Any] = {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "errors": sum(c for s, c in statuses.items() if s >= 400),
+        "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+        "notices": dict(notices),
+        "elapsed_s": round(elapsed, 4),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "loop_lag_ms": {
+            "p50": round(percentile(lag, 50) * 1000, 3),
+            "p99": round(percentile(lag, 99) * 1000, 3),
+            "max": round(max(lag) * 1000, 3) if lag else 0.0,
+        },
+        "rss_mb": _rss_mb(),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 2),
+    }
+    result.update(summarize_ms(latencies))
+    if peak is not None:
+        result["tracemalloc_peak_mb"] = peak
+    return result
+
+
+# Metrics where a higher value is worse, and where a lower value is worse
+_HIGHER_WORSE = ("p50_ms", "p95_ms", "p99_ms")
+_LOWER_WORSE = ("rps",)
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.10, min_delta_ms: float = 1.0) -> List[Dict[str, Any]]:
+    """Return one row per compared metric; rows flagged ``regression`` exceed the threshold."""
+    rows = []
+    for name, cur in current.get("results", {}).items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric in _HIGHER_WORSE + _LOWER_WORSE:
+            b, c = base.get(metric), cur.get(metric)
+            if b is None or c is None:
+                continue
+            change = (c - b) / b if b else 0.0
+            if metric in _HIGHER_WORSE:
+                regression = change > threshold and (c - b) > min_delta_ms
+            else:
+                regression = change < -threshold
+            rows.append({"scenario": name, "metric": metric, "baseline": b, "current": c, "change": round(change, 4), "regression": regression})
+    return rows
+
+
+def _print_results(doc: Dict[str, Any]) -> None:
+    print(f"{'scenario':<18}{'n':>6}{'err':>5}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'lag p99':>10}{'rss MB':>9}")
+    for name, r in doc["results"].items():
+        print(
+            f"{name:<18}{r['requests']:>6}{r['errors']:>5}{r['rps']:>10.1f}{r['p50_ms']:>10.2f}"
+            f"{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['loop_lag_ms']['p99']:>10.2f}{r['rss_mb']:>9.1f}"
+        )
+
+
+def _print_comparison(rows: List[Dict[str, Any]]) -> None:
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['scenario']:<18}{row['metric']:<8}{row['baseline']:>12}{row['current']:>12}{row['change'] * 100:>9.1f}% {flag}")
+
+
+async def run_all(args) -> Dict[str, Any]:
+    configure_provider(args.faults, args.cassette, args.latency_scale)
+    app = build_app(args.rate_limit)
+    names = list(SCENARIOS) if args.scenario == ["all"] else args.scenario
+    results = {}
+    for name in names:
+        results[name] = await run_scenario(app, name, args.requests, args.concurrency, args.warmup, args.tracemalloc)
+    return {
+        "meta": {
+            "ts": round(time.time(), 3),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "faults": args.faults,
+            "cassette": args.cassette,
+            "rate_limit": args.rate_limit,
+        },
+        "results": results,
+    }
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] == "compare":
+        p = argparse.ArgumentParser(prog="bench_endpoints compare")
+        p.add_argument("current")
+        p.add_argument("baseline")
+        p.add_argument("--threshold", type=float, default=0.10)
+        a = p.parse_args(argv[1:])
+        rows = compare_results(_load(a.current), _load(a.baseline), a.threshold)
+        _print_comparison(rows)
+        return 1 if any(r["regression"] for r in rows) else 0
+
+    p = argparse.ArgumentParser(prog="bench_endpoints")
+    p.add_argument("--scenario", nargs="+", default=["all"], choices=["all", *SCENARIOS])
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--warmup", type=int, default=5)
+    p.add_argument("--faults", default=DEFAULT_FAULTS, help="provider fault/latency spec (LLM_FAULTS syntax)")
+    p.add_argument("--cassette", default=None, help="replay this cassette instead of the canned provider")
+    p.add_argument("--latency-scale", type=float, default=1.0, help="cassette latency scale")
+    p.add_argument("--rate-limit", action="store_true", help="keep the rate limiter enabled")
+    p.add_argument("--tracemalloc", action="store_true", help="report Python heap peak (slower)")
+    p.add_argument("--out", default=None, help="write machine-readable results here")
+    p.add_argument("--compare", default=None, help="baseline results to compare against")
+    p.add_argument("--threshold", type=float, default=0.10)
+    args = p.parse_args(argv)
+
+    doc = anyio.run(run_all, args)
+    _print_results(doc)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+    if args.compare:
+        rows = compare_results(doc, _load(args.compare), args.threshold)
+        _print_comparison(rows)
+        return 1 if any(r["regression"] for r in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
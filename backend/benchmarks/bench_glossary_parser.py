@@ -0,0 +1,82 @@
+"""
+Glossary extraction on ordinary and adversarial chapter texts.
+
+Runs the current `extract_glossary` next to the previous regex-based line
+parser (kept here verbatim for comparison) on inputs that made the old lazy
+patterns backtrack: one huge line without separators, whitespace runs between
+words, and many long lines. Reports milliseconds per extraction.
+
+    cd backend
+    python -m benchmarks.bench_glossary_parser --sizes 1000 10000 50000
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.glossary_extract import extract_glossary
+
+_LEGACY_DASH = re.compile(r"^\s*([^\-—:|]+?)\s*[—-]\s*(.+)$")
+_LEGACY_COLON = re.compile(r"^\s*([^:|]+?)\s*:\s*(.+)$")
+
+
+def legacy_parse_lines(text: str) -> int:
+    """The old per-line matching loop; returns the number of matched lines."""
+    found = 0
+    for ln in text.splitlines():
+        s = ln.strip()
+        if not s:
+            continue
+        if _LEGACY_DASH.match(s) or _LEGACY_COLON.match(s):
+            found += 1
+    return found
+
+
+def inputs(size: int) -> Dict[str, str]:
+    entry = "Staatsinrichting — Hoe een staat is georganiseerd.\n"
+    return {
+        "regular": "Begrippenlijst\n" + entry * max(1, size // len(entry)),
+        "one_long_line": "woord " * (size // 6),
+        "whitespace_runs": "a" + " " * size + "b",
+        "long_lines": ("x " * 500 + "\n") * max(1, size // 1000),
+    }
+
+
+def time_ms(fn: Callable[[str], Any], text: str, budget_s: float) -> Optional[float]:
+    runs = 0
+    t0 = time.perf_counter()
+    while True:
+        fn(text)
+        runs += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= budget_s or runs >= 50:
+            return round(elapsed / runs * 1000, 3)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="bench_glossary_parser")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    p.add_argument("--budget", type=float, default=0.5, help="seconds per measurement")
+    p.add_argument("--no-legacy", action="store_true", help="skip the old parser (slow on large inputs)")
+    p.add_argument("--out", default=None)
+    args = p.parse_args(argv)
+
+    results: Dict[str, Any] = {}
+    for size in args.sizes:
+        for name, text in inputs(size).items():
+            row = {"chars": len(text), "current_ms": time_ms(extract_glossary, text, args.budget)}
+            if not args.no_legacy:
+                row["legacy_ms"] = time_ms(legacy_parse_lines, text, args.budget)
+            results[f"{name}/{size}"] = row
+            print(f"{name:<18}{size:>8}  " + json.dumps(row))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Per-request overhead of the rate-limiting layer.
+
+Builds two minimal apps with one POST route each: the previous stack
+(slowapi's SlowAPIMiddleware plus the @limiter.limit decorator, only if
+slowapi is installed) and the pure ASGI RateLimitMiddleware, and drives both
+in-process with limits set high enough never to trigger. Also reports the raw
+cost of one hit against the memory and SQLite stores.
+
+    cd backend
+    python -m benchmarks.bench_rate_limiter --requests 5000 --clients 200
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import anyio
+import httpx
+from fastapi import FastAPI, Request
+
+from app.rate_limiter import Limiter, MemoryStore, RateLimitMiddleware, SQLiteStore, parse_rate
+from benchmarks._stats import summarize_ms
+
+HIGH_LIMIT = "1000000/minute"
+
+
+def build_asgi_app() -> FastAPI:
+    app = FastAPI()
+    limiter = Limiter(default_limits=[HIGH_LIMIT], key_func=lambda scope: dict(scope["headers"]).get(b"x-client", b"").decode())
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+    @app.post("/hit")
+    async def hit(request: Request):
+        return {"ok": True}
+
+    return app
+
+
+def build_slowapi_app() -> Optional[FastAPI]:
+    try:
+        from slowapi import Limiter as SlowLimiter
+        from slowapi.middleware import SlowAPIMiddleware
+    except ImportError:
+        return None
+    limiter = SlowLimiter(key_func=lambda request: request.headers.get("x-client", ""), default_limits=[HIGH_LIMIT])
+    app = FastAPI()
+    app.state.limiter = limiter
+    app.add_middleware(SlowAPIMiddleware)
+
+    @app.post("/hit")
+    @limiter.limit(HIGH_LIMIT)
+    async def hit(request: Request):
+        return {"ok": True}
+
+    return app
+
+
+async def drive(app: FastAPI, requests: int, clients: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        todo = iter(range(requests))
+
+        async def worker():
+            for i in todo:
+                t0 = time.perf_counter()
+                r = await client.post("/hit", headers={"x-client": f"c{i % clients}"})
+                latencies.append(time.perf_counter() - t0)
+                assert r.status_code == 200, r.status_code
+
+        started = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for _ in range(concurrency):
+                tg.start_soon(worker)
+        elapsed = time.perf_counter() - started
+    out: Dict[str, Any] = {"requests": requests, "rps": round(requests / elapsed, 1)}
+    out.update(summarize_ms(latencies))
+    return out
+
+
+def bench_store(store, ops: int, keys: int) -> Dict[str, Any]:
+    """Raw GCRA store throughput, without HTTP."""
+    rate = parse_rate(HIGH_LIMIT)
+    now = time.time()
+    t0 = time.perf_counter()
+    for i in range(ops):
+        store.hit(f"k{i % keys}", rate, now)
+    elapsed = time.perf_counter() - t0
+    return {"ops": ops, "keys": len(store), "us_per_op": round(elapsed / ops * 1e6, 2)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(prog="bench_rate_limiter")
+    p.add_argument("--requests", type=int, default=3000)
+    p.add_argument("--clients", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--out", default=None)
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results: Dict[str, Any] = {
+            "store_memory": bench_store(MemoryStore(), 100_000, args.clients),
+            "store_sqlite": bench_store(SQLiteStore(os.path.join(tmp, "rl.db")), 20_000, args.clients),
+        }
+    stacks = {"asgi": build_asgi_app(), "slowapi": build_slowapi_app()}
+    for name, app in stacks.items():
+        if app is None:
+            print(f"{name}: skipped (not installed)")
+            continue
+        results[name] = anyio.run(drive, app, args.requests, args.clients, args.concurrency)
+    for name, r in results.items():
+        print(name, json.dumps(r))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
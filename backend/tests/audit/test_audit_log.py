@@ -0,0 +1,77 @@
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from app.audit_log import AuditLog
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(ln) for ln in f if ln.strip()]
+
+
+def test_llm_and_glossary_requests_are_audited(monkeypatch, tmp_path):
+    log_path = tmp_path / "audit.jsonl"
+    monkeypatch.setenv("AUDIT_LOG_PATH", str(log_path))
+    monkeypatch.delenv("LLM_ENABLED", raising=False)
+    from app.main import create_app
+
+    app = create_app()
+    client = TestClient(app)
+    client.post("/api/llm/generate-hints", json={"topicId": "t", "text": "x"})
+    client.get("/api/glossary", params={"vak": "a", "leerjaar": "1", "hoofdstuk": "1"})
+    client.get("/docs")
+    app.state.audit_log.close()
+
+    records = _read(log_path)
+    assert [r["path"] for r in records] == ["/api/llm/generate-hints", "/api/glossary"]
+    hints = records[0]
+    assert hints["status"] == 200
+    assert hints["outcome"] == "disabled"
+    assert hints["duration_ms"] >= 0
+    assert records[1]["terms"] == 0
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    log = AuditLog(str(tmp_path / "a.jsonl"), max_queue=2)
+    log._ensure_started = lambda: None  # keep the writer stopped so the queue fills
+    assert log.emit({"n": 1}) and log.emit({"n": 2})
+    assert log.emit({"n": 3}) is False
+    assert log.dropped == 1
+
+
+def test_size_rotation(tmp_path):
+    path = tmp_path / "a.jsonl"
+    log = AuditLog(str(path), max_bytes=200, backups=2)
+    for i in range(20):
+        log.emit({"n": i, "pad": "x" * 40})
+    log.close()
+    assert (tmp_path / "a.jsonl.1").exists()
+    assert not (tmp_path / "a.jsonl.3").exists()
+    assert path.stat().st_size <= 200
+
+
+def test_unwritable_path_drops_records_and_keeps_writer(tmp_path):
+    blocker = tmp_path / "logs"
+    blocker.write_text("a file where the log directory should be")
+    log = AuditLog(str(blocker / "a.jsonl"))
+
+    def wait_for(cond):
+        deadline = time.time() + 5
+        while not cond() and time.time() < deadline:
+            time.sleep(0.01)
+        assert cond()
+
+    log.emit({"n": 1})
+    log.emit({"n": 2})
+    wait_for(lambda: log.dropped == 2)
+    assert log.write_errors == 2 and log._thread.is_alive()
+
+    # Once the path is writable again, the same writer picks up
+    blocker.unlink()
+    blocker.mkdir()
+    log.emit({"n": 3})
+    wait_for(lambda: log.written == 1)
+    log.close()
+    assert json.loads((blocker / "a.jsonl").read_text()) == {"n": 3}
@@ -0,0 +1,40 @@
+import sys
+
+import anyio
+
+from benchmarks import bench_endpoints as bench
+from benchmarks._stats import percentile
+
+
+def test_percentile_interpolates():
+    assert percentile([], 50) == 0.0
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([0, 10], 95) == 9.5
+
+
+def test_smoke_run_all_scenarios(monkeypatch):
+    for key in ("LLM_ENABLED", "LLM_PROVIDER", "OPENAI_API_KEY", "LLM_CASSETTE_MODE"):
+        monkeypatch.setenv(key, "")
+    monkeypatch.setitem(sys.modules, "openai", sys.modules.get("openai"))
+    from app.providers import faults
+    from app.rate_limiter import limiter
+
+    try:
+        bench.configure_provider("latency=fixed:0", None, 1.0)
+        app = bench.build_app(rate_limit=False)
+        for name in bench.SCENARIOS:
+            r = anyio.run(bench.run_scenario, app, name, 6, 3, 1)
+            assert r["requests"] == 6
+            assert r["errors"] == 0
+            assert r["p99_ms"] >= r["p50_ms"]
+            assert r["rps"] > 0
+    finally:
+        faults.set_override(None)
+        limiter.enabled = True
+
+
+def test_compare_flags_regressions():
+    base = {"results": {"grade-quiz": {"p50_ms": 100.0, "p95_ms": 200.0, "p99_ms": 300.0, "rps": 50.0}}}
+    cur = {"results": {"grade-quiz": {"p50_ms": 101.0, "p95_ms": 260.0, "p99_ms": 300.5, "rps": 40.0}}}
+    rows = {r["metric"]: r["regression"] for r in bench.compare_results(cur, base, threshold=0.10)}
+    assert rows == {"p50_ms": False, "p95_ms": True, "p99_ms": False, "rps": True}
@@ -0,0 +1,11 @@
+import json
+
+from benchmarks import bench_glossary_parser
+
+
+def test_bench_runs_and_writes_results(tmp_path):
+    out = tmp_path / "parser.json"
+    assert bench_glossary_parser.main(["--sizes", "500", "--budget", "0.01", "--out", str(out)]) == 0
+    results = json.loads(out.read_text())
+    assert set(results) == {"regular/500", "one_long_line/500", "whitespace_runs/500", "long_lines/500"}
+    assert all(row["current_ms"] >= 0 and "legacy_ms" in row for row in results.values())
@@ -4,4 +4,30 @@ from pathlib import Path
 # Ensure '/app/backend' (repo backend root) is on sys.path so 'import app' works
 BACKEND_ROOT = Path(__file__).resolve().parents[1]
 if str(BACKEND_ROOT) not in sys.path:
-    sys.path.insert(0, str(BACKEND_ROOT))
\ No newline at end of file
+    sys.path.insert(0, str(BACKEND_ROOT))
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _reset_rate_limits():
+    # All TestClients share the "testclient" address, so start each test with
+    # fresh buckets.
+    from app.rate_limiter import limiter
+
+    limiter.reset()
+    yield
+
+
+@pytest.fixture
+def fault_injection():
+    """Install a provider fault spec (same syntax as LLM_FAULTS) for one test."""
+    from app.providers import faults
+
+    def _set(spec: str):
+        cfg = faults.FaultConfig.parse(spec)
+        faults.set_override(cfg)
+        return cfg
+
+    yield _set
+    faults.set_override(None)
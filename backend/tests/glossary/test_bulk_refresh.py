@@ -0,0 +1,93 @@
+import json
+
+import anyio
+from fastapi.testclient import TestClient
+
+from app import glossary_bulk
+from app.glossary_bulk import BulkItemError, aiter_list, iter_ndjson
+from app.main import app
+from app.routers.glossary import _BulkNDJSONResponse
+
+client = TestClient(app)
+
+CHAPTER = "Begrippen\nStaat — Georganiseerde gemeenschap\nWet: Regel die voor iedereen geldt\n"
+
+
+def _chapter(hoofdstuk, text=CHAPTER):
+    return {"vak": "Bulk", "leerjaar": "1", "hoofdstuk": str(hoofdstuk), "text": text}
+
+
+def test_json_bulk_in_input_order_with_errors(monkeypatch):
+    monkeypatch.setattr("app.routers.glossary.MAX_REFRESH_CHARS", 200)
+    chapters = [_chapter(1), "geen object", _chapter(3, "x" * 300), _chapter(4, "Begrip\nEen - twee")]
+    r = client.post("/api/glossary/refresh/bulk", json={"chapters": chapters})
+    assert r.status_code == 200
+    data = r.json()["data"]
+    assert (data["ok"], data["failed"]) == (2, 2)
+    assert [c["index"] for c in data["chapters"]] == [0, 1, 2, 3]
+    assert data["chapters"][0]["terms"] == 2
+    assert data["chapters"][1] == {"index": 1, "error": "invalid_body"}
+    assert data["chapters"][2]["error"] == "payload_too_large"
+    assert data["chapters"][3]["terms"] == 1
+
+    stored = client.get("/api/glossary", params={"vak": "Bulk", "leerjaar": "1", "hoofdstuk": "1"}).json()
+    assert [t["term"] for t in stored["data"]["terms"]] == ["Staat", "Wet"]
+    assert client.post("/api/glossary/refresh/bulk", json={"chapters": "nee"}).status_code == 422
+
+
+def test_ndjson_stream_in_process_pool(monkeypatch):
+    # Force every chapter through the worker processes
+    monkeypatch.setattr(glossary_bulk, "INLINE_CHARS", 0)
+
+    def body():
+        for i in range(6):
+            yield (json.dumps(_chapter(10 + i)) + "\n").encode()
+        yield b"{kapot\n"
+
+    r = client.post("/api/glossary/refresh/bulk", content=body(), headers={"content-type": "application/x-ndjson"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    results = sorted((json.loads(line) for line in r.text.splitlines()), key=lambda x: x["index"])
+    assert [x.get("terms") for x in results[:6]] == [2] * 6
+    assert results[6] == {"index": 6, "error": "invalid_json"}
+    stored = client.get("/api/glossary", params={"vak": "Bulk", "leerjaar": "1", "hoofdstuk": "15"}).json()
+    assert len(stored["data"]["terms"]) == 2
+
+
+def test_disconnect_mid_stream_cancels_in_flight_chapters():
+    cancelled = []
+
+    async def handle(index, item):
+        if index == 0:
+            return {"index": 0}
+        try:
+            await anyio.sleep(10)
+        except anyio.get_cancelled_exc_class():
+            cancelled.append(index)
+            raise
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            raise OSError("client went away")
+
+    async def main():
+        response = _BulkNDJSONResponse(aiter_list([{}, {}, {}]), handle)
+        with anyio.fail_after(5):
+            await response({"type": "http"}, None, send)
+
+    anyio.run(main)
+    assert sorted(cancelled) == [1, 2]
+
+
+def test_iter_ndjson_chunk_boundaries_and_long_lines():
+    async def chunks():
+        for piece in (b'{"a"', b': 1}\n\n{"b": 2}', b"\n" + b"x" * 50, b"y" * 50 + b"\n", b'{"c": 3}'):
+            yield piece
+
+    async def main():
+        return [item async for item in iter_ndjson(chunks(), max_line_bytes=40)]
+
+    items = anyio.run(main)
+    assert items[:2] == [{"a": 1}, {"b": 2}]
+    assert isinstance(items[2], BulkItemError) and str(items[2]) == "payload_too_large"
+    assert items[3:] == [{"c": 3}]
@@ -0,0 +1,75 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.glossary_store import CachedGlossaryStore, SQLiteGlossaryStore
+from app.main import app
+
+client = TestClient(app)
+
+PARAMS = {"vak": "Etag", "leerjaar": "1", "hoofdstuk": "1"}
+
+
+def _refresh(text):
+    return client.post("/api/glossary/refresh", json=dict(PARAMS, text=text))
+
+
+def test_conditional_get():
+    _refresh("Begrippen\nStaat — Gemeenschap\n")
+    r = client.get("/api/glossary", params=PARAMS)
+    etag = r.headers["etag"]
+    assert r.status_code == 200 and etag.startswith('"') and r.headers["cache-control"] == "no-cache"
+
+    r = client.get("/api/glossary", params=PARAMS, headers={"If-None-Match": f'"nope", W/{etag}'})
+    assert r.status_code == 304 and r.content == b"" and r.headers["etag"] == etag
+    assert client.get("/api/glossary", params=PARAMS, headers={"If-None-Match": "*"}).status_code == 304
+
+    # An unchanged resubmission keeps the version; an edit does not
+    _refresh("Begrippen\nStaat — Gemeenschap\n")
+    assert client.get("/api/glossary", params=PARAMS, headers={"If-None-Match": etag}).status_code == 304
+    _refresh("Begrippen\nStaat — Andere definitie\n")
+    r = client.get("/api/glossary", params=PARAMS, headers={"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag
+    assert r.json()["data"]["terms"][0]["definition"] == "Andere definitie"
+
+    missing = dict(PARAMS, hoofdstuk="99")
+    assert client.get("/api/glossary", params=missing, headers={"If-None-Match": "*"}).status_code == 200
+
+
+def test_etag_check_does_not_load_terms(tmp_path, monkeypatch):
+    path = str(tmp_path / "g.db")
+    monkeypatch.setattr("app.routers.glossary.glossary_store", CachedGlossaryStore(SQLiteGlossaryStore(path)))
+    monkeypatch.setattr("app.routers.glossary.CACHE_CONTROL", "private, max-age=60")
+    _refresh("Wet: Regel\n")
+    r = client.get("/api/glossary", params=PARAMS)
+    etag = r.headers["etag"]
+    assert r.headers["cache-control"] == "private, max-age=60"
+
+    # Another worker, same database: same ETag, answered without reading the terms
+    other = CachedGlossaryStore(SQLiteGlossaryStore(path))
+    monkeypatch.setattr(other.backend, "get", lambda key: 1 / 0)
+    monkeypatch.setattr("app.routers.glossary.glossary_store", other)
+    assert client.get("/api/glossary", params=PARAMS, headers={"If-None-Match": etag}).status_code == 304
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def test_sqlite_reads_kept_off_the_event_loop(tmp_path, monkeypatch):
+    store = CachedGlossaryStore(SQLiteGlossaryStore(str(tmp_path / "g.db")))
+    on_loop = []
+    for name in ("data_version", "get", "version"):
+        original = getattr(store.backend, name)
+        monkeypatch.setattr(store.backend, name, lambda *a, _f=original: on_loop.append(_on_event_loop()) or _f(*a))
+    monkeypatch.setattr("app.routers.glossary.glossary_store", store)
+
+    _refresh("Wet: Regel\n")
+    etag = client.get("/api/glossary", params=PARAMS).headers["etag"]
+    assert client.get("/api/glossary", params=PARAMS, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/glossary", params=dict(PARAMS, hoofdstuk="2")).json()["data"]["terms"] == []
+    assert on_loop and not any(on_loop)
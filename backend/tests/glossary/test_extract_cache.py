@@ -0,0 +1,60 @@
+from fastapi.testclient import TestClient
+
+from app import glossary_extract
+from app.glossary_extract import ExtractionCache, GlossaryExtractor, extract_glossary_cached, text_digest
+from app.main import app
+
+client = TestClient(app)
+
+CHAPTER = "Begrippen\nStaat — Georganiseerde gemeenschap\nWet: Regel die voor iedereen geldt\n"
+
+
+def test_digest_ignores_line_endings_and_matches_streaming():
+    assert text_digest(CHAPTER) == text_digest(CHAPTER.replace("\n", "\r\n"))
+    assert text_digest(CHAPTER) != text_digest(CHAPTER + "Extra - regel")
+    ex = GlossaryExtractor()
+    for i in range(0, len(CHAPTER), 5):
+        ex.feed(CHAPTER[i : i + 5].replace("\n", "\r\n"))
+    ex.close()
+    assert ex.digest == text_digest(CHAPTER)
+
+
+def test_digest_includes_extractor_version(monkeypatch):
+    before = text_digest(CHAPTER)
+    monkeypatch.setattr(glossary_extract, "EXTRACTOR_VERSION", "test")
+    assert text_digest(CHAPTER) != before
+
+
+def test_cache_is_bounded_and_returns_copies(monkeypatch):
+    cache = ExtractionCache(max_bytes=1000)
+    monkeypatch.setattr(glossary_extract, "extraction_cache", cache)
+    digest, terms = extract_glossary_cached(CHAPTER)
+    terms[0]["term"] = "changed"
+    assert extract_glossary_cached(CHAPTER)[1][0]["term"] == "Staat"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    extract_glossary_cached("a - b")
+    extract_glossary_cached("c - d")
+    assert len(cache) == 2 and cache.nbytes <= 1000 and cache.get(digest) is None
+
+
+def test_refresh_skips_parse_and_write_when_unchanged(monkeypatch):
+    cache = ExtractionCache(max_bytes=1 << 20)
+    monkeypatch.setattr("app.routers.glossary.extraction_cache", cache)
+    params = {"vak": "Cache", "leerjaar": "2", "hoofdstuk": "1"}
+    body = dict(params, text=CHAPTER)
+    first = client.post("/api/glossary/refresh", json=body).json()
+
+    calls = []
+    monkeypatch.setattr("app.routers.glossary.extract_glossary", lambda text: calls.append(text) or [])
+    again = client.post("/api/glossary/refresh", json=body).json()
+    assert again["data"]["terms"] == first["data"]["terms"] and calls == []
+    assert cache.hits == 1
+
+    # The same text streamed as text/plain is recognised as well
+    r = client.post("/api/glossary/refresh", params=params, content=CHAPTER.encode(), headers={"content-type": "text/plain"})
+    assert r.json()["data"]["terms"] == first["data"]["terms"]
+
+    bulk = client.post("/api/glossary/refresh/bulk", json=[body, dict(body, hoofdstuk="2")]).json()["data"]["chapters"]
+    assert bulk[0]["unchanged"] is True and "unchanged" not in bulk[1]
+    assert calls == []
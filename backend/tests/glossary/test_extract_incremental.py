@@ -0,0 +1,46 @@
+from fastapi.testclient import TestClient
+
+from app.glossary_extract import ChapterIndex, diff_terms, extract_glossary
+from app.main import app
+
+client = TestClient(app)
+
+LINES = ["Inleiding: telt niet mee", "Begrippenlijst"] + [f"Begrip {i} — Definitie {i}" for i in range(200)]
+
+
+def test_edit_reparses_only_changed_lines_and_matches_full_extraction():
+    index = ChapterIndex()
+    text = "\n".join(LINES)
+    assert index.extract(text) == extract_glossary(text)
+    assert index.reparsed == len(LINES)
+
+    edited = list(LINES)
+    edited[50] = "Begrip 48 — Verbeterde definitie"
+    edited.insert(0, "Woordenlijst")
+    text = "\n".join(edited)
+    assert index.extract(text) == extract_glossary(text)
+    assert index.reparsed == 2
+
+    # Moving the header changes what earlier lines mean, without reparsing them
+    text = "\n".join(edited[1:] + edited[:1])
+    assert index.extract(text) == extract_glossary(text)
+    assert index.reparsed == 0
+
+
+def test_diff_terms():
+    old = [{"term": "Staat", "definition": "a"}, {"term": "Wet", "definition": "b"}]
+    new = [{"term": "wet", "definition": "b"}, {"term": "Volk", "definition": "c"}]
+    assert diff_terms(old, new) == {"added": ["Volk"], "removed": ["Staat"], "updated": ["wet"]}
+
+
+def test_refresh_reports_changed_terms():
+    body = {"vak": "Incr", "leerjaar": "3", "hoofdstuk": "1", "text": "\n".join(LINES)}
+    first = client.post("/api/glossary/refresh", json=body).json()["data"]
+    assert len(first["changes"]["added"]) == 200
+
+    edited = body["text"].replace("Definitie 7\n", "Nieuw\n").replace("Begrip 9 — Definitie 9\n", "")
+    data = client.post("/api/glossary/refresh", json=dict(body, text=edited)).json()["data"]
+    assert data["changes"] == {"added": [], "removed": ["Begrip 9"], "updated": ["Begrip 7"]}
+    assert data["terms"] == extract_glossary(edited)
+    stored = client.get("/api/glossary", params={"vak": "Incr", "leerjaar": "3", "hoofdstuk": "1"}).json()
+    assert stored["data"]["terms"] == data["terms"]
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from app import glossary_extract
+from app.routers.glossary import extract_glossary, parse_line
+
+
+@pytest.mark.parametrize(
+    "line,expected",
+    [
+        ("Term — definitie", ("Term", "definitie")),
+        ("  Term -  definitie  ", ("Term", "definitie")),
+        ("Democratie: volk - invloed", ("Democratie", "volk - invloed")),
+        ("Term - uitleg: met dubbele punt", ("Term", "uitleg: met dubbele punt")),
+        ("-Term: uitleg", ("-Term", "uitleg")),
+        ("a | b - c", None),
+        ("Term -", None),
+        ("- alleen definitie", None),
+        ("geen scheiding", None),
+    ],
+)
+def test_parse_line_matches_previous_patterns(line, expected):
+    assert parse_line(line) == expected
+
+
+def test_adversarial_lines_are_linear():
+    text = "a" + " " * 200_000 + "b\n" + "woord " * 50_000
+    t0 = time.perf_counter()
+    assert extract_glossary(text) == []
+    assert time.perf_counter() - t0 < 0.5
+
+
+def test_overlong_lines_skipped(monkeypatch):
+    monkeypatch.setattr(glossary_extract, "MAX_LINE_CHARS", 40)
+    text = "Kort — prima\n" + "Lang — " + "x" * 60
+    assert extract_glossary(text) == [{"term": "Kort", "definition": "prima"}]
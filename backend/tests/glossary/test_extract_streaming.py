@@ -0,0 +1,88 @@
+import io
+
+from fastapi.testclient import TestClient
+
+from app.glossary_extract import GlossaryExtractor, extract_glossary, iter_glossary
+from app.main import app
+
+client = TestClient(app)
+
+CHAPTER = """Inleiding: dit hoort niet bij de begrippen
+Begrippenlijst
+Staatsinrichting — Hoe een staat is georganiseerd.
+Democratie: Regeringsvorm waarbij het volk invloed heeft.
+democratie - dubbel, wordt overgeslagen
+"""
+
+TABLE = """Begrippen
+| Begrip | Definitie |
+|--------|-----------|
+| Monarchie | Land met een koning als staatshoofd |
+| Republiek | Land zonder koning |
+"""
+
+
+def _chunked(text, size):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def test_chunked_input_matches_whole_text():
+    for text in (CHAPTER, TABLE, CHAPTER.replace("\n", "\r\n"), "Term - def\rAnder: iets"):
+        expected = extract_glossary(text)
+        for size in (1, 2, 7, 64):
+            assert list(iter_glossary(_chunked(text, size))) == expected
+    assert [t["term"] for t in extract_glossary(CHAPTER)] == ["Staatsinrichting", "Democratie"]
+
+
+def test_file_lines_and_terms_yielded_as_they_go():
+    assert list(iter_glossary(io.StringIO(CHAPTER))) == extract_glossary(CHAPTER)
+
+    ex = GlossaryExtractor()
+    assert ex.feed("Begrippen\nAlfa - een") == []
+    assert ex.feed("\nBeta - twee\n") == [{"term": "Alfa", "definition": "een"}, {"term": "Beta", "definition": "twee"}]
+    assert ex.close() == []
+
+
+def test_held_back_until_known():
+    ex = GlossaryExtractor()
+    # Without a header yet, entries may still be discarded
+    assert ex.feed("Voor - vooraf\n") == []
+    assert ex.feed("Woordenlijst\n| Begrip | Betekenis |\n| Na | erna |\n") == []
+    assert ex.close() == [{"term": "Na", "definition": "erna"}]
+
+
+def test_overlong_line_not_buffered():
+    ex = GlossaryExtractor(max_line_chars=100)
+    ex.feed("Begrippen\n")
+    for _ in range(1000):
+        ex.feed("x" * 50)
+    assert ex._parts == []
+    assert ex.feed("\nTerm - def\n") == [{"term": "Term", "definition": "def"}]
+
+
+def test_refresh_accepts_streamed_text_body():
+    def body():
+        for chunk in _chunked(TABLE.encode("utf-8"), 5):
+            yield chunk
+
+    r = client.post(
+        "/api/glossary/refresh",
+        params={"vak": "Stream", "leerjaar": "1", "hoofdstuk": "1"},
+        content=body(),
+        headers={"content-type": "text/plain; charset=utf-8"},
+    )
+    assert r.status_code == 200
+    assert r.json()["data"]["terms"] == extract_glossary(TABLE)
+    assert {"Monarchie", "Republiek"} <= {t["term"] for t in r.json()["data"]["terms"]}
+    stored = client.get("/api/glossary", params={"vak": "Stream", "leerjaar": "1", "hoofdstuk": "1"}).json()
+    assert stored["data"]["terms"] == r.json()["data"]["terms"]
+
+
+def test_refresh_streamed_latin1_and_cap(monkeypatch):
+    r = client.post("/api/glossary/refresh", content="Begrip\nCafé - koffiehuis\n".encode("latin-1"), headers={"content-type": "text/plain; charset=latin-1"})
+    assert r.json()["data"]["terms"] == [{"term": "Café", "definition": "koffiehuis"}]
+
+    monkeypatch.setattr("app.routers.glossary.MAX_REFRESH_CHARS", 10)
+    r = client.post("/api/glossary/refresh", content=b"Term - def\n" * 5, headers={"content-type": "text/plain"})
+    assert r.status_code == 413
+    assert client.post("/api/glossary/refresh", content=b"[1, 2]", headers={"content-type": "application/json"}).status_code == 422
@@ -0,0 +1,55 @@
+from fastapi.testclient import TestClient
+
+from app.glossary_store import CachedGlossaryStore, MemoryGlossaryStore, SQLiteGlossaryStore, store_from_env
+from app.main import app
+
+client = TestClient(app)
+
+KEY = ("Geschiedenis", "2", "4")
+TERMS = [{"term": "Staat", "definition": "Georganiseerde gemeenschap"}]
+
+
+def test_workers_share_sqlite_store_and_cache_revalidates(tmp_path):
+    path = str(tmp_path / "glossary.db")
+    a = CachedGlossaryStore(SQLiteGlossaryStore(path))
+    b = CachedGlossaryStore(SQLiteGlossaryStore(path))
+    assert b.get(KEY) is None
+
+    assert a.put(KEY, TERMS, "d1").version == 1
+    first = b.get(KEY)
+    assert (first.terms, first.digest, first.version) == (TERMS, "d1", 1)
+
+    # Hot reads come from memory until some connection commits
+    loads = []
+    backend_get = b.backend.get
+    b.backend.get = lambda key: loads.append(key) or backend_get(key)
+    assert b.get(KEY) is first and loads == []
+
+    a.put(("Geschiedenis", "2", "5"), TERMS, "other")
+    assert b.get(KEY) is first and loads == []  # revalidated by version, not reloaded
+
+    a.put(KEY, [], "d2")
+    assert b.get(KEY).version == 2 and loads == [KEY]
+    assert SQLiteGlossaryStore(path).get(KEY).terms == []
+
+
+def test_memory_store_versions_and_env(tmp_path, monkeypatch):
+    store = MemoryGlossaryStore()
+    assert store.version(KEY) == 0
+    store.put(KEY, TERMS, "d")
+    assert store.put(KEY, TERMS, "d").version == 2
+
+    monkeypatch.setenv("GLOSSARY_STORAGE", f"sqlite:///{tmp_path / 'g.db'}")
+    assert isinstance(store_from_env(), CachedGlossaryStore)
+
+
+def test_api_with_sqlite_store(tmp_path, monkeypatch):
+    path = str(tmp_path / "glossary.db")
+    monkeypatch.setattr("app.routers.glossary.glossary_store", CachedGlossaryStore(SQLiteGlossaryStore(path)))
+    body = {"vak": "Sql", "leerjaar": "1", "hoofdstuk": "1", "text": "Begrippen\nStaat — Gemeenschap\n"}
+    assert client.post("/api/glossary/refresh", json=body).status_code == 200
+
+    # Another worker's store sees the write
+    monkeypatch.setattr("app.routers.glossary.glossary_store", CachedGlossaryStore(SQLiteGlossaryStore(path)))
+    r = client.get("/api/glossary", params={"vak": "Sql", "leerjaar": "1", "hoofdstuk": "1"})
+    assert r.json() == {"data": {"terms": [{"term": "Staat", "definition": "Gemeenschap"}]}}
@@ -0,0 +1,80 @@
+from fastapi.testclient import TestClient
+
+from app.glossary_store import (
+    CachedGlossaryStore,
+    Chapter,
+    ChapterLRU,
+    MemoryGlossaryStore,
+    SQLiteGlossaryStore,
+    chapter_bytes,
+    memory_budget,
+    parse_pinned,
+    store_from_env,
+)
+from app.main import app
+
+
+def _terms(n, width=50):
+    return [{"term": f"T{i}", "definition": "x" * width} for i in range(n)]
+
+
+def test_lru_evicts_by_bytes_and_keeps_pinned():
+    lru = ChapterLRU(max_bytes=100, layer="test", pinned=[("a", "1", "1")])
+    lru.put(("a", "1", "1"), "pinned", 40)
+    lru.put(("a", "1", "2"), "old", 40)
+    lru.put(("a", "1", "3"), "new", 40)
+    assert ("a", "1", "2") not in lru and lru.get(("a", "1", "1")) == "pinned"
+    assert (lru.bytes, lru.evictions) == (80, 1)
+
+    # An oversized write keeps only itself and the pinned chapter, until the next trim
+    lru.put(("a", "1", "4"), "big", 500)
+    assert len(lru) == 2 and lru.evictions == 2
+    lru.unpin(("a", "1", "1"))
+    assert len(lru) == 0 and lru.bytes == 0 and lru.evictions == 4
+
+
+def test_memory_store_bounded_with_global_versions():
+    one = chapter_bytes(Chapter(_terms(10), "", 0))
+    store = MemoryGlossaryStore(max_bytes=3 * one)
+    for i in range(10):
+        store.put(("Vak", "1", str(i)), _terms(10), f"d{i}")
+    assert len(store.chapters) == 3 and store.chapters.bytes == 3 * one
+    assert store.get(("Vak", "1", "0")) is None and store.get(("Vak", "1", "9")).version == 10
+
+    # A chapter written again after eviction gets a fresh version
+    assert store.put(("Vak", "1", "0"), [], "d").version == 11
+
+
+def test_sqlite_cache_eviction_only_drops_the_copy(tmp_path):
+    one = chapter_bytes(Chapter(_terms(10), "", 0))
+    store = CachedGlossaryStore(SQLiteGlossaryStore(str(tmp_path / "g.db")), max_bytes=one)
+    store.put(("Vak", "1", "1"), _terms(10), "a")
+    store.put(("Vak", "1", "2"), _terms(10), "b")
+    assert store.cache.evictions == 1 and ("Vak", "1", "1") not in store.cache
+    assert len(store.get(("Vak", "1", "1")).terms) == 10
+
+
+def test_pinned_from_env(monkeypatch):
+    assert parse_pinned("Geschiedenis/2/4, Aardrijkskunde / 1 / 3,kapot") == [("Geschiedenis", "2", "4"), ("Aardrijkskunde", "1", "3")]
+    monkeypatch.setenv("GLOSSARY_MEMORY_BYTES", "1")
+    monkeypatch.setenv("GLOSSARY_PINNED_CHAPTERS", "Vak/1/1")
+    store = store_from_env()
+    store.put(("Vak", "1", "1"), _terms(3), "a")
+    store.put(("Vak", "1", "2"), _terms(3), "b")
+    store.put(("Vak", "1", "3"), _terms(3), "c")
+    assert store.get(("Vak", "1", "1")) is not None and store.get(("Vak", "1", "2")) is None
+
+
+def test_indexes_share_the_memory_budget(monkeypatch):
+    monkeypatch.setenv("GLOSSARY_MEMORY_BYTES", "24000")
+    assert [memory_budget(layer) for layer in ("store", "index", "extract")] == [18000, 3000, 3000]
+
+    indexes = ChapterLRU(memory_budget("index"), "index")
+    monkeypatch.setattr("app.routers.glossary._INDEXES", indexes)
+    client = TestClient(app)
+    for i in range(3):
+        text = "Begrippen\n" + "\n".join(f"Term{i}x{j} - uitleg {j}" for j in range(3))
+        body = {"vak": "Budget", "leerjaar": "1", "hoofdstuk": str(i), "text": text}
+        assert client.post("/api/glossary/refresh", json=body).status_code == 200
+    assert indexes.evictions == 1 and 0 < indexes.bytes <= 3000
+    assert ("Budget", "1", "2") in indexes and ("Budget", "1", "0") not in indexes
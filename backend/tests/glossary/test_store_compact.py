@@ -0,0 +1,44 @@
+import json
+
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse
+
+from app.glossary_store import Chapter, CompactTerms, SQLiteGlossaryStore
+from app.main import app
+
+client = TestClient(app)
+
+TERMS = [
+    {"term": "Staat", "definition": "Georganiseerde gemeenschap"},
+    {"term": "Wet", "definition": ""},
+    {"term": "Één", "definition": 'Met "aanhalingstekens" en ü'},
+]
+
+
+def test_compact_terms_round_trip():
+    compact = CompactTerms(TERMS)
+    assert compact.to_list() == TERMS and len(compact) == 3
+    assert compact.definition(2) == TERMS[2]["definition"]
+    assert compact.names[0] is CompactTerms([{"term": "Sta" + "at", "definition": ""}]).names[0]
+
+    chapter = Chapter(TERMS, "d", 1)
+    assert json.loads(chapter.terms_json) == TERMS
+    assert Chapter.from_json(chapter.terms_json, "d", 1).terms == TERMS
+
+
+def test_sqlite_store_keeps_serialized_terms(tmp_path):
+    store = SQLiteGlossaryStore(str(tmp_path / "g.db"))
+    written = store.put(("V", "1", "1"), TERMS, "d")
+    assert store.get(("V", "1", "1")).terms_json == written.terms_json
+
+
+def test_get_writes_preserialized_bytes(monkeypatch):
+    body = {"vak": "Compact", "leerjaar": "1", "hoofdstuk": "1", "text": "Begrippen\n" + "\n".join(f"{t['term']}: {t['definition'] or '-'}" for t in TERMS)}
+    terms = client.post("/api/glossary/refresh", json=body).json()["data"]["terms"]
+
+    # GET must not rebuild the term dicts
+    monkeypatch.setattr(Chapter, "terms", property(lambda self: 1 / 0))
+    r = client.get("/api/glossary", params={"vak": "Compact", "leerjaar": "1", "hoofdstuk": "1"})
+    assert r.headers["content-type"] == "application/json"
+    assert r.content == JSONResponse({"data": {"terms": terms}}).body
+    assert client.get("/api/glossary").json() == {"data": {"terms": []}}
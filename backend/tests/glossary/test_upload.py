@@ -0,0 +1,101 @@
+import io
+import zipfile
+
+from fastapi.testclient import TestClient
+
+from app import glossary_documents
+from app.glossary_documents import docx_paragraphs
+from app.main import app
+
+client = TestClient(app)
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def _p(text):
+    return f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>"
+
+
+def _row(*cells):
+    return "<w:tr>" + "".join(f"<w:tc>{_p(c)}</w:tc>" for c in cells) + "</w:tr>"
+
+
+def _docx(body):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("[Content_Types].xml", "<Types/>")
+        zf.writestr("word/document.xml", f'<w:document xmlns:w="{W}"><w:body>{body}</w:body></w:document>')
+    return buf.getvalue()
+
+
+CHAPTER = _docx(_p("Inleiding") + _p("Begrippenlijst") + _p("Staat — Georganiseerde gemeenschap") + _p("Wet: Regel voor iedereen"))
+
+
+def test_upload_docx():
+    files = {"file": ("h1.docx", CHAPTER, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+    r = client.post("/api/glossary/upload", files=files, data={"vak": "Doc", "leerjaar": "1", "hoofdstuk": "1"})
+    assert r.status_code == 200
+    assert [t["term"] for t in r.json()["data"]["terms"]] == ["Staat", "Wet"]
+    stored = client.get("/api/glossary", params={"vak": "Doc", "leerjaar": "1", "hoofdstuk": "1"}).json()
+    assert len(stored["data"]["terms"]) == 2
+
+
+def test_docx_tables_become_rows(tmp_path):
+    path = tmp_path / "t.docx"
+    path.write_bytes(_docx(_p("Begrippen") + "<w:tbl>" + _row("Begrip", "Definitie") + _row("Monarchie", "Land met een koning") + "</w:tbl>"))
+    rows = ["Begrippen", "| Begrip | Definitie |", "| Monarchie | Land met een koning |"]
+    assert docx_paragraphs(str(path), 0, 100, 10_000) == (False, rows)
+    assert docx_paragraphs(str(path), 0, 100, 5) == (False, ["Begrippen"])
+
+
+def test_docx_nested_table_keeps_outer_cells(tmp_path):
+    nested = "<w:tbl>" + _row("land", "met een koning") + "</w:tbl>"
+    outer = "<w:tr><w:tc>" + _p("Monarchie") + "</w:tc><w:tc>" + _p("Staatsvorm") + nested + "</w:tc></w:tr>"
+    path = tmp_path / "n.docx"
+    path.write_bytes(_docx("<w:tbl>" + _row("Begrip", "Definitie") + outer + "</w:tbl>"))
+    assert docx_paragraphs(str(path), 0, 100, 10_000)[1] == [
+        "| Begrip | Definitie |",
+        "| Monarchie | Staatsvorm land met een koning |",
+    ]
+
+
+def test_docx_read_in_batches(tmp_path, monkeypatch):
+    path = tmp_path / "b.docx"
+    path.write_bytes(_docx("".join(_p(f"Alinea {i}") for i in range(5))))
+    assert docx_paragraphs(str(path), 2, 4, 10_000) == (True, ["Alinea 2", "Alinea 3"])
+    assert docx_paragraphs(str(path), 4, 6, 10_000) == (False, ["Alinea 4"])
+
+    monkeypatch.setattr(glossary_documents, "DOCX_PARAGRAPH_BATCH", 2)
+    files = {"file": ("h2.docx", CHAPTER)}
+    r = client.post("/api/glossary/upload", files=files, data={"vak": "Doc", "leerjaar": "1", "hoofdstuk": "2"})
+    assert [t["term"] for t in r.json()["data"]["terms"]] == ["Staat", "Wet"]
+
+
+def test_upload_errors(monkeypatch):
+    assert client.post("/api/glossary/upload", files={"file": ("a.txt", b"platte tekst")}).status_code == 415
+    assert client.post("/api/glossary/upload", data={"vak": "x"}).json() == {"error": "invalid_body"}
+    r = client.post("/api/glossary/upload", files={"file": ("kapot.docx", b"PK\x03\x04kapot")})
+    assert r.status_code == 422 and r.json() == {"error": "unreadable_document"}
+
+    monkeypatch.setattr("app.routers.glossary.pdf_supported", lambda: False)
+    r = client.post("/api/glossary/upload", files={"file": ("h.pdf", b"%PDF-1.4\n")})
+    assert r.status_code == 501 and r.json() == {"error": "pdf_support_unavailable"}
+
+
+def test_upload_text_cap(monkeypatch):
+    monkeypatch.setattr("app.routers.glossary.MAX_REFRESH_CHARS", 20)
+    r = client.post("/api/glossary/upload", files={"file": ("h1.docx", CHAPTER)})
+    assert r.status_code == 413
+
+
+def test_pdf_pages_in_batches(monkeypatch):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(width=100, height=100)
+    buf = io.BytesIO()
+    writer.write(buf)
+    monkeypatch.setattr(glossary_documents, "PDF_PAGE_BATCH", 2)
+    r = client.post("/api/glossary/upload", files={"file": ("leeg.pdf", buf.getvalue())})
+    assert r.status_code == 200 and r.json()["data"]["terms"] == []
@@ -0,0 +1,188 @@
+import hashlib
+import hmac
+
+import anyio
+import pytest
+from fastapi.testclient import TestClient
+
+from app.admission import PRIORITY_BULK, PRIORITY_INTERACTIVE, AdmissionController, Overloaded, parse_weights
+from app.main import app
+from app.routers import llm
+
+client = TestClient(app)
+
+
+def test_interactive_requests_served_before_bulk():
+    ctl = AdmissionController(max_concurrency=1, max_queue=10, expected_service=0.01)
+    order = []
+
+    async def job(name, priority):
+        async with ctl.slot(name, priority, deadline=5):
+            order.append(name)
+            await anyio.sleep(0.01)
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(job, "first", PRIORITY_BULK)
+            await anyio.wait_all_tasks_blocked()
+            tg.start_soon(job, "bulk", PRIORITY_BULK)
+            await anyio.wait_all_tasks_blocked()
+            tg.start_soon(job, "hint", PRIORITY_INTERACTIVE)
+
+    anyio.run(main)
+    assert order == ["first", "hint", "bulk"]
+    assert ctl.active == 0 and ctl.queue_depth == 0
+
+
+def test_rejects_early_when_expected_wait_exceeds_deadline():
+    ctl = AdmissionController(max_concurrency=1, max_queue=10, expected_service=2.0)
+    ctl.active = 1
+
+    async def main():
+        with pytest.raises(Overloaded) as exc:
+            await ctl.acquire("grade-quiz", PRIORITY_BULK, deadline=1.0)
+        assert exc.value.reason == "deadline"
+        assert exc.value.retry_after == 2.0
+
+    anyio.run(main)
+    assert ctl.queue_depth == 0
+
+
+def test_queued_request_times_out_and_leaves_queue():
+    ctl = AdmissionController(max_concurrency=1, max_queue=10, expected_service=0.01)
+    ctl.active = 1
+
+    async def main():
+        with pytest.raises(Overloaded) as exc:
+            await ctl.acquire("generate-hints", PRIORITY_INTERACTIVE, deadline=0.05)
+        assert exc.value.reason == "timeout"
+        # The freed slot is not handed to the abandoned waiter
+        ctl.release()
+
+    anyio.run(main)
+    assert ctl.active == 0 and ctl.queue_depth == 0
+
+
+def test_cancel_right_after_hand_off_passes_the_slot_on():
+    ctl = AdmissionController(max_concurrency=1, max_queue=10)
+    ctl.active = 1
+    results = []
+
+    async def main():
+        cancelled = anyio.CancelScope()
+
+        async def cancelled_waiter():
+            with cancelled:
+                await ctl.acquire("grade-quiz", PRIORITY_BULK, deadline=10)
+                results.append("cancelled waiter admitted")
+
+        async def next_waiter():
+            await ctl.acquire("grade-quiz", PRIORITY_BULK, deadline=10)
+            results.append("next waiter admitted")
+            ctl.release()
+
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(cancelled_waiter)
+            await anyio.wait_all_tasks_blocked()
+            tg.start_soon(next_waiter)
+            await anyio.wait_all_tasks_blocked()
+            # The cancellation is pending when release() hands over the slot
+            cancelled.cancel()
+            ctl.release()
+
+    anyio.run(main)
+    assert results == ["next waiter admitted"]
+    assert ctl.active == 0 and ctl.queue_depth == 0
+
+
+def test_queue_full_rejected():
+    ctl = AdmissionController(max_concurrency=1, max_queue=0)
+    ctl.active = 1
+
+    async def main():
+        with pytest.raises(Overloaded) as exc:
+            await ctl.acquire("generate-hints", PRIORITY_INTERACTIVE, deadline=10)
+        assert exc.value.reason == "queue_full"
+
+    anyio.run(main)
+
+
+def test_overloaded_route_returns_503(monkeypatch):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("LLM_QUEUE_DEADLINE_GENERATE_HINTS", "1")
+    ctl = AdmissionController(max_concurrency=1, expected_service=4.0)
+    ctl.active = 1
+    monkeypatch.setattr("app.routers.llm.admission", ctl)
+
+    r = client.post("/api/llm/generate-hints", json={"topicId": "t", "text": "x"})
+    assert r.status_code == 503
+    assert r.json() == {"error": "overloaded"}
+    assert r.headers["Retry-After"] == "4"
+
+
+def _served_order(ctl, arrivals):
+    order = []
+
+    async def job(tenant):
+        async with ctl.slot("grade-quiz", PRIORITY_BULK, deadline=5, tenant=tenant):
+            order.append(tenant)
+            await anyio.sleep(0.005)
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            for tenant in arrivals:
+                tg.start_soon(job, tenant)
+                await anyio.sleep(0)
+
+    anyio.run(main)
+    return order
+
+
+def test_bulk_run_does_not_starve_other_tenant():
+    ctl = AdmissionController(max_concurrency=1, expected_service=0.01)
+    order = _served_order(ctl, ["a"] * 6 + ["b"] * 2)
+    # b's requests arrive last but are interleaved with a's backlog
+    assert "".join(order) == "aababaaa"
+
+
+def test_weights_set_share_and_idle_capacity_is_borrowed():
+    ctl = AdmissionController(max_concurrency=1, expected_service=0.01, tenant_weights=parse_weights("a=2,b=1"))
+    order = _served_order(ctl, ["a"] * 6 + ["b"] * 6)
+    # While both are backlogged a gets two slots for each of b's
+    assert "".join(order) == "aaabaababbbb"
+
+    # A single tenant uses every slot when nobody else is waiting
+    ctl = AdmissionController(max_concurrency=2, expected_service=0.01, tenant_weights=parse_weights("a=1,b=9"))
+    assert _served_order(ctl, ["a"] * 5) == ["a"] * 5
+    assert ctl.active == 0
+
+
+def _signed_scope(key, subject, tenant_header=None):
+    sig = hmac.new(key.encode(), subject.encode(), hashlib.sha256).hexdigest()
+    headers = [(b"x-student-token", f"{subject}.{sig}".encode())]
+    if tenant_header:
+        headers.append((b"x-tenant-id", tenant_header.encode()))
+    return {"type": "http", "path": "/api/llm/grade-quiz", "headers": headers, "client": ("1.2.3.4", 1)}
+
+
+def test_unconfigured_signed_schools_each_get_a_share(monkeypatch):
+    monkeypatch.setattr(llm.limiter, "signing_key", "k")
+    ctl = AdmissionController(max_concurrency=1, expected_service=0.01)
+    monkeypatch.setattr(llm, "admission", ctl)
+
+    a = llm._tenant_key("made-up", _signed_scope("k", "school-a/s1", "made-up"))
+    b = llm._tenant_key(None, _signed_scope("k", "school-b/s2"))
+    assert (a, b) == ("school-a", "school-b")
+    # A plain header only picks a configured tenant
+    assert llm._tenant_key("made-up") == "default"
+
+    # Neither school is in LLM_TENANT_WEIGHTS, yet b is not stuck behind a's backlog
+    order = _served_order(ctl, [a] * 6 + [b] * 2)
+    assert [t[-1] for t in order] == list("aababaaa")
+    assert ctl._tenant_label(a) == "other"
+
+
+def test_parse_weights():
+    assert parse_weights("a=3, b=0.5,*=2,bad,c=x,d=0") == {"a": 3.0, "b": 0.5, "*": 2.0}
@@ -0,0 +1,76 @@
+import json
+import sys
+import time
+import types
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.providers import cassette
+
+client = TestClient(app)
+
+# Hand-written in the cassette format (no real provider session behind it);
+# test_record_then_replay_with_scaled_latency checks the format against what
+# RecordingClient writes.
+CASSETTE = Path(__file__).resolve().parents[1] / "cassettes" / "openai_pipeline.jsonl"
+
+
+def _enable(monkeypatch, mode, path, scale="0"):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("LLM_CASSETTE_MODE", mode)
+    monkeypatch.setenv("LLM_CASSETTE_PATH", str(path))
+    monkeypatch.setenv("LLM_CASSETTE_LATENCY_SCALE", scale)
+    monkeypatch.delenv("OPENAI_MODEL_HINTS", raising=False)
+    monkeypatch.delenv("OPENAI_MODEL_GRADE", raising=False)
+    cassette.reset_cassettes()
+
+
+def test_replay_full_pipeline_offline(monkeypatch):
+    _enable(monkeypatch, "replay", CASSETTE)
+
+    r = client.post("/api/llm/generate-hints", json={"topicId": "staatsinrichting", "text": "Wat is democratie?"})
+    assert r.json()["hints"][0] == "Denk aan wie de wetten maakt."
+
+    r2 = client.post("/api/llm/grade-quiz", json={"answers": ["De macht is verdeeld in drie delen."]})
+    assert r2.json()["score"] == 75
+    assert len(r2.json()["feedback"]) == 2
+
+
+def test_unrecorded_request_is_a_provider_error(monkeypatch):
+    _enable(monkeypatch, "replay", CASSETTE)
+    r = client.post("/api/llm/grade-quiz", json={"answers": ["iets anders"]})
+    assert r.json()["notice"] == "provider_error"
+
+
+def test_record_then_replay_with_scaled_latency(monkeypatch, tmp_path):
+    class Completions:
+        def create(self, **kwargs):
+            time.sleep(0.2)
+            msg = types.SimpleNamespace(content=json.dumps({"score": 61, "feedback": ["x"]}))
+            return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)])
+
+    class StubOpenAI:
+        def __init__(self, **kwargs):
+            self.chat = types.SimpleNamespace(completions=Completions())
+            self.moderations = types.SimpleNamespace(create=lambda **kw: {"results": [{"flagged": False}]})
+
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=StubOpenAI))
+    path = tmp_path / "rec.jsonl"
+    _enable(monkeypatch, "record", path)
+    assert client.post("/api/llm/grade-quiz", json={"answers": ["a"]}).json()["score"] == 61
+    recorded = [json.loads(ln) for ln in path.read_text().splitlines()]
+    assert [r["endpoint"] for r in recorded] == ["moderations.create", "chat.completions.create"]
+    assert recorded[1]["elapsed_s"] >= 0.2
+    fixture = [json.loads(ln) for ln in CASSETTE.read_text().splitlines()]
+    assert {frozenset(r) for r in recorded} <= {frozenset(f) for f in fixture}
+
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace())  # replay must not need the SDK
+    _enable(monkeypatch, "replay", path, scale="0.25")
+    t0 = time.perf_counter()
+    assert client.post("/api/llm/grade-quiz", json={"answers": ["a"]}).json()["score"] == 61
+    elapsed = time.perf_counter() - t0
+    assert 0.05 <= elapsed < 0.2
@@ -0,0 +1,116 @@
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+
+import anyio
+import pytest
+from fastapi.testclient import TestClient
+
+from app.deadline import Deadline, DeadlineExceeded
+from app.main import app
+from app.providers import cassette, openai_client
+from app.routers import llm
+
+client = TestClient(app)
+
+CASSETTE = Path(__file__).resolve().parents[1] / "cassettes" / "openai_pipeline.jsonl"
+GRADE = {"answers": ["De macht is verdeeld in drie delen."]}
+
+
+@pytest.fixture(autouse=True)
+def replay_provider(monkeypatch):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("LLM_CASSETTE_MODE", "replay")
+    monkeypatch.setenv("LLM_CASSETTE_PATH", str(CASSETTE))
+    monkeypatch.setenv("LLM_CASSETTE_LATENCY_SCALE", "0")
+    monkeypatch.delenv("OPENAI_MODEL_GRADE", raising=False)
+    cassette.reset_cassettes()
+
+
+def test_header_parsing(monkeypatch):
+    monkeypatch.setenv("LLM_REQUEST_TIMEOUT_GRADE_QUIZ", "20")
+    assert 19 < Deadline.from_headers({}, "grade-quiz").remaining() <= 20
+    assert Deadline.from_headers({"x-request-timeout": "2.5"}, "grade-quiz").remaining() <= 2.5
+    # The server default caps what a client may ask for
+    assert Deadline.from_headers({"x-request-timeout": "600"}, "grade-quiz").remaining() <= 20
+    absolute = str(time.time() + 3)
+    assert 2 < Deadline.from_headers({"x-request-deadline": absolute}, "grade-quiz").remaining() <= 3
+    assert Deadline.from_headers({"x-request-deadline": str(time.time() - 5)}, "grade-quiz").expired
+    assert Deadline.from_headers({"x-request-timeout": "soon"}, "grade-quiz").remaining() > 19
+
+
+def test_check_accounts_for_backoff():
+    dl = Deadline(0.5)
+    dl.check(0.25)
+    with pytest.raises(DeadlineExceeded):
+        dl.check(0.8)
+
+
+def test_within_budget_succeeds():
+    r = client.post("/api/llm/grade-quiz", json=GRADE, headers={"X-Request-Timeout": "5"})
+    assert r.json()["score"] == 75
+
+
+def test_stalled_provider_returns_at_deadline(fault_injection):
+    # Without a budget this would block for a full second per attempt, three times
+    fault_injection("stall=1:1,endpoints=chat.completions.create")
+    t0 = time.perf_counter()
+    r = client.post("/api/llm/grade-quiz", json=GRADE, headers={"X-Request-Timeout": "0.3"})
+    elapsed = time.perf_counter() - t0
+    assert r.json()["notice"] == "provider_error"
+    assert elapsed < 0.8
+
+
+def test_expired_deadline_fails_fast(fault_injection):
+    fault_injection("latency=fixed:0.5,endpoints=chat.completions.create")
+    t0 = time.perf_counter()
+    r = client.post("/api/llm/grade-quiz", json=GRADE, headers={"X-Request-Deadline": str(time.time() - 1)})
+    assert r.json()["notice"] == "provider_error"
+    assert time.perf_counter() - t0 < 0.4
+
+
+def test_stalled_call_ends_its_thread_at_deadline(monkeypatch):
+    released = threading.Event()
+    returned = threading.Event()
+    seen = []
+
+    def create(**kwargs):
+        # Behaves like the SDK: gives up once its own timeout has passed
+        seen.append(kwargs.get("timeout"))
+        try:
+            released.wait(kwargs.get("timeout", 30))
+            raise TimeoutError("request timed out")
+        finally:
+            returned.set()
+
+    stub = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm, "openai_client", lambda: stub)
+
+    async def main():
+        with pytest.raises(DeadlineExceeded):
+            await llm._openai_grade_quiz(["x"], deadline=Deadline(0.3))
+
+    try:
+        anyio.run(main)
+        # The abandoned worker thread is free again rather than stuck in the SDK
+        assert returned.wait(0.2)
+    finally:
+        released.set()
+    assert seen and all(t is not None and t <= 0.3 for t in seen)
+
+
+def test_client_leaves_retries_to_the_router(monkeypatch):
+    built = {}
+
+    class StubOpenAI:
+        def __init__(self, **kwargs):
+            built.update(kwargs)
+
+    monkeypatch.setenv("LLM_CASSETTE_MODE", "")
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=StubOpenAI))
+    openai_client()
+    assert built["max_retries"] == 0
@@ -0,0 +1,118 @@
+import os
+import signal
+import time
+from pathlib import Path
+
+import anyio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.admission import Overloaded
+from app.drain import Drain, drain
+from app.main import app
+from app.providers import cassette
+
+client = TestClient(app)
+
+CASSETTE = Path(__file__).resolve().parents[1] / "cassettes" / "openai_pipeline.jsonl"
+GRADE = {"answers": ["De macht is verdeeld in drie delen."]}
+
+
+@pytest.fixture(autouse=True)
+def fresh_drain():
+    drain.reset()
+    yield
+    drain.reset()
+
+
+def test_grace_period_then_cancel():
+    d = Drain(grace_seconds=0.2)
+    finished = []
+
+    async def request(name, seconds):
+        try:
+            async with d.track("grade-quiz"):
+                await anyio.sleep(seconds)
+                finished.append(name)
+        except Overloaded:
+            finished.append(f"{name}:dropped")
+
+    async def main():
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(request, "quick", 0.05)
+            tg.start_soon(request, "stuck", 10)
+            await anyio.sleep(0.01)
+            t0 = time.monotonic()
+            assert await d.shutdown() == 1
+            assert time.monotonic() - t0 < 1
+            with pytest.raises(Overloaded):
+                async with d.track("grade-quiz"):
+                    pass
+
+    anyio.run(main)
+    assert sorted(finished) == ["quick", "stuck:dropped"]
+    assert d.dropped == 1 and d.in_flight == 0
+
+
+def test_readiness_and_new_requests_during_drain(monkeypatch):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    assert client.get("/readyz").json() == {"ready": True}
+    drain.begin()
+    r = client.get("/readyz")
+    assert r.status_code == 503 and r.json()["ready"] is False
+    r = client.post("/api/llm/grade-quiz", json=GRADE)
+    assert r.status_code == 503
+    assert r.json() == {"error": "overloaded"}
+
+
+def test_lifespan_shutdown_drops_stalled_call(monkeypatch, fault_injection):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("LLM_CASSETTE_MODE", "replay")
+    monkeypatch.setenv("LLM_CASSETTE_PATH", str(CASSETTE))
+    monkeypatch.setenv("LLM_CASSETTE_LATENCY_SCALE", "0")
+    cassette.reset_cassettes()
+    fault_injection("stall=1:2,endpoints=chat.completions.create")
+    monkeypatch.setattr(drain, "grace_seconds", 0.2)
+    responses = []
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+
+            async def call():
+                responses.append(await c.post("/api/llm/grade-quiz", json=GRADE))
+
+            async with anyio.create_task_group() as tg:
+                async with app.router.lifespan_context(app):
+                    tg.start_soon(call)
+                    await anyio.sleep(0.1)
+                    assert drain.in_flight == 1
+
+    t0 = time.monotonic()
+    dropped = drain.dropped
+    anyio.run(main)
+    assert time.monotonic() - t0 < 1.5
+    assert [r.status_code for r in responses] == [503]
+    assert drain.dropped == dropped + 1
+
+
+def test_sigterm_starts_drain_and_chains():
+    seen = []
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: seen.append(signum))
+    d = Drain(grace_seconds=1)
+
+    async def main():
+        d.install_signal_handler()
+        os.kill(os.getpid(), signal.SIGTERM)
+        await anyio.sleep(0.05)
+
+    try:
+        anyio.run(main)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    assert seen == [signal.SIGTERM]
+    assert d.draining and not d.ready
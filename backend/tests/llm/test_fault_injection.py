@@ -0,0 +1,102 @@
+import statistics
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.providers import cassette
+from app.providers.faults import FaultConfig, FaultInjectingClient
+from app.routers import llm
+
+client = TestClient(app)
+
+CASSETTE = Path(__file__).resolve().parents[1] / "cassettes" / "openai_pipeline.jsonl"
+HINTS = {"topicId": "staatsinrichting", "text": "Wat is democratie?"}
+GRADE = {"answers": ["De macht is verdeeld in drie delen."]}
+
+
+@pytest.fixture(autouse=True)
+def replay_provider(monkeypatch):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("LLM_CASSETTE_MODE", "replay")
+    monkeypatch.setenv("LLM_CASSETTE_PATH", str(CASSETTE))
+    monkeypatch.setenv("LLM_CASSETTE_LATENCY_SCALE", "0")
+    monkeypatch.delenv("OPENAI_MODEL_HINTS", raising=False)
+    monkeypatch.delenv("OPENAI_MODEL_GRADE", raising=False)
+    cassette.reset_cassettes()
+
+    async def _no_backoff(sec):
+        return None
+
+    monkeypatch.setattr(llm, "_sleep_backoff", _no_backoff)
+
+
+@pytest.mark.parametrize("spec", ["rate_limit=1", "server_error=1", "timeout=1", "malformed=1", "truncated=1"])
+def test_persistent_faults_end_in_provider_error(fault_injection, spec):
+    fault_injection(spec + ",endpoints=chat.completions.create")
+    r = client.post("/api/llm/grade-quiz", json=GRADE)
+    assert r.status_code == 200
+    assert r.json()["notice"] == "provider_error"
+
+
+def test_transient_fault_is_retried(fault_injection):
+    # With seed 1 the first draw at a 50% rate fails and the second succeeds
+    probe = FaultConfig.parse("rate_limit=0.5,seed=1")
+    assert [probe.draw(), probe.draw()] == ["rate_limit", None]
+
+    fault_injection("rate_limit=0.5,seed=1,endpoints=chat.completions.create")
+    r = client.post("/api/llm/grade-quiz", json=GRADE)
+    assert r.json()["score"] == 75
+
+
+def test_injected_latency_is_applied(fault_injection):
+    fault_injection("latency=fixed:0.05,endpoints=chat.completions.create")
+    t0 = time.perf_counter()
+    r = client.post("/api/llm/generate-hints", json=HINTS)
+    assert r.json()["hints"]
+    assert time.perf_counter() - t0 >= 0.05
+
+
+def test_env_spec(monkeypatch):
+    monkeypatch.setenv("LLM_FAULTS", "malformed=1,endpoints=chat.completions.create")
+    r = client.post("/api/llm/generate-hints", json=HINTS)
+    assert r.json()["notice"] == "provider_error"
+
+
+def test_latency_distributions():
+    lognormal = FaultConfig.parse("latency=lognormal:0.2:0.5,seed=7")
+    samples = [lognormal.sample_latency() for _ in range(2000)]
+    assert 0.18 < statistics.median(samples) < 0.22
+
+    longtail = FaultConfig.parse("latency=longtail:0.1:0.1:5,seed=7")
+    samples = [longtail.sample_latency() for _ in range(2000)]
+    assert 150 < sum(1 for s in samples if s == 5) < 250
+
+    stall = FaultConfig.parse("stall=1:12")
+    assert stall.draw() == "stall" and stall.stall_seconds == 12
+
+
+def test_stall_hangs_a_stream_after_its_first_chunk():
+    class Target:
+        def create(self, stream=False, **kwargs):
+            return iter(["a", "b", "c"]) if stream else "whole"
+
+    wrapped = FaultInjectingClient(Target(), FaultConfig.parse("stall=1:0.1"))
+    t0 = time.perf_counter()
+    chunks = wrapped.create(stream=True)
+    first = next(chunks)
+    assert first == "a" and time.perf_counter() - t0 < 0.1
+    assert list(chunks) == ["b", "c"] and time.perf_counter() - t0 >= 0.1
+
+    # Without a stream the call itself hangs
+    t0 = time.perf_counter()
+    assert wrapped.create() == "whole" and time.perf_counter() - t0 >= 0.1
+
+
+def test_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        FaultConfig.parse("explode=1")
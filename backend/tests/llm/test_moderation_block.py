@@ -24,7 +24,7 @@ def test_moderation_block(monkeypatch):
     monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
 
     import sys
-    sys.modules['openai'] = types.SimpleNamespace(OpenAI=StubOpenAI)
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=StubOpenAI))
 
     r = client.post("/api/llm/generate-hints", json={"topicId": "t1", "text": "bad text"})
     assert r.status_code == 200
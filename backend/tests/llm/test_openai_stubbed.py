@@ -50,7 +50,7 @@ def test_openai_enabled_stubbed(monkeypatch):
     # monkeypatch OpenAI client
     import builtins
     import sys
-    sys.modules['openai'] = types.SimpleNamespace(OpenAI=StubOpenAI)
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=StubOpenAI))
 
     # generate-hints
     r = client.post("/api/llm/generate-hints", json={"topicId": "t1", "text": "hello"})
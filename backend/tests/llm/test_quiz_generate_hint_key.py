@@ -35,7 +35,7 @@ def test_hint_key_enabled_stub(monkeypatch):
     monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
 
     import sys
-    sys.modules['openai'] = types.SimpleNamespace(OpenAI=StubOpenAI)
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=StubOpenAI))
 
     r = client.post("/api/llm/generate-hints", json={"topicId": "t", "text": "x"})
     assert r.status_code == 200
@@ -21,4 +21,41 @@ def test_rate_limit_exceeded(monkeypatch):
         if r.status_code == 429:
             hits += 1
             break
-    assert hits == 1, f"Expected a 429 after many requests, got last status {last_status}"
\ No newline at end of file
+    assert hits == 1, f"Expected a 429 after many requests, got last status {last_status}"
+
+def test_rate_limit_headers(monkeypatch):
+    monkeypatch.delenv("LLM_ENABLED", raising=False)
+    r = client.post("/api/llm/grade-quiz", json={"answers": ["a"]})
+    assert r.headers["RateLimit-Limit"] == "60"
+    assert r.headers["RateLimit-Remaining"] == "59"
+    assert int(r.headers["RateLimit-Reset"]) >= 1
+
+    for _ in range(59):
+        client.post("/api/llm/grade-quiz", json={"answers": ["a"]})
+    r = client.post("/api/llm/grade-quiz", json={"answers": ["a"]})
+    assert r.status_code == 429
+    assert r.json() == {"error": "rate_limited"}
+    assert r.headers["RateLimit-Remaining"] == "0"
+    assert r.headers["Retry-After"] == "1"
+
+
+def test_gcra_refills_and_evicts_idle_keys():
+    from app.rate_limiter import MemoryStore, parse_rate
+
+    rate = parse_rate("2/second")
+    store = MemoryStore(sweep_interval=10)
+    assert store.hit("a", rate, 100.0).allowed
+    assert store.hit("a", rate, 100.0).allowed
+    assert not store.hit("a", rate, 100.0).allowed
+    assert store.hit("a", rate, 100.5).allowed  # one slot back after 1/rate
+    assert len(store) == 1
+    store.hit("b", rate, 200.0)  # past the sweep deadline; "a" has drained
+    assert len(store) == 1
+
+
+def test_parse_rate():
+    from app.rate_limiter import parse_rate
+
+    assert parse_rate("60/minute").interval == 1.0
+    assert parse_rate("10 per second").count == 10
+    assert parse_rate("100/5minutes").period == 300
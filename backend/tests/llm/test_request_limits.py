@@ -0,0 +1,63 @@
+import anyio
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.body_limit import BodySizeLimitMiddleware, parse_limits
+from app.main import app
+from app.models.llm import MAX_ANSWER_CHARS, MAX_ANSWERS, MAX_TEXT_CHARS
+
+client = TestClient(app)
+
+
+def test_declared_oversize_rejected_before_routing():
+    r = client.post("/api/llm/generate-hints", content=b"x" * (200 * 1024), headers={"content-type": "application/json"})
+    assert r.status_code == 413
+    assert r.json() == {"error": "payload_too_large"}
+
+
+def test_streamed_body_cut_off_at_limit():
+    reads = []
+    inner = FastAPI()
+
+    @inner.post("/upload")
+    async def upload(request: Request):
+        async for chunk in request.stream():
+            reads.append(len(chunk))
+        return {"ok": True}
+
+    limited = BodySizeLimitMiddleware(inner, default_limit=1000, route_limits={})
+
+    async def chunks():
+        for _ in range(100):
+            yield b"y" * 100
+
+    async def main():
+        transport = httpx.ASGITransport(app=limited)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            return await c.post("/upload", content=chunks())
+
+    r = anyio.run(main)
+    assert r.status_code == 413
+    assert r.json() == {"error": "payload_too_large"}
+    assert sum(reads) <= 1000
+
+
+def test_field_caps(monkeypatch):
+    monkeypatch.setenv("LLM_ENABLED", "false")
+    ok = client.post("/api/llm/grade-quiz", json={"answers": ["a"] * MAX_ANSWERS})
+    assert ok.status_code == 200
+    assert client.post("/api/llm/grade-quiz", json={"answers": ["a"] * (MAX_ANSWERS + 1)}).status_code == 422
+    assert client.post("/api/llm/grade-quiz", json={"answers": ["a" * (MAX_ANSWER_CHARS + 1)]}).status_code == 422
+    assert client.post("/api/llm/generate-hints", json={"topicId": "t", "text": "a" * (MAX_TEXT_CHARS + 1)}).status_code == 422
+
+
+def test_glossary_refresh_text_cap(monkeypatch):
+    monkeypatch.setattr("app.routers.glossary.MAX_REFRESH_CHARS", 100)
+    r = client.post("/api/glossary/refresh", json={"text": "Begrip - uitleg\n" * 10})
+    assert r.status_code == 413
+    assert client.post("/api/glossary/refresh", json={"text": "Begrip - uitleg"}).status_code == 200
+
+
+def test_parse_limits():
+    assert parse_limits("/a=10, /b=x,/c=20,bad") == {"/a": 10, "/c": 20}
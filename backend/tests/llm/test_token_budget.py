@@ -0,0 +1,147 @@
+import asyncio
+import json
+import sqlite3
+import sys
+import types
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.rate_limiter import STORE_ERRORS, MemoryStore, SQLiteStore
+from app.token_budget import TokenBudget, TokenBudgetExceeded
+from app.usage import Usage
+
+client = TestClient(app)
+
+SCOPE = {"type": "http", "path": "/api/llm/grade-quiz", "client": ("10.0.0.9", 1), "headers": []}
+
+
+class StubChatCompletions:
+    def __init__(self, prompt_tokens):
+        self.prompt_tokens = prompt_tokens
+
+    def create(self, **kwargs):
+        msg = types.SimpleNamespace(content=json.dumps({"score": 50, "feedback": []}))
+        usage = types.SimpleNamespace(prompt_tokens=self.prompt_tokens, completion_tokens=20)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)], usage=usage)
+
+
+def _stub_openai(monkeypatch, prompt_tokens):
+    class StubOpenAI:
+        def __init__(self, **kwargs):
+            self.chat = types.SimpleNamespace(completions=StubChatCompletions(prompt_tokens))
+            self.moderations = types.SimpleNamespace(create=lambda **kw: types.SimpleNamespace(results=[{"flagged": False}]))
+
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=StubOpenAI))
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.delenv("LLM_CASSETTE_MODE", raising=False)
+
+
+def test_heavy_grading_exhausts_budget_light_hints_unaffected(monkeypatch, enabled):
+    _stub_openai(monkeypatch, prompt_tokens=1500)
+    b = TokenBudget(["8000/minute"], [], store=MemoryStore())
+    monkeypatch.setattr("app.routers.llm.budget", b)
+
+    # Each grading reserves ~3.7k estimated tokens and settles at 1.52k real ones
+    answers = ["x" * 400] * 30
+    statuses = [client.post("/api/llm/grade-quiz", json={"answers": answers}).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+    r = client.post("/api/llm/grade-quiz", json={"answers": answers})
+    assert r.json() == {"error": "rate_limited"}
+    assert int(r.headers["Retry-After"]) >= 1
+
+    r = client.post("/api/llm/generate-hints", json={"topicId": "t", "text": "kort"})
+    assert r.status_code == 200
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def test_blocking_store_kept_off_the_event_loop(monkeypatch, enabled, tmp_path):
+    _stub_openai(monkeypatch, prompt_tokens=1500)
+    store = SQLiteStore(str(tmp_path / "budget.db"))
+    on_loop = []
+    for name in ("hit_many", "adjust"):
+        original = getattr(store, name)
+        monkeypatch.setattr(store, name, lambda *a, _f=original: on_loop.append(_on_event_loop()) or _f(*a))
+    monkeypatch.setattr("app.routers.llm.budget", TokenBudget(["8000/minute"], [], store=store))
+
+    # Same sequence as with the memory store, so settling still found its reservation
+    answers = ["x" * 400] * 30
+    statuses = [client.post("/api/llm/grade-quiz", json={"answers": answers}).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    assert on_loop and not any(on_loop)
+
+
+def test_store_errors_fail_open(monkeypatch, enabled, tmp_path):
+    _stub_openai(monkeypatch, prompt_tokens=10)
+    store = SQLiteStore(str(tmp_path / "budget.db"))
+
+    def broken(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "hit_many", broken)
+    monkeypatch.setattr("app.routers.llm.budget", TokenBudget(["10/minute"], [], store=store))
+    before = STORE_ERRORS.value(store="SQLiteStore")
+    assert client.post("/api/llm/grade-quiz", json={"answers": ["a"]}).status_code == 200
+    assert STORE_ERRORS.value(store="SQLiteStore") == before + 1
+
+    # A failed reconciliation is skipped, not raised
+    b = TokenBudget(["1000/minute"], [], store=MemoryStore())
+    res = b.reserve(SCOPE, "grade-quiz", 500)
+    monkeypatch.setattr(b.store, "adjust", broken)
+    res.add_usage(Usage(prompt_tokens=10, completion_tokens=0))
+    res.settle()
+    assert STORE_ERRORS.value(store="MemoryStore") >= 1
+
+
+def test_reconcile_refunds_overestimate():
+    b = TokenBudget(["1000/minute"], ["10000/minute"], store=MemoryStore())
+    b.clock = lambda: 100.0
+    res = b.reserve(SCOPE, "grade-quiz", 900)
+    with pytest.raises(TokenBudgetExceeded) as exc:
+        b.reserve(SCOPE, "grade-quiz", 900)
+    assert exc.value.scope == "key"
+
+    res.add_usage(Usage(prompt_tokens=80, completion_tokens=20))
+    res.settle()
+    # Only 100 of the 900 reserved tokens stay charged
+    assert b.reserve(SCOPE, "grade-quiz", 900) is not None
+
+
+def test_no_response_refunds_everything_and_overuse_becomes_debt():
+    b = TokenBudget(["1000/minute"], [], store=MemoryStore())
+    b.clock = lambda: 100.0
+    b.reserve(SCOPE, "grade-quiz", 1000).settle()
+    res = b.reserve(SCOPE, "grade-quiz", 500)
+    res.add_usage(Usage(prompt_tokens=1500, completion_tokens=0))
+    res.settle()
+    with pytest.raises(TokenBudgetExceeded) as exc:
+        b.reserve(SCOPE, "grade-quiz", 10)
+    assert exc.value.retry_after == pytest.approx(30.6, abs=0.1)
+
+
+def test_global_budget_is_shared():
+    b = TokenBudget([], ["1000/minute"], store=MemoryStore())
+    b.reserve(SCOPE, "generate-hints", 600)
+    other = dict(SCOPE, client=("10.9.9.9", 1))
+    with pytest.raises(TokenBudgetExceeded) as exc:
+        b.reserve(other, "generate-hints", 600)
+    assert exc.value.scope == "global"
+
+
+def test_disabled_by_default():
+    assert TokenBudget([], []).reserve(SCOPE, "grade-quiz", 10**9) is None
@@ -0,0 +1,137 @@
+import json
+import sys
+import time
+import types
+
+from fastapi.testclient import TestClient
+
+from app.admission import admission
+from app.main import app
+from app.rate_limiter import limiter, sign_student
+from app.routers.llm import _tenant_key
+from app.usage import Usage, UsageAccountant, accountant, estimate_cost, extract_usage
+
+client = TestClient(app)
+
+
+class StubChatCompletions:
+    def create(self, **kwargs):
+        msg = types.SimpleNamespace(content=json.dumps({"score": 70, "feedback": ["Ok"]}))
+        usage = types.SimpleNamespace(
+            prompt_tokens=1000,
+            completion_tokens=200,
+            prompt_tokens_details=types.SimpleNamespace(cached_tokens=400),
+        )
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)], usage=usage)
+
+
+class StubOpenAI:
+    def __init__(self, **kwargs): pass
+    @property
+    def chat(self):
+        return types.SimpleNamespace(completions=StubChatCompletions())
+    @property
+    def moderations(self):
+        return types.SimpleNamespace(create=lambda **kw: types.SimpleNamespace(results=[{"flagged": False}]))
+
+
+def test_grade_quiz_usage_is_aggregated_per_tenant(monkeypatch):
+    monkeypatch.setenv("LLM_ENABLED", "true")
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_MODEL_GRADE", "gpt-4o-mini")
+    monkeypatch.setitem(sys.modules, "openai", types.SimpleNamespace(OpenAI=StubOpenAI))
+    monkeypatch.setattr(admission, "tenant_weights", {"school-1": 2.0})
+    accountant.reset()
+
+    for _ in range(2):
+        r = client.post("/api/llm/grade-quiz", json={"answers": ["a"]}, headers={"X-Tenant-Id": "school-1"})
+        assert r.json()["score"] == 70
+
+    totals = client.get("/api/llm/usage").json()["data"]["totals"]
+    row = next(t for t in totals if t["route"] == "grade-quiz" and t["tenant"] == "school-1")
+    assert row["requests"] == 2
+    assert row["prompt_tokens"] == 2000
+    assert row["completion_tokens"] == 400
+    assert row["cached_tokens"] == 800
+    assert row["cost_usd"] > 0
+
+    text = client.get("/metrics").text
+    assert 'studiebot_llm_tokens_total{route="grade-quiz",model="gpt-4o-mini",tenant="school-1",kind="cached"}' in text
+
+
+def test_tenant_header_only_selects_configured_tenants(monkeypatch):
+    monkeypatch.setattr(admission, "tenant_weights", {"school-1": 2.0})
+    monkeypatch.setattr(limiter, "signing_key", "k")
+    scope = {"type": "http", "headers": []}
+    assert _tenant_key("school-1", scope) == "school-1"
+    assert _tenant_key("made-up-1", scope) == "default"
+    assert _tenant_key(None, scope) is None
+
+    # A signed student token names the tenant, whatever the header says
+    signed = {"type": "http", "headers": [(b"x-student-token", sign_student("s1", "school-2", "k").encode())]}
+    assert _tenant_key("school-1", signed) == "school-2"
+
+
+def test_extract_usage_responses_api_shape():
+    resp = {"usage": {"input_tokens": 10, "output_tokens": 5, "input_tokens_details": {"cached_tokens": 4}}}
+    assert extract_usage(resp) == Usage(10, 5, 4)
+    assert extract_usage(types.SimpleNamespace()) == Usage()
+
+
+def test_cost_uses_cached_price_and_snapshot_prefix():
+    prices = {"m": {"input": 1.0, "cached_input": 0.5, "output": 2.0}}
+    cost = estimate_cost("m-2024-01-01", Usage(1_000_000, 1_000_000, 500_000), prices)
+    assert cost == 0.5 + 0.25 + 2.0
+
+
+def test_flush_and_reload(tmp_path):
+    path = str(tmp_path / "usage.db")
+    acc = UsageAccountant(store_path=path, flush_seconds=0, prices={})
+    acc.record("generate-hints", "m", None, Usage(3, 2, 0))
+    assert acc.flush() is True
+    assert acc.flush() is False  # nothing changed since
+
+    again = UsageAccountant(store_path=path, flush_seconds=0, prices={})
+    assert again.snapshot()[0]["prompt_tokens"] == 3
+    assert again.since == acc.since
+
+
+def test_workers_share_store_without_double_counting(tmp_path):
+    path = str(tmp_path / "usage.db")
+    a = UsageAccountant(store_path=path, flush_seconds=0, prices={})
+    b = UsageAccountant(store_path=path, flush_seconds=0, prices={})
+    for _ in range(3):
+        a.record("grade-quiz", "m", "s1", Usage(10, 1, 0))
+        b.record("grade-quiz", "m", "s1", Usage(5, 1, 0))
+        a.flush()
+        b.flush()
+    b.record("grade-quiz", "m", "s1", Usage(1, 0, 0))  # unflushed, still reported
+
+    # A restarted worker neither reloads nor re-adds what is already stored
+    restarted = UsageAccountant(store_path=path, flush_seconds=0, prices={})
+    restarted.close()
+    for acc, requests, prompt in ((a, 6, 45), (b, 7, 46), (restarted, 6, 45)):
+        row = acc.snapshot()[0]
+        assert (row["requests"], row["prompt_tokens"]) == (requests, prompt)
+
+
+def test_flusher_restarts_with_the_next_lifespan(tmp_path, monkeypatch):
+    acc = UsageAccountant(store_path=str(tmp_path / "usage.db"), flush_seconds=0.01, prices={})
+    monkeypatch.setattr("app.main.accountant", acc)
+    for _ in range(2):
+        with TestClient(app):
+            acc.record("grade-quiz", "m", None, Usage(10, 1))
+            deadline = time.time() + 5
+            while acc._pending and time.time() < deadline:
+                time.sleep(0.01)
+            assert not acc._pending  # flushed in the background
+        assert acc._thread is None
+    assert acc.snapshot()[0]["requests"] == 2
+
+
+def test_tenant_labels_are_capped():
+    acc = UsageAccountant(prices={}, max_tenants=2)
+    for tenant in ("s1", "s2", "s3", "s4", "s1"):
+        acc.record("grade-quiz", "m", tenant, Usage(1, 0, 0))
+    assert {r["tenant"]: r["requests"] for r in acc.snapshot()} == {"s1": 2, "s2": 1, "other": 2}
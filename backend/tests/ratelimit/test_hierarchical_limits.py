@@ -0,0 +1,100 @@
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.rate_limiter import Limiter, MemoryStore, limiter, parse_route_limits, sign_student
+
+KEY = "test-signing-key"
+HINTS = "/api/llm/generate-hints"
+
+
+def _scope(path=HINTS, ip="10.0.0.1", **headers):
+    return {
+        "type": "http",
+        "path": path,
+        "client": (ip, 1234),
+        "headers": [(k.replace("_", "-").lower().encode(), v.encode()) for k, v in headers.items()],
+    }
+
+
+def _limiter(**kw):
+    kw.setdefault("signing_key", KEY)
+    return Limiter(store=MemoryStore(), **kw)
+
+
+def _allowed(lim, scope, n):
+    return sum(lim.check(scope).allowed for _ in range(n))
+
+
+def test_classroom_behind_one_nat_is_not_throttled():
+    lim = _limiter()
+    tokens = [sign_student(f"s{i}", "school-1", KEY) for i in range(30)]
+    # 30 students x 20 requests from one address: 600 > 60 per IP
+    allowed = sum(_allowed(lim, _scope(X_Student_Token=t), 20) for t in tokens)
+    assert allowed == 600
+    # A student still has a personal ceiling
+    assert _allowed(lim, _scope(X_Student_Token=tokens[0]), 60) == 40
+
+
+def test_anonymous_and_forged_tokens_share_the_ip_limit():
+    lim = _limiter()
+    forged = sign_student("s1", "school-1", "wrong-key")
+    assert _allowed(lim, _scope(X_Student_Token=forged), 100) == 60
+    assert _allowed(lim, _scope(), 10) == 0
+
+
+def test_school_aggregate_ceiling_across_addresses():
+    lim = _limiter(aggregate_limits=["100/minute"])
+    allowed = sum(
+        _allowed(lim, _scope(ip=f"10.0.0.{i}", X_Student_Token=sign_student(f"s{i}", "school-2", KEY)), 50)
+        for i in range(3)
+    )
+    assert allowed == 100
+
+
+def test_denied_tier_consumes_nothing():
+    lim = _limiter(student_limits=["5/minute"], aggregate_limits=["3/minute"])
+    a = _scope(X_Student_Token=sign_student("a", "sch", KEY))
+    b = _scope(X_Student_Token=sign_student("b", "sch", KEY))
+    assert _allowed(lim, a, 3) == 3
+    assert _allowed(lim, b, 3) == 0  # school ceiling reached
+    d = lim.check(a)
+    assert not d.allowed and d.limit == 3
+
+
+def test_global_ceiling_only_on_provider_routes():
+    lim = _limiter(global_limits=["10/minute"])
+    scopes = [_scope(ip=f"10.1.0.{i}") for i in range(20)]
+    assert sum(lim.check(s).allowed for s in scopes) == 10
+    assert lim.check(_scope(path="/api/glossary")).allowed
+
+
+def test_unsigned_ids_only_when_trusted():
+    untrusted = _limiter(signing_key=None)
+    assert untrusted.identify(_scope(X_Student_Id="s1")) is None
+    trusted = _limiter(signing_key=None, trust_client_ids=True)
+    who = trusted.identify(_scope(X_Student_Id="s1", X_School_Id="sch"))
+    assert (who.student, who.school) == ("s1", "sch")
+
+
+def test_student_token_over_http(monkeypatch):
+    monkeypatch.delenv("LLM_ENABLED", raising=False)
+    monkeypatch.setattr(limiter, "signing_key", KEY)
+    client = TestClient(app)
+    for _ in range(60):
+        client.post(HINTS, json={"topicId": "t", "text": "x"})
+    assert client.post(HINTS, json={"topicId": "t", "text": "x"}).status_code == 429
+
+    token = sign_student("s1", "school-1", KEY)
+    r = client.post(HINTS, json={"topicId": "t", "text": "x"}, headers={"X-Student-Token": token})
+    assert r.status_code == 200
+    assert r.headers["RateLimit-Remaining"] == "59"
+
+
+def test_route_limits_from_env(monkeypatch):
+    assert parse_route_limits("/a=2/minute;5/hour, /b = 1/second,kapot,/c=") == {"/a": ["2/minute", "5/hour"], "/b": ["1/second"]}
+    monkeypatch.setenv("RATE_LIMIT_DEFAULT", "100/minute")
+    monkeypatch.setenv("RATE_LIMIT_ROUTES", "/api/glossary/upload=2/minute;3/hour")
+    lim = Limiter.from_env()
+    lim.store = MemoryStore()
+    assert _allowed(lim, _scope(path="/api/glossary/upload"), 5) == 2
+    assert _allowed(lim, _scope(path="/api/glossary"), 5) == 5
@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.rate_limiter import (
+    ADJUST_LUA,
+    GCRA_LUA,
+    Limiter,
+    MemoryStore,
+    RedisStore,
+    SQLiteStore,
+    gcra,
+    parse_rate,
+    store_from_env,
+)
+
+
+def _hammer(path, n, out):
+    store = SQLiteStore(path)
+    rate = parse_rate("60/minute")
+    out.put(sum(store.hit("ip|1.2.3.4", rate, time.time()).allowed for _ in range(n)))
+
+
+def test_sqlite_limit_is_shared_across_processes(tmp_path):
+    path = str(tmp_path / "rl.db")
+    SQLiteStore(path)
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_hammer, args=(path, 30, out)) for _ in range(4)]
+    for p in procs:
+        p.start()
+    allowed = sum(out.get(timeout=60) for _ in procs)
+    for p in procs:
+        p.join(10)
+    assert allowed == 60
+
+
+def test_sqlite_state_survives_restart_and_sweeps(tmp_path):
+    path = str(tmp_path / "rl.db")
+    rate = parse_rate("2/minute")
+    store = SQLiteStore(path, sweep_interval=30)
+    assert store.hit("k", rate, 1000.0).allowed
+    assert store.hit("k", rate, 1000.0).allowed
+
+    restarted = SQLiteStore(path, sweep_interval=30)
+    assert not restarted.hit("k", rate, 1001.0).allowed
+    restarted.hit("other", rate, 2000.0)  # "k" drained long ago
+    assert len(restarted) == 1
+    plan = sqlite3.connect(path).execute("EXPLAIN QUERY PLAN DELETE FROM ratelimit WHERE tat <= 1").fetchall()
+    assert "ratelimit_tat" in str(plan)
+
+
+def test_store_errors_fail_open(tmp_path, monkeypatch):
+    from app.rate_limiter import STORE_ERRORS, limiter
+
+    class BrokenStore(SQLiteStore):
+        def hit_many(self, items, now):
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(limiter, "store", BrokenStore(str(tmp_path / "rl.db")))
+    before = STORE_ERRORS.value(store="BrokenStore")
+    r = TestClient(app).get("/api/glossary")
+    assert r.status_code == 200 and "ratelimit-remaining" not in r.headers
+    assert Limiter(store=limiter.store).check({"type": "http", "path": "/x", "headers": []}) is None
+    assert STORE_ERRORS.value(store="BrokenStore") == before + 2
+
+
+class LocalRedis:
+    """Stand-in for a Redis server: runs the GCRA script's logic in-process."""
+
+    def __init__(self):
+        self.data = {}
+
+    def register_script(self, lua):
+        if lua is ADJUST_LUA:
+            return self._adjust
+        assert lua is GCRA_LUA
+
+        def _run(keys, args):
+            now = float(args[0])
+            results = []
+            for i, key in enumerate(keys):
+                rate = parse_rate("1/second")
+                rate.interval, rate.tolerance = float(args[1 + i * 3]), float(args[2 + i * 3])
+                tat = self.data.get(key)
+                results.append(gcra(float(tat) if tat else None, now, rate, int(args[3 + i * 3])))
+            if all(new_tat is not None for _, new_tat in results):
+                for key, (_, new_tat) in zip(keys, results):
+                    self.data[key] = "%.6f" % new_tat
+            flat = []
+            for d, _ in results:
+                flat += [int(d.allowed), d.remaining, int(d.reset_after * 1e6), int(d.retry_after * 1e6)]
+            return flat
+
+        return _run
+
+    def _adjust(self, keys, args):
+        now, interval, delta = float(args[0]), float(args[1]), float(args[2])
+        tat = max(float(self.data.get(keys[0]) or now), now) + interval * delta
+        if tat <= now:
+            self.data.pop(keys[0], None)
+        else:
+            self.data[keys[0]] = "%.6f" % tat
+        return 1
+
+    def scan_iter(self, match):
+        return [k for k in list(self.data) if k.startswith(match.rstrip("*"))]
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def test_redis_store_is_consistent_across_workers():
+    server = LocalRedis()
+    workers = [RedisStore(server), RedisStore(server)]
+    rate = parse_rate("10/minute")
+    allowed = sum(workers[i % 2].hit("ip|x", rate, 500.0).allowed for i in range(30))
+    assert allowed == 10
+    d = workers[0].hit("ip|x", rate, 500.0)
+    assert not d.allowed and d.retry_after == pytest.approx(6.0)
+
+    # Multi-bucket hits are all-or-nothing on the server side too
+    other = parse_rate("100/minute")
+    decisions = workers[1].hit_many([("ip|y", other, 1), ("ip|x", rate, 1)], 500.0)
+    assert [d.allowed for d in decisions] == [True, False]
+    assert workers[0].hit("ip|y", other, 500.0).remaining == 99
+
+    workers[1].reset()
+    assert workers[0].hit("ip|x", rate, 500.0).allowed
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_REDIS_URL"), reason="set TEST_REDIS_URL to run the Lua scripts on a real Redis")
+def test_lua_scripts_on_real_redis():
+    pytest.importorskip("redis")
+    store = RedisStore.from_url(os.environ["TEST_REDIS_URL"])
+    store._prefix = f"studiebot:test:{os.getpid()}:"
+    try:
+        rate = parse_rate("10/minute")
+        now = time.time()
+        assert sum(store.hit("ip|x", rate, now).allowed for _ in range(12)) == 10
+        d = store.hit("ip|x", rate, now)
+        assert not d.allowed and d.retry_after == pytest.approx(6.0, abs=1e-3)
+
+        other = parse_rate("100/minute")
+        assert [d.allowed for d in store.hit_many([("ip|y", other, 1), ("ip|x", rate, 1)], now)] == [True, False]
+        assert store.hit("ip|y", other, now).remaining == 99
+
+        # Refund two requests, then charge one: exactly one more fits
+        store.adjust("ip|x", rate, -2, now)
+        store.adjust("ip|x", rate, 1, now)
+        assert [store.hit("ip|x", rate, now).allowed for _ in range(2)] == [True, False]
+
+        # Refunding everything deletes the key
+        store.adjust("ip|y", other, -10, now)
+        assert store._client.get(store._prefix + "ip|y") is None
+    finally:
+        store.reset()
+
+
+def test_store_from_env(monkeypatch, tmp_path):
+    monkeypatch.delenv("RATE_LIMIT_STORAGE", raising=False)
+    assert isinstance(store_from_env(), MemoryStore)
+    monkeypatch.setenv("RATE_LIMIT_STORAGE", f"sqlite:///{tmp_path}/rl.db")
+    assert isinstance(store_from_env(), SQLiteStore)
+    monkeypatch.setenv("RATE_LIMIT_STORAGE", "memcached://x")
+    with pytest.raises(ValueError):
+        store_from_env()